@@ -45,3 +45,14 @@ do
 
     popd
 done
+
+# Remove the objects of the content-addressed store no longer linked from any stage
+# (a relative SET_DEDUPSTORE is relative to the stage directories, as in 3.fourfit)
+store=${SET_DEDUPSTORE:-"../../store"}
+if [[ $store != /* ]]; then
+    store="${stages[0]}/$store"
+fi
+if [ -d "$store" ]; then
+    echo "Removing unused objects from $store..."
+    python ../share/dedup_store.py gc "$store"
+fi
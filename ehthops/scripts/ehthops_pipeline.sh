@@ -58,13 +58,17 @@ IFS=' ' read -r -a stages <<< "${config[stages]}"
 
 # Working directory name
 workdir=$(pwd)
+# the dataset path is used from the stage directories as well, so make a relative path absolute
+if [[ -n "${config[SET_ALISTDATASET]}" && "${config[SET_ALISTDATASET]}" != /* ]]; then
+    config[SET_ALISTDATASET]="$workdir/${config[SET_ALISTDATASET]}"
+fi
 
 # Check if the first stage is "1.+flags+wins" and ensure
 # some steps from 0.bootstrap is run regardless
 if [[ "${stages[0]}" == "1.+flags+wins" ]]; then
     echo "Stage 0.bootstrap not requested. Only running setup relevant to stage 1.+flags+wins..."
     cd 0.bootstrap
-    SET_SRCDIR="${config[SET_SRCDIR]}" && SET_CORRDAT="${config[SET_CORRDAT]}" && SET_METADIR="${config[SET_METADIR]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_FILTERSTRING="${config[SET_FILTERSTRING]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_HAXP="${config[SET_HAXP]}" && SET_JOBARRAY_CAP="${config[SET_JOBARRAY_CAP]}" && source bin/0.launch
+    SET_SRCDIR="${config[SET_SRCDIR]}" && SET_CORRDAT="${config[SET_CORRDAT]}" && SET_METADIR="${config[SET_METADIR]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_FILTERSTRING="${config[SET_FILTERSTRING]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_HAXP="${config[SET_HAXP]}" && SET_JOBARRAY_CAP="${config[SET_JOBARRAY_CAP]}" && SET_QAMODE="${config[SET_QAMODE]}" && SET_PYPROFILE="${config[SET_PYPROFILE]}" && SET_QUICKLOOK="${config[SET_QUICKLOOK]}" && SET_ALISTDATASET="${config[SET_ALISTDATASET]}" && source bin/0.launch
     source bin/9.next
     cd ..
 fi
@@ -80,16 +84,27 @@ do
     # Run fourfit for stages 0-5
     if [[ $stage =~ ^[0-5] ]]
     then
-        SET_SRCDIR="${config[SET_SRCDIR]}" && SET_CORRDAT="${config[SET_CORRDAT]}" && SET_METADIR="${config[SET_METADIR]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_FILTERSTRING="${config[SET_FILTERSTRING]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_HAXP="${config[SET_HAXP]}" && SET_JOBARRAY_CAP="${config[SET_JOBARRAY_CAP]}" && source bin/0.launch
+        SET_SRCDIR="${config[SET_SRCDIR]}" && SET_CORRDAT="${config[SET_CORRDAT]}" && SET_METADIR="${config[SET_METADIR]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_FILTERSTRING="${config[SET_FILTERSTRING]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_HAXP="${config[SET_HAXP]}" && SET_JOBARRAY_CAP="${config[SET_JOBARRAY_CAP]}" && SET_QAMODE="${config[SET_QAMODE]}" && SET_PYPROFILE="${config[SET_PYPROFILE]}" && SET_QUICKLOOK="${config[SET_QUICKLOOK]}" && SET_ALISTDATASET="${config[SET_ALISTDATASET]}" && source bin/0.launch
         source bin/1.version
         if ! source bin/2.link; then
             echo "ERROR: 2.link failed in stage $stage. Aborting!" >&2
             cd "$workdir"
             return 1
         fi
-        source bin/3.fourfit
+        if ! source bin/3.fourfit; then
+            echo "ERROR: 3.fourfit failed in stage $stage. Aborting!" >&2
+            cd "$workdir"
+            return 1
+        fi
         source bin/4.alists
         source bin/5.check
+        # a quick-look run (on a sample of the root files) ends with the QA of its first stage: the
+        # summary and the control files for the next stage must come from the full data
+        if [[ -n "${config[SET_QUICKLOOK]}" ]]; then
+            echo "Quick-look run: stopping after 5.check of stage $stage"
+            cd "$workdir"
+            return 0
+        fi
         source bin/6.summary
     fi
 
@@ -117,7 +132,7 @@ do
     # Run stage 6 after the 5 fringe-fitting stages; INPUTDIR is now 5.+close/data
     if [ $stage == "6.uvfits" ]
     then
-        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/5.+close/data" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && source bin/0.launch
+        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/5.+close/data" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && SET_PYPROFILE="${config[SET_PYPROFILE]}" && source bin/0.launch
         source bin/1.convert
         source bin/2.import
         source bin/3.average
@@ -127,8 +142,12 @@ do
     # Run stage 7 after the 6 uvfits stage; INPUTDIR is now 6.uvfits
     if [ $stage == "7.+apriori" ]
     then
-        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/6.uvfits" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && source bin/0.launch
-        source bin/1.antab2sefd
+        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/6.uvfits" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && SET_PYPROFILE="${config[SET_PYPROFILE]}" && source bin/0.launch
+        if ! source bin/1.antab2sefd; then
+            echo "ERROR: 1.antab2sefd failed in stage $stage. Aborting!" >&2
+            cd "$workdir"
+            return 1
+        fi
         source bin/2.applycal
         source bin/3.import
         source bin/4.average
@@ -137,7 +156,7 @@ do
     # Run stage 8 after the 7 apriori stage; INPUTDIR is now 7.+apriori
     if [ $stage == "8.+polcal" ]
     then
-        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/7.+apriori" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && source bin/0.launch
+        SET_EHTIMPATH="${config[SET_EHTIMPATH]}" && SET_INPUTDIR="$workdir/7.+apriori" && SET_METADIR="${config[SET_METADIR]}" && SET_MIXEDPOL="${config[SET_MIXEDPOL]}" && SET_OBSYEAR="${config[SET_OBSYEAR]}" && SET_CAMPAIGN="${config[SET_CAMPAIGN]}" && SET_PYPROFILE="${config[SET_PYPROFILE]}" && source bin/0.launch
         source bin/1.gainratiocal
         source bin/2.import
         source bin/3.average
@@ -153,3 +172,9 @@ do
     echo "cd up to $(pwd)"
     echo "Finished stage $stage..."
 done
+
+# Export the alists of all bands and stages into the campaign dataset (share/alistdataset.py)
+if [ -n "${config[SET_ALISTDATASET]}" ]; then
+    python "$workdir/../share/alistdataset.py" export "$workdir/.." "${config[SET_ALISTDATASET]}" > "$workdir/alistdataset.log" 2>&1 \
+        || echo "WARNING: exporting the alist dataset failed, see $workdir/alistdataset.log" >&2
+fi
@@ -7,21 +7,144 @@ from collections import OrderedDict
 from eat.io import hops, util
 from eat.hops import util as hu
 
+# one-letter HOPS station codes for the stations that need notches
+STATION_CODES = {'NOEMA': 'N'}
+
 def overlap(rstation, rzoom):
     return np.maximum(rzoom[0], rstation[0]) <= np.minimum(rzoom[1], rstation[1])
 
 def contains(rstation, rzoom):
-    return (rstation[0] <= rzoom[0]) and (rstation[1] >= rzoom[1])
+    return (rstation[0] <= rzoom[0]) & (rstation[1] >= rzoom[1])
+
+def read_freqinfo(freqfile):
+    """Read a station frequency info file once and return, for each station, its
+    LO edges sorted in ascending order and the matching bandwidths (both in MHz).
+    """
+    df = pd.read_csv(freqfile, sep=r'\s+')
+
+    freqinfo = OrderedDict()
+    for station, rows in df.groupby('station', sort=False):
+        loedge = rows.loedge_MHz.to_numpy(dtype=float)
+        bw = rows.bw_MHz.to_numpy(dtype=float)
+        # stable sort so that duplicated edges keep the first bandwidth listed in the file
+        order = np.argsort(loedge, kind='stable')
+        freqinfo[station] = (loedge[order], bw[order])
+
+    return freqinfo
+
+def compute_notches(fedge, bw, stloedge, stbw):
+    """Compute the notches for all zoom channels of one band against one station.
+
+    The zoom channels (fedge, fedge+bw) are joined to the station sub-bands by searching
+    the sorted station LO edges for the last edge below the upper edge of each zoom channel.
+    Returns a list of tuples (ch, (f_lo_notch, f_hi_notch)) in channel order.
+    """
+    f_lo_zoom = np.asarray(fedge, dtype=float)
+    bw = np.asarray(bw, dtype=float)
+    f_hi_zoom = f_lo_zoom + bw
+
+    # TODO update the following to work for band 1
+    # index of the largest station LO edge strictly below the upper edge of each zoom channel
+    idx = np.searchsorted(stloedge, f_hi_zoom, side='left') - 1
+    valid = idx >= 0
+    idx = np.searchsorted(stloedge, stloedge[np.maximum(idx, 0)], side='left')
+    f_lo_station = stloedge[idx]
+    f_hi_station = f_lo_station + stbw[idx]
+
+    rzoom = (f_lo_zoom, f_hi_zoom)
+    rstation = (f_lo_station, f_hi_station)
+    mid_zoom = f_lo_zoom + bw/2.
+
+    # if the ranges overlap, the smaller section of the zoom band must be flagged
+    flag = valid & overlap(rstation, rzoom) & ~contains(rstation, rzoom)
+    above = f_lo_station > f_lo_zoom
+    f_lo_notch = np.where(above,
+                          np.where(f_lo_station <= mid_zoom, f_lo_zoom, f_lo_station),
+                          np.where(f_hi_station > mid_zoom, f_hi_station, f_lo_zoom))
+    f_hi_notch = np.where(above,
+                          np.where(f_lo_station <= mid_zoom, f_lo_station, f_hi_zoom),
+                          np.where(f_hi_station > mid_zoom, f_hi_zoom, f_hi_station))
+
+    return [(ch, (f_lo_notch[ch], f_hi_notch[ch])) for ch in np.flatnonzero(flag)]
+
+def write_notches(fname, band, notches):
+    """Write a control file with the notches for one band. *notches* maps the station
+    name to the list of tuples returned by compute_notches().
+    """
+    with open(fname, 'w') as f:
+        f.write(f"* Ensure these settings are captured regardless of control-file concatenation order by introducing an (effectively) 'if true' statement\n")
+        f.write("if scan > 001-000000\n\n")
+        f.write(f"* Band {band}\n\n")
+
+        for station, freq_to_notch in notches.items():
+            f.write(f"if station {STATION_CODES[station]}\n")
+
+            cmdflag = True
+            for tup in freq_to_notch:
+                if cmdflag:
+                    f.write(f"  notches {tup[1][0]:.6f} {tup[1][1]:.6f}\n")
+                    cmdflag = False
+                else:
+                    f.write(f"          {tup[1][0]:.6f} {tup[1][1]:.6f}\n")
+
+def run_batch(jobs, stations=None):
+    """Write the notches control files for all (band, fringefile, freqfile, outdir) jobs,
+    reading every fringe file and frequency info file only once.
+    """
+    params = {}
+    freqinfos = {}
+    for (band, fringefile, freqfile, outdir) in jobs:
+        if fringefile not in params:
+            params[fringefile] = hu.params(fringefile)
+        if freqfile not in freqinfos:
+            freqinfos[freqfile] = read_freqinfo(freqfile)
+        p = params[fringefile]
+        freqinfo = freqinfos[freqfile]
+
+        notches = OrderedDict()
+        for station in (stations or freqinfo.keys()):
+            if station not in STATION_CODES:
+                print(f"No notches necessary for non-NOEMA station {station}! Skipping.")
+                continue
+            if station not in freqinfo:
+                print(f"Station {station} not found in {freqfile}! Skipping.")
+                continue
+            notches[station] = compute_notches(p.fedge, p.bw, *freqinfo[station])
+
+        os.makedirs(outdir, exist_ok=True)
+        fname = os.path.join(outdir, f'cf1_b{band}_notches')
+        write_notches(fname, band, notches)
+        print(f"{fname}: {sum(len(n) for n in notches.values())} notches for {', '.join(notches.keys()) or 'no stations'}")
 
 def main():
     parser = argparse.ArgumentParser(description='Program to create a HOPS control file with notches')
-    parser.add_argument('band', type=int, choices=[1,2,3,4], help='frequency band')
-    parser.add_argument('fringefile', type=str, help='path to a non-NOEMA baseline fringe file for extracting zoom band information for the given band')
-    parser.add_argument('freqfile', type=str, help='path to station frequency info file')
-    parser.add_argument('station', type=str, help='station name to compute notches for (e.g. "NOEMA")')
+    parser.add_argument('band', type=int, nargs='?', choices=[1,2,3,4], help='frequency band')
+    parser.add_argument('fringefile', type=str, nargs='?', help='path to a non-NOEMA baseline fringe file for extracting zoom band information for the given band')
+    parser.add_argument('freqfile', type=str, nargs='?', help='path to station frequency info file')
+    parser.add_argument('station', type=str, nargs='?', help='station name to compute notches for (e.g. "NOEMA")')
+    parser.add_argument('-j', '--job', nargs=4, action='append', metavar=('BAND', 'FRINGEFILE', 'FREQFILE', 'OUTDIR'),
+                        help='batch mode: write OUTDIR/cf1_bBAND_notches using the zoom bands in FRINGEFILE and the station '
+                             'frequencies in FREQFILE; repeat for every band/campaign configuration to generate in one run')
+    parser.add_argument('-s', '--stations', nargs='+', help='batch mode: stations to compute notches for (default: all stations in FREQFILE)')
 
     args = parser.parse_args()
 
+    if args.job:
+        jobs = []
+        for (band, fringefile, freqfile, outdir) in args.job:
+            if band not in ('1', '2', '3', '4'):
+                parser.error(f"invalid band {band} in --job (choose from 1, 2, 3, 4)")
+            for fname in (fringefile, freqfile):
+                if not os.path.exists(fname):
+                    print(f"{fname} does not exist! Exiting.")
+                    sys.exit(1)
+            jobs.append((int(band), fringefile, freqfile, outdir))
+        run_batch(jobs, args.stations)
+        return
+
+    if None in (args.band, args.fringefile, args.freqfile, args.station):
+        parser.error("band, fringefile, freqfile and station are required unless --job is given")
+
     # get zoom band info
     try:
         p = hu.params(args.fringefile)
@@ -31,75 +154,24 @@ def main():
 
     # get station freq info (e.g. for NOEMA)
     try:
-        df = pd.read_csv(args.freqfile, delim_whitespace=True)
+        freqinfo = read_freqinfo(args.freqfile)
     except FileNotFoundError:
         print(f"{args.freqfile} does not exist! Exiting.")
         sys.exit(1)
 
-    # get only the rows corresponding to given station
-    df = df[df['station'] == args.station]
+    if args.station not in STATION_CODES:
+        print("No notches necessary for non-NOEMA stations! Exiting.")
+        sys.exit(1)
 
     # compute where phase jumps occur in zoom bands for NOEMA baselines
-    freq_to_notch = [] # list of tuples to notch
-    notchdict = OrderedDict()
-
-    nchan = p.fedge.shape[0]
-    for ch in range(nchan):
-        f_lo_zoom = p.fedge[ch]
-        f_hi_zoom = p.fedge[ch]+p.bw[ch]
-
-        # TODO update the following to work for band 1
-        stfreqs = [n for n in df.loedge_MHz if n < f_lo_zoom or n < f_hi_zoom]
-        if not stfreqs:
-            continue
-        f_lo_station = max(stfreqs)
-        f_hi_station = f_lo_station + df.bw_MHz[df.loedge_MHz == f_lo_station].to_numpy()[0]
-
-        rzoom = (f_lo_zoom, f_hi_zoom)
-        rstation = (f_lo_station, f_hi_station)
-
-        # if the ranges overlap, the smaller section of the zoom band must be flagged
-        if overlap(rstation, rzoom) and not contains(rstation, rzoom):
-            if rstation[0] > rzoom[0]:
-                if rstation[0] <= rzoom[0]+(p.bw[ch]/2.):
-                    freq_to_notch.append((ch, (rzoom[0], rstation[0])))
-                    notchdict[ch] = (rzoom[0], rstation[0])
-                else:
-                    freq_to_notch.append((ch, (rstation[0], rzoom[1])))
-                    notchdict[ch] = (rstation[0], rzoom[1])
-            else:
-                if rstation[1] > rzoom[0]+(p.bw[ch]/2.):
-                    freq_to_notch.append((ch, (rstation[1], rzoom[1])))
-                    notchdict[ch] = (rstation[1], rzoom[1])
-                else:
-                    freq_to_notch.append((ch, (rzoom[0], rstation[1])))
-                    notchdict[ch] = (rzoom[0], rstation[1])
+    freq_to_notch = compute_notches(p.fedge, p.bw, *freqinfo[args.station]) if args.station in freqinfo else []
+    notchdict = OrderedDict(freq_to_notch)
 
     for k in notchdict.keys():
         print(f"notchdict[{k}] = {notchdict[k]}")
 
     # create control file with notches
-    #for tup in freq_to_notch:
-    #    print(tup)
-    with open(f'cf1_b{args.band}_notches', 'w') as f:
-        f.write(f"* Ensure these settings are captured regardless of control-file concatenation order by introducing an (effectively) 'if true' statement\n")
-        f.write("if scan > 001-000000\n\n")
-        f.write(f"* Band {args.band}\n\n")
-
-        if args.station == "NOEMA":
-            f.write("if station N\n")
-        else:
-            print("No notches necessary for non-NOEMA stations! Exiting.")
-            sys.exit(1)
-
-        cmdflag = True
-        for tup in freq_to_notch:
-            if cmdflag:
-                f.write(f"  notches {tup[1][0]:.6f} {tup[1][1]:.6f}\n")
-                cmdflag = False
-            else:
-                f.write(f"          {tup[1][0]:.6f} {tup[1][1]:.6f}\n")
+    write_notches(f'cf1_b{args.band}_notches', args.band, OrderedDict([(args.station, freq_to_notch)]))
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+#
+# Usage: alist_scan.sh CACHEDIR SCAN
+#
+# Build the alists of one scan directory DATADIR/SCAN (SCAN is <expt_no>/<scan>):
+# writes CACHEDIR/<expt_no>.<scan>.v6 and its 30s, 8s, 4s and 2s fringex
+# segmented alists, then a .done stamp that 4.alists uses to detect later
+# changes to the scan directory. Used by 4.alists and share/stream_alists.py.
+
+_frag="$1/${2//\//.}"
+rm -f "$_frag".*
+alist -v6 -o "$_frag.v6" "$DATADIR/$2" || exit 1
+for _i in 30 8 4 2; do
+    fringex -i$_i -r "$_frag.v6" > "$_frag.v6.${_i}s" || exit 1
+done
+touch "$_frag.done"
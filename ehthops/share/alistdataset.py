@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Campaign-wide Parquet dataset of the alists of all bands and stages.
+
+``export`` reads the baseline alists (alist.v6, alist.v6.<n>s and their .avg versions, plain or
+compressed) of every hops-b<n>/<stage>/data directory of a campaign and writes them into one
+Hive-partitioned Parquet dataset:
+
+    OUTDIR/band=b1/stage=2.+pcal/resolution=30s/expt_no=3600/part-0.parquet
+
+The resolution is 'scan' for alist.v6, '<n>s' for the fringex segmented alists and '<n>s.avg'
+for their scan averages. The export is incremental: OUTDIR/_manifest.json records the size and
+modification time of every exported alist, and only the partitions of new or changed alists are
+written again (those of alists that disappeared are removed). Closure (.close) alists have a
+different schema and are not exported.
+
+query() reads the dataset with partition pruning and column projection, so that e.g. comparing
+the b1 and b4 delays of one stage reads only these two bands of that stage:
+
+    df = query(dataset, columns=['baseline', 'scan_id', 'mbdelay'], band=['b1', 'b4'],
+               stage='3.+adhoc', resolution='scan', filters=[('snr', '>', 7)])
+
+    alistdataset.py export $TOPDIR/.. ../alists.parquet        # TOPDIR/.. holds hops-b1 ... hops-b4
+
+Requires pyarrow.
+"""
+import os
+import re
+import glob
+import json
+import shutil
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = ['band', 'stage', 'resolution', 'expt_no']
+ALIST_PATTERN = re.compile(r'^alist\.v6(?:\.(\d+s))?(\.avg)?(?:\.gz|\.zst)?$')
+MANIFEST = '_manifest.json'
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("the pyarrow package is required for the alist dataset (pip install pyarrow)")
+    return pyarrow
+
+def resolution(name):
+    """Resolution label of an alist file name, None for files that are not exported."""
+    m = ALIST_PATTERN.match(name)
+    if m is None:
+        return None
+    (seg, avg) = m.groups()
+    return (seg or 'scan') + ('.avg' if avg else '')
+
+def discover(topdir):
+    """{relative path: (band, stage, resolution)} of the alists of the hops-b<n> trees in *topdir*."""
+    alists = {}
+    for path in sorted(glob.glob(os.path.join(topdir, 'hops-b*', '*', 'data', 'alist.v6*'))):
+        res = resolution(os.path.basename(path))
+        if res is None:
+            continue
+        parts = os.path.relpath(path, topdir).split(os.sep)
+        alists[os.path.relpath(path, topdir)] = (parts[0][len('hops-'):], parts[1], res)
+    # the plain alist wins over a compressed copy of the same file
+    for (rel, key) in list(alists.items()):
+        if rel.endswith(('.gz', '.zst')) and rel.rsplit('.', 1)[0] in alists:
+            del alists[rel]
+    return alists
+
+def partition_dir(outdir, band, stage, res):
+    return os.path.join(outdir, f'band={band}', f'stage={stage}', f'resolution={res}')
+
+def export_alist(topdir, rel, band, stage, res, outdir):
+    """Write the partitions of one alist; returns the number of records."""
+    pa = _pyarrow()
+    import alistio
+    df = alistio.read_alist(os.path.join(topdir, os.path.dirname(rel)), os.path.basename(rel))
+    # partitions are written to a hidden directory (ignored by readers) and swapped in at the end
+    final = partition_dir(outdir, band, stage, res)
+    tmp = os.path.join(outdir, f'.{band}.{stage}.{res}.{os.getpid()}')
+    shutil.rmtree(tmp, ignore_errors=True)
+    for (expt, group) in df.groupby('expt_no', sort=True):
+        edir = os.path.join(tmp, f'expt_no={expt}')
+        os.makedirs(edir)
+        table = pa.Table.from_pandas(group.drop(columns=[c for c in PARTITIONS if c in group]), preserve_index=False)
+        pa.parquet.write_table(table, os.path.join(edir, 'part-0.parquet'))
+    shutil.rmtree(final, ignore_errors=True)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    if os.path.isdir(tmp):
+        os.replace(tmp, final)
+    return len(df)
+
+def _work(args):
+    return export_alist(*args)
+
+def export(topdir, outdir, bands=None, nproc=None):
+    """Export the new and changed alists of *topdir* into the dataset *outdir*."""
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    alists = discover(topdir)
+    if bands:
+        alists = {rel: key for (rel, key) in alists.items() if key[0] in bands}
+    current = {}
+    for rel in alists:
+        st = os.stat(os.path.join(topdir, rel))
+        current[rel] = [st.st_size, st.st_mtime_ns]
+    todo = [rel for rel in alists if manifest.get(rel, {}).get('stat') != current[rel]]
+
+    # alists that are gone (when exporting all bands, or from the selected bands)
+    for (rel, entry) in list(manifest.items()):
+        if rel not in alists and (not bands or entry['key'][0] in bands):
+            shutil.rmtree(partition_dir(outdir, *entry['key']), ignore_errors=True)
+            del manifest[rel]
+
+    with ProcessPoolExecutor(max_workers=max(1, nproc or os.cpu_count() or 1)) as pool:
+        futures = {rel: pool.submit(_work, (topdir, rel) + alists[rel] + (outdir,)) for rel in todo}
+        for (rel, fut) in futures.items():
+            try:
+                n = fut.result()
+            except Exception as e:
+                logger.error(f"{rel} not exported: {e}")
+                manifest.pop(rel, None)
+                continue
+            manifest[rel] = {'stat': current[rel], 'key': list(alists[rel]), 'records': n}
+            logger.info(f"{rel}: {n} records")
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
+    logger.info(f"Exported {len(todo)} of {len(alists)} alists into {outdir}")
+
+def _toiter(x):
+    return list(x) if isinstance(x, (list, tuple, set)) else [x]
+
+def query(dataset, columns=None, band=None, stage=None, resolution=None, expt_no=None, filters=None):
+    """Pandas frame of the records of the alist *dataset* in the given partitions (each a value
+    or a list of values, None for all) satisfying *filters* (a list of (column, op, value)
+    tuples as in pandas.read_parquet). Only the partitions selected are opened, and only the
+    given *columns* (plus the partition columns) are read."""
+    _pyarrow()
+    import pandas as pd
+    preds = []
+    for (col, val) in zip(PARTITIONS, (band, stage, resolution, expt_no)):
+        if val is not None:
+            preds.append((col, 'in', [int(v) for v in _toiter(val)] if col == 'expt_no' else [str(v) for v in _toiter(val)]))
+    preds += list(filters or [])
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + PARTITIONS))
+    df = pd.read_parquet(dataset, engine='pyarrow', columns=columns, filters=preds or None)
+    for c in PARTITIONS[:-1]:
+        if c in df:
+            df[c] = df[c].astype(str)
+    if 'expt_no' in df:
+        df['expt_no'] = df['expt_no'].astype(int)
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the alists of all bands and stages into a partitioned Parquet dataset')
+    parser.add_argument('command', choices=['export'], help='export new and changed alists')
+    parser.add_argument('topdir', help='directory holding the hops-b<n> trees')
+    parser.add_argument('outdir', help='dataset directory')
+    parser.add_argument('-b', '--band', type=str, nargs='+', default=None, help='bands to export (default: all)')
+    parser.add_argument('-n', '--nproc', type=int, default=None, help='number of alists exported concurrently')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    export(args.topdir, args.outdir, args.band, args.nproc)
+
+if __name__ == '__main__':
+    main()
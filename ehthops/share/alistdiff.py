@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Compare the alists of two or more stages, one expt_no at a time.
+
+The records of every stage are joined on (expt_no, scan_id, baseline, polarization) and the
+changes of snr, amp, resid_phas, sbdelay, mbdelay and delay_rate between consecutive stages are
+written per key, together with a summary per expt_no, station and pair of stages (number of
+keys found in both, only in the earlier or only in the later stage, median changes and median
+snr ratio).
+
+The alists are not parsed into full frames: the records of one expt_no at a time are read (through
+the frame index of seekable .zst alists, or through an index of the byte ranges of every expt_no
+built in one pass over plain text alists), only the needed columns are parsed, and the keys of
+all stages are merged into one sorted array on which the values of every stage are scattered,
+so the memory used is bounded by the largest expt_no. A key appearing several times in one stage
+(fringe files made again) is represented by its last record.
+
+    alistdiff.py hops-b1/2.+pcal/data/alist.v6 hops-b1/3.+adhoc/data/alist.v6 -o diff.tsv -s summary.tsv
+    alistdiff.py pcal=... adhoc=... delays=... --expt 3600 3601
+"""
+import io
+import os
+import re
+import gzip
+import shutil
+import argparse
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import alistzst
+from alistschema import has_station
+
+logger = logging.getLogger(__name__)
+
+# positions of the fields used here in the whitespace separated alist v6 records
+FIELDS = {
+    'root_id': 1, 'expt_no': 7, 'scan_id': 8, 'timetag': 11, 'source': 13, 'baseline': 14, 'freq_code': 16,
+    'polarization': 17, 'amp': 19, 'snr': 20, 'resid_phas': 21, 'sbdelay': 24, 'mbdelay': 25, 'delay_rate': 27,
+}
+KEYS = ['scan_id', 'baseline', 'polarization']
+QUANTITIES = ['snr', 'amp', 'resid_phas', 'sbdelay', 'mbdelay', 'delay_rate']
+# quantities compared modulo 360 degrees
+PHASES = {'resid_phas'}
+
+class Stage:
+    """Alist of one stage, read one expt_no at a time."""
+
+    def __init__(self, label, path, tmpdir):
+        (self.label, self.path) = (label, path)
+        if path.endswith('.zst'):
+            self.runs = None
+            self.expts = sorted({fr['expt_no'] for fr in alistzst.read_index(path) if fr['expt_no'] is not None})
+            return
+        if path.endswith('.gz'):
+            # random access needs the plain text
+            (fd, plain) = tempfile.mkstemp(suffix='.alist', dir=tmpdir)
+            with gzip.open(path, 'rb') as f, os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(f, out, 1 << 20)
+            self.path = plain
+        self.runs = self._index(self.path)
+        self.expts = sorted(self.runs)
+
+    @staticmethod
+    def _index(path):
+        """{expt_no: [(offset, length), ...]} of the byte ranges of the records of every expt_no."""
+        runs = {}
+        (offset, expt, start) = (0, None, 0)
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.startswith(b'*') and line.strip():
+                    e = int(line.split(None, FIELDS['expt_no'] + 1)[FIELDS['expt_no']])
+                    if e != expt:
+                        if expt is not None:
+                            runs.setdefault(expt, []).append((start, offset - start))
+                        (expt, start) = (e, offset)
+                elif expt is not None:
+                    runs.setdefault(expt, []).append((start, offset - start))
+                    expt = None
+                offset += len(line)
+        if expt is not None:
+            runs.setdefault(expt, []).append((start, offset - start))
+        return runs
+
+    def text(self, expt):
+        if self.runs is None:
+            text = alistzst.read_text(self.path, expt_no=expt)
+            return ''.join(l for l in text.splitlines(True) if not l.startswith('*'))
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return b''.join(os.pread(fd, n, o) for (o, n) in self.runs.get(expt, [])).decode()
+        finally:
+            os.close(fd)
+
+    def read(self, expt, keys):
+        """Frame of the key and value columns of the records of *expt*."""
+        cols = list(dict.fromkeys(keys + QUANTITIES))
+        text = self.text(expt)
+        if not text:
+            return pd.DataFrame({c: pd.Series(dtype=object if c in keys else float) for c in cols})
+        usecols = sorted(FIELDS[c] for c in cols)
+        names = {FIELDS[c]: c for c in cols}
+        df = pd.read_csv(io.StringIO(text), sep=r'\s+', header=None, usecols=usecols,
+                         dtype={FIELDS[c]: str for c in keys})
+        return df.rename(columns=names)[cols]
+
+def keystrings(df, keys):
+    key = df[keys[0]].astype(str)
+    for c in keys[1:]:
+        key = key + ' ' + df[c].astype(str)
+    return key.to_numpy(dtype=str)
+
+def diff_expt(stages, expt, keys, pool):
+    """(per key table, per station summary) of one expt_no."""
+    frames = list(pool.map(lambda s: s.read(expt, keys), stages))
+    ks = [keystrings(df, keys) for df in frames]
+    # sorted union of the keys; inverse maps every record to its position in the union
+    (union, inverse) = np.unique(np.concatenate(ks), return_inverse=True)
+    bounds = np.cumsum([0] + [len(k) for k in ks])
+    present = np.zeros((len(stages), len(union)), dtype=bool)
+    values = {q: np.full((len(stages), len(union)), np.nan) for q in QUANTITIES}
+    first = np.full(len(union), -1)
+    for (i, df) in enumerate(frames):
+        pos = inverse[bounds[i]:bounds[i + 1]]
+        # last record of every key of the stage
+        (upos, rev) = np.unique(pos[::-1], return_index=True)
+        last = len(pos) - 1 - rev
+        present[i, upos] = True
+        for q in QUANTITIES:
+            values[q][i, upos] = df[q].to_numpy(dtype=float)[last]
+        # representative record for the key columns
+        sel = first[upos] < 0
+        first[upos[sel]] = bounds[i] + last[sel]
+    allkeys = pd.concat([df[keys] for df in frames], ignore_index=True).iloc[first].reset_index(drop=True)
+
+    out = allkeys.copy()
+    out.insert(0, 'expt_no', expt)
+    for (i, stage) in enumerate(stages):
+        out[f'in_{stage.label}'] = present[i]
+    for q in QUANTITIES:
+        out[f'{q}_{stages[0].label}'] = values[q][0]
+    summary = []
+    sites = sorted(set(''.join(out['baseline'].astype(str).unique())))
+    masks = {site: has_station(out, site).to_numpy() for site in sites}
+    for i in range(1, len(stages)):
+        pair = f'{stages[i].label}-{stages[i - 1].label}'
+        deltas = {}
+        for q in QUANTITIES:
+            d = values[q][i] - values[q][i - 1]
+            if q in PHASES:
+                d = (d + 180.0) % 360.0 - 180.0
+            deltas[q] = d
+            out[f'd{q}_{pair}'] = d
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = values['snr'][i] / values['snr'][i - 1]
+        (a, b) = (present[i - 1], present[i])
+        for site in sites:
+            m = masks[site]
+            both = m & a & b
+            row = {'expt_no': expt, 'station': site, 'stages': pair, 'both': int(both.sum()),
+                   'only_earlier': int((m & a & ~b).sum()), 'only_later': int((m & ~a & b).sum()),
+                   'snr_ratio': float(np.nanmedian(ratio[both])) if both.any() else np.nan}
+            for q in QUANTITIES:
+                row[f'd{q}'] = float(np.nanmedian(deltas[q][both])) if both.any() else np.nan
+            summary.append(row)
+    return (out, summary)
+
+def stage_label(path):
+    """Stage directory of an alist path (e.g. 2.+pcal), or the file name."""
+    for part in reversed(os.path.normpath(os.path.abspath(path)).split(os.sep)):
+        if re.match(r'^\d+\.', part):
+            return part
+    return os.path.basename(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the alists of two or more stages')
+    parser.add_argument('alists', nargs='+', help='alists in stage order, optionally as LABEL=PATH (plain, .gz or seekable .zst)')
+    parser.add_argument('-o', '--output', type=str, default='alistdiff.tsv', help='per key table')
+    parser.add_argument('-s', '--summary', type=str, default='alistdiff_summary.tsv', help='per expt_no and station summary')
+    parser.add_argument('-e', '--expt', type=int, nargs='+', default=None, help='expt_nos to compare (default: all)')
+    parser.add_argument('-k', '--key', type=str, nargs='*', default=[], choices=[c for c in FIELDS if c not in QUANTITIES + KEYS + ['expt_no']],
+                        help='additional key fields')
+    parser.add_argument('-n', '--nproc', type=int, default=None, help='number of alists read concurrently')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+    if len(args.alists) < 2:
+        parser.error("at least two alists are needed")
+
+    keys = KEYS + args.key
+    with tempfile.TemporaryDirectory(prefix='alistdiff.') as tmpdir, \
+            ThreadPoolExecutor(max_workers=args.nproc or len(args.alists)) as pool:
+        specs = [a.split('=', 1) if '=' in a else (stage_label(a), a) for a in args.alists]
+        labels = [label for (label, _) in specs]
+        if len(set(labels)) != len(labels):
+            parser.error(f"stage labels are not unique ({' '.join(labels)}), use LABEL=PATH")
+        stages = list(pool.map(lambda s: Stage(s[0], s[1], tmpdir), specs))
+        expts = sorted(set().union(*(s.expts for s in stages)))
+        if args.expt is not None:
+            expts = [e for e in expts if e in set(args.expt)]
+
+        summary = []
+        header = True
+        for expt in expts:
+            (out, summ) = diff_expt(stages, expt, keys, pool)
+            out.to_csv(args.output, sep='\t', index=False, header=header, mode='w' if header else 'a', float_format='%.6g')
+            header = False
+            summary += summ
+            logger.info(f"expt_no {expt}: {len(out)} keys")
+    pd.DataFrame(summary).to_csv(args.summary, sep='\t', index=False, float_format='%.6g')
+    logger.info(f"Compared {len(stages)} alists on {len(expts)} expt_nos -> {args.output}, {args.summary}")
+
+if __name__ == '__main__':
+    main()
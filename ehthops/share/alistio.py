@@ -0,0 +1,71 @@
+"""Loading of alist files for the summary notebooks.
+
+The notebooks read their alists through read_alist() and read_tlist() instead of calling
+eat.io.hops directly. When the notebooks are executed by run_notebooks.py, the alists are
+parsed once in the parent process with preload() and handed to every forked notebook process,
+which then shares the parsed frames copy-on-write instead of parsing the text files again.
+
+Seekable compressed alists (*.zst, see alistzst) are decompressed in parallel, and only the
+frames of the requested expt_nos/scans are read when read_alist() is given a selection.
+
+Analyses across bands and stages read the campaign dataset written by alistdataset.py through
+query_dataset(), which opens only the partitions selected.
+"""
+import os
+from eat.io import hops
+
+import alistzst
+
+# frames parsed ahead of time by preload(), keyed by (kind, absolute path)
+_preloaded = {}
+
+def _path(datadir, alistf):
+    return os.path.abspath(os.path.join(datadir or os.environ['DATADIR'], alistf))
+
+def _read(kind, path):
+    if path.endswith('.zst'):
+        return alistzst.read_alist(path)
+    if kind == 'tlist':
+        return hops.read_tlist_v6(path)
+    return hops.read_alist(path)
+
+def kind_of(alistf):
+    """Closure (triangle) files are read with read_tlist_v6, everything else with read_alist."""
+    return 'tlist' if '.close' in alistf else 'alist'
+
+def preload(datadir, alistfs):
+    """Parse the given alist files and keep them for the next read_alist/read_tlist call."""
+    for alistf in alistfs:
+        path = _path(datadir, alistf)
+        if os.path.isfile(path):
+            key = (kind_of(alistf), path)
+            _preloaded[key] = _read(*key)
+
+def _load(kind, datadir, alistf):
+    path = _path(datadir, alistf)
+    # a preloaded frame is handed out only once so that re-running a cell re-reads the file
+    # instead of returning a frame that was already modified in place by the notebook
+    df = _preloaded.pop((kind, path), None)
+    if df is None:
+        df = _read(kind, path)
+    return df
+
+def read_alist(datadir, alistf, expt_no=None, scans=None):
+    """Read the alist file *alistf* from *datadir* (default: $DATADIR), only the given expt_nos
+    and/or scans for seekable compressed (.zst) alists."""
+    if alistf.endswith('.zst') and (expt_no is not None or scans is not None):
+        return alistzst.read_alist(_path(datadir, alistf), expt_no, scans)
+    return _load('alist', datadir, alistf)
+
+def read_tlist(datadir, alistf):
+    """Read the closure (triangle) alist file *alistf* from *datadir* (default: $DATADIR)."""
+    return _load('tlist', datadir, alistf)
+
+def query_dataset(dataset=None, **selection):
+    """Records of the campaign alist dataset *dataset* (default: $ALISTDATASET), see
+    alistdataset.query for the selection arguments."""
+    import alistdataset
+    dataset = dataset or os.environ.get('ALISTDATASET')
+    if not dataset:
+        raise ValueError('no alist dataset given and ALISTDATASET is not set (SET_ALISTDATASET in 0.launch)')
+    return alistdataset.query(dataset, **selection)
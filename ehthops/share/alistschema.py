@@ -0,0 +1,79 @@
+"""Compact in-memory schema for alist frames.
+
+compact() converts the string columns of an alist frame (baseline, source, polarization, scan_id,
+triangle, ...) to categoricals, down-casts the integer columns and the float columns that do not
+need double precision, and adds a 'stations' bitmask column with one bit per station of the
+baseline or triangle. Station filters then become integer operations on that column instead of
+string scans (see has_station).
+
+compact() is applied after the eat pre-processing (util.fix, util.add_scanno, ...), which assigns
+new strings to some of these columns. Grouping on categorical columns must use observed=True;
+frames handed to eat functions that group internally are converted back with expand().
+"""
+import string
+
+import numpy as np
+import pandas as pd
+
+# string columns stored as categoricals when present
+CATEGORICAL_COLUMNS = ['baseline', 'triangle', 'source', 'polarization', 'scan_id', 'timetag', 'root_id', 'quality']
+# float columns for which single precision is enough (delays, rates, times and (u, v) stay double)
+FLOAT32_COLUMNS = ['snr', 'amp', 'resid_phas', 'bis_snr', 'bis_amp', 'bis_phas', 'ref_elev', 'rem_elev', 'ref_az', 'rem_az']
+# one bit per single character station code
+STATION_CHARS = string.ascii_letters + string.digits
+
+def station_bits(sites):
+    """Bitmask of the stations in *sites* (a string of station codes)."""
+    bits = 0
+    for site in sites:
+        bits |= 1 << STATION_CHARS.index(site)
+    return bits
+
+def _stations(col):
+    """Station bitmask of every row of a baseline or triangle column."""
+    col = col.astype('category') if not isinstance(col.dtype, pd.CategoricalDtype) else col
+    bits = np.array([station_bits(v) for v in col.cat.categories] + [0], dtype=np.int64)
+    return bits[col.cat.codes.to_numpy()]
+
+def compact(df):
+    """Return *df* with the compact schema applied (see module docstring)."""
+    df = df.copy()
+    for c in CATEGORICAL_COLUMNS:
+        if c in df and pd.api.types.is_string_dtype(df[c].dtype) and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype('category')
+    for c in FLOAT32_COLUMNS:
+        if c in df and df[c].dtype == np.float64:
+            df[c] = df[c].astype(np.float32)
+    for c in df.columns:
+        if df[c].dtype == np.int64 and len(df) and np.iinfo(np.int32).min <= df[c].min() and df[c].max() <= np.iinfo(np.int32).max:
+            df[c] = df[c].astype(np.int32)
+    return add_stations(df)
+
+def add_stations(df):
+    """Set the 'stations' bitmask column of *df* from its baseline (or triangle) column, in place.
+
+    Aggregations such as groupby().mean() turn the bitmask into floats or drop it, so frames
+    derived that way get it again from this function."""
+    for c in ('baseline', 'triangle'):
+        if c in df:
+            df['stations'] = _stations(df[c])
+            break
+    return df
+
+def expand(df):
+    """Return *df* with the categorical columns converted back to strings (for eat functions)."""
+    cats = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    return df.astype({c: object for c in cats}) if cats else df
+
+def has_station(df, sites, col='baseline'):
+    """Boolean mask of the rows of *df* whose baseline (or triangle) contains any of *sites*.
+
+    Uses the 'stations' bitmask of compacted frames (when it is still an integer column),
+    otherwise evaluates the string test once per distinct value of *col*.
+    """
+    if 'stations' in df and pd.api.types.is_integer_dtype(df.stations.dtype):
+        return pd.Series((df.stations.to_numpy() & station_bits(sites)) != 0, index=df.index)
+    (codes, uniq) = pd.factorize(df[col], sort=False)
+    hit = np.array([any(s in v for s in sites) for v in uniq], dtype=bool)
+    # factorize marks missing values with -1, which never match
+    return pd.Series(np.append(hit, False)[codes], index=df.index)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""Seekable zstd compression of the high time resolution (4s, 2s) alists.
+
+A compressed alist is a sequence of independent zstd frames: the header lines, then the records
+cut at scan boundaries into frames of at least --frame-size bytes (never mixing expt_nos),
+followed by an index of the frames (offset, sizes, expt_no and scan_ids) stored in a zstd
+skippable frame at the end of the file. ``zstd -dc`` therefore still decompresses the whole
+alist, while the readers here look up the index and decompress only the frames of the
+requested expt_nos/scans, in parallel threads.
+
+    alistzst.py compress alist.v6.2s                      # -> alist.v6.2s.zst
+    alistzst.py cat alist.v6.2s.zst --expt 3600 3601      # header + records of these expt_nos
+    alistzst.py cat alist.v6.2s.zst --scan 095-0125       # ... or of these scans
+
+Requires the zstandard package; 4.alists falls back to gzip when it is not installed.
+"""
+import os
+import sys
+import json
+import struct
+import argparse
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# positions of expt_no and scan_id in the whitespace separated fields of the alist records
+EXPT_FIELD = 7
+SCAN_FIELD = 8
+# skippable frame holding the index, and the tag ending the file
+SKIPPABLE_MAGIC = 0x184D2A5A
+INDEX_TAG = b'ALZI'
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("the zstandard package is required for seekable alists (pip install zstandard)")
+    return zstandard
+
+def _frames(f, frame_size):
+    """Yield (expt_no, scan_ids, text) chunks of the alist open in *f*, the header first."""
+    (header, lines, scans, expt, nbytes) = ([], [], [], None, 0)
+    for line in f:
+        if line.startswith('*'):
+            header.append(line)
+            continue
+        if header is not None:
+            yield (None, [], ''.join(header))
+            header = None
+        fields = line.split(None, SCAN_FIELD + 1)
+        (e, s) = (int(fields[EXPT_FIELD]), fields[SCAN_FIELD])
+        if lines and (e != expt or (s != scans[-1] and nbytes >= frame_size)):
+            yield (expt, scans, ''.join(lines))
+            (lines, scans, nbytes) = ([], [], 0)
+        if not scans or s != scans[-1]:
+            scans.append(s)
+        expt = e
+        lines.append(line)
+        nbytes += len(line)
+    if header is not None:
+        yield (None, [], ''.join(header))
+    if lines:
+        yield (expt, scans, ''.join(lines))
+
+def compress(path, outpath=None, level=3, frame_size=1 << 20, nproc=None):
+    """Write the seekable compressed version of the alist *path*; returns the output path."""
+    zstd = _zstd()
+    outpath = outpath or path + '.zst'
+    nproc = nproc or min(8, os.cpu_count() or 1)
+    index = []
+
+    def work(chunk):
+        (expt, scans, text) = chunk
+        data = text.encode()
+        cctx = zstd.ZstdCompressor(level=level, write_checksum=True, write_content_size=True)
+        return (expt, scans, len(data), cctx.compress(data))
+
+    tmp = outpath + '.tmp'
+    with open(path) as f, open(tmp, 'wb') as out, ThreadPoolExecutor(max_workers=nproc) as pool:
+        # bounded number of frames in flight, written in file order
+        pending = deque()
+
+        def flush(n):
+            while len(pending) > n:
+                (expt, scans, dsize, frame) = pending.popleft().result()
+                index.append({'offset': out.tell(), 'csize': len(frame), 'dsize': dsize, 'expt_no': expt, 'scans': scans})
+                out.write(frame)
+
+        for chunk in _frames(f, frame_size):
+            pending.append(pool.submit(work, chunk))
+            flush(2 * nproc)
+        flush(0)
+        payload = json.dumps({'frames': index}).encode()
+        payload += struct.pack('<I', len(payload) + 8) + INDEX_TAG
+        out.write(struct.pack('<II', SKIPPABLE_MAGIC, len(payload)) + payload)
+    os.replace(tmp, outpath)
+    return outpath
+
+def read_index(path):
+    """Frame index of the seekable alist *path*."""
+    with open(path, 'rb') as f:
+        f.seek(-8, os.SEEK_END)
+        (size, tag) = struct.unpack('<I4s', f.read(8))
+        if tag != INDEX_TAG:
+            raise ValueError(f"{path} is not a seekable alist (no frame index)")
+        f.seek(-size, os.SEEK_END)
+        return json.loads(f.read(size - 8))['frames']
+
+def read_text(path, expt_no=None, scans=None, nproc=None):
+    """Header and records of the seekable alist *path*, restricted to the frames holding the
+    given expt_nos and/or scan_ids (all frames by default). Frames are decompressed in parallel;
+    records of other scans sharing a selected frame are dropped."""
+    zstd = _zstd()
+    expts = None if expt_no is None else set(int(e) for e in (expt_no if hasattr(expt_no, '__iter__') else [expt_no]))
+    scans = None if scans is None else set([scans] if isinstance(scans, str) else scans)
+    frames = [fr for fr in read_index(path) if fr['expt_no'] is None or (
+        (expts is None or fr['expt_no'] in expts) and (scans is None or scans.intersection(fr['scans'])))]
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        def work(fr):
+            # one decompression context per thread; zstandard releases the GIL while decompressing
+            data = zstd.ZstdDecompressor().decompress(os.pread(fd, fr['csize'], fr['offset']), max_output_size=fr['dsize'])
+            text = data.decode()
+            if scans is not None and fr['expt_no'] is not None and not scans.issuperset(fr['scans']):
+                text = ''.join(l for l in text.splitlines(True) if l.split(None, SCAN_FIELD + 1)[SCAN_FIELD] in scans)
+            return text
+        with ThreadPoolExecutor(max_workers=nproc or min(8, os.cpu_count() or 1)) as pool:
+            return ''.join(pool.map(work, frames))
+    finally:
+        os.close(fd)
+
+def read_alist(path, expt_no=None, scans=None, nproc=None):
+    """Parse the selected part (see read_text) of the seekable alist *path* with eat."""
+    from eat.io import hops
+    with tempfile.NamedTemporaryFile('w', suffix='.alist') as f:
+        f.write(read_text(path, expt_no, scans, nproc))
+        f.flush()
+        return hops.read_alist(f.name)
+
+def main():
+    parser = argparse.ArgumentParser(description='Seekable zstd compression of alists')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('compress', help='compress alists into seekable ALIST.zst files')
+    p.add_argument('alists', nargs='+', help='alist files to compress')
+    p.add_argument('-l', '--level', type=int, default=3, help='zstd compression level')
+    p.add_argument('-s', '--frame-size', type=int, default=1 << 20, help='minimum uncompressed size of a frame in bytes')
+    p.add_argument('--remove', action='store_true', help='remove the alists once compressed (like gzip)')
+    p = sub.add_parser('cat', help='write the selected part of a seekable alist to the standard output')
+    p.add_argument('alist', help='seekable alist (.zst)')
+    p.add_argument('-e', '--expt', type=int, nargs='+', default=None, help='expt_nos to extract (default: all)')
+    p.add_argument('-s', '--scan', type=str, nargs='+', default=None, help='scan_ids to extract (default: all)')
+    for p in sub.choices.values():
+        p.add_argument('-n', '--nproc', type=int, default=None, help='number of frames (de)compressed concurrently')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.command == 'compress':
+        for alist in args.alists:
+            out = compress(alist, level=args.level, frame_size=args.frame_size, nproc=args.nproc)
+            logger.info(f"{alist} -> {out} ({os.path.getsize(out) / max(1, os.path.getsize(alist)):.1%})")
+            if args.remove:
+                os.remove(alist)
+    else:
+        sys.stdout.write(read_text(args.alist, args.expt, args.scan, args.nproc))
+
+if __name__ == '__main__':
+    main()
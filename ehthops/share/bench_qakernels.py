@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Check and time the qakernels functions against the original notebook code.
+
+Synthetic alists with the columns used by the summary notebooks are generated for each requested
+size. Every kernel is first checked to give the same result as the pandas code it replaces in
+the notebooks, then both are timed. Exits with a non-zero status if any check fails.
+
+    python bench_qakernels.py --rows 100000 1000000 10000000
+"""
+import sys
+import time
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import alistschema
+import qakernels
+
+SITES = 'AXZLPSJKGNR'
+POLS = ['LL', 'LR', 'RL', 'RR']
+SOURCES = ['SGRA', 'M87', '3C279', 'OJ287', 'CENA', 'NRAO530']
+
+def synthetic_alist(nrows, seed=0, mixedpol=0.1):
+    """Alist-like frame with *nrows* rows: consecutive scans of one source, each with all four
+    polarization products on a random subset of the baselines."""
+    rng = np.random.default_rng(seed)
+    baselines = [''.join(bl) for bl in itertools.combinations(SITES, 2)]
+    nbl = len(baselines) // 2
+    nscans = -(-nrows // (len(POLS) * nbl))
+
+    scan = np.repeat(np.arange(nscans), nbl * len(POLS))[:nrows]
+    bl = np.array(baselines)[rng.integers(len(baselines), size=nscans * nbl)].repeat(len(POLS))[:nrows]
+    pol = np.tile(POLS, nscans * nbl)[:nrows].astype(object)
+    # a fraction of the scans correlated in a mixed (linear-circular) basis
+    mixed = rng.random(nscans)[scan] < mixedpol
+    pol[mixed] = pd.Series(pol[mixed]).map({'LL': 'XL', 'LR': 'XR', 'RL': 'YL', 'RR': 'YR'}).to_numpy()
+    expt = 3600 + scan * 5 // max(1, nscans)
+
+    a = pd.DataFrame({
+        'expt_no': expt,
+        'scan_no': scan,
+        'scan_id': pd.Series(scan).map(lambda s: '%03d-%04d' % (80 + s // 1440, s % 1440)).to_numpy(),
+        'source': np.array(SOURCES)[scan % len(SOURCES)],
+        'baseline': bl,
+        'polarization': pol,
+        'timetag': pd.Series(scan).map(lambda s: '%03d-%04d00' % (80 + s // 1440, s % 1440)).to_numpy(),
+        'gmst': (scan * 0.1) % 24.0,
+        'u': rng.normal(size=nrows) * 1e6,
+        'v': rng.normal(size=nrows) * 1e6,
+        'snr': rng.lognormal(2.5, 1.0, size=nrows),
+        'amp': rng.lognormal(0.0, 0.5, size=nrows),
+        'ref_freq': 228100.0,
+    })
+    # make (u, v, gmst) identical for the products of the same baseline and scan
+    first = a.groupby(['scan_no', 'baseline']).transform('first')
+    a[['u', 'v', 'gmst']] = first[['u', 'v', 'gmst']]
+    return a
+
+def synthetic_tlist(nrows, seed=0):
+    """Closure phase frame with *nrows* rows."""
+    rng = np.random.default_rng(seed)
+    triangles = [''.join(t) for t in itertools.combinations(SITES, 3)]
+    scan = rng.integers(max(1, nrows // 50), size=nrows)
+    return pd.DataFrame({
+        'expt_no': 3600 + scan % 5,
+        'scan_no': scan,
+        'source': np.array(SOURCES)[scan % len(SOURCES)],
+        'triangle': np.array(triangles)[rng.integers(len(triangles), size=nrows)],
+        'polarization': np.array(['LL', 'RR'])[rng.integers(2, size=nrows)],
+        'bis_snr': rng.lognormal(1.5, 1.0, size=nrows),
+        'bis_phas': rng.normal(scale=10.0, size=nrows),
+        'duration': rng.choice([8.0, 40.0, 400.0], size=nrows),
+        'gmst': rng.random(nrows) * 24.0,
+    })
+
+# the notebook code replaced by the kernels
+
+def legacy_snr_cut(a):
+    return a[(a.snr > 7) & ~a.baseline.str.contains('R')]
+
+def legacy_relabel(a):
+    return a.polarization.replace(qakernels.MIXED_TO_PARALLEL)
+
+def legacy_expt_boundaries(a):
+    sorted_a = a.sort_values(['expt_no', 'scan_no'])
+    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()
+    return (last_scans.iloc[:-1] + 0.5).to_numpy()
+
+def legacy_coherence_ratio(a0, a1):
+    idx_cols = 'expt_no source scan_id baseline polarization'.split()
+    group_cols = 'expt_no source scan_id baseline'.split()
+    pols = qakernels.COHERENCE_POLS
+    a0_1 = a0[a0.polarization.isin(pols)].set_index(idx_cols).groupby(group_cols).mean(numeric_only=True)
+    a1_1 = a1[a1.polarization.isin(pols)].set_index(idx_cols).groupby(group_cols).mean(numeric_only=True)
+    a0_1['snr1'] = a1_1.snr
+    a0_1['amp1'] = a1_1.amp
+    a0_1['coh'] = a0_1.amp1 / a0_1.amp
+    return a0_1.reset_index().dropna()
+
+def legacy_polfrac(a):
+    index_cols = 'expt_no scan_no gmst timetag baseline source u v'.split()
+    frames = []
+    for (c1, c2, p1, p2) in qakernels.POLFRAC_PRODUCTS.values():
+        sub = a[a.polarization.isin({c1, c2, p1, p2})]
+        if sub.empty:
+            continue
+        p = sub.pivot_table(aggfunc='first', index=index_cols, columns=['polarization'], values=['snr']).dropna()
+        p['fpol'] = np.sqrt(p.snr[c1] * p.snr[c2] / (p.snr[p1] * p.snr[p2]))
+        p['fpol_err'] = np.sqrt(2.0 / (p.snr[p1] * p.snr[p2]))
+        frames.append(p)
+    q = pd.concat(frames)
+    q.columns = ['_'.join(c for c in col if c) for col in q.columns]
+    return q.reset_index()
+
+def legacy_site_frames(a):
+    return {site: a[a.baseline.str.contains(site)] for site in sorted(set().union(*set(a.baseline)))}
+
+def legacy_triangle_groups(df, triangles):
+    df = df[(df.bis_snr > 3) & ~df.triangle.str.contains('R') & (df.duration > 8 * 5)]
+    return {(tri, pol): df[(df.polarization == pol) & (df.triangle == tri)] for tri in triangles for pol in ('LL', 'RR')}
+
+def legacy_coherence_snr_cut(a0, a1):
+    return legacy_snr_cut(legacy_coherence_ratio(a0, a1))
+
+def kernel_coherence_snr_cut(a0, a1):
+    # snr_cut on the aggregated coherence frame, as in summary_plots_coherence
+    return qakernels.snr_cut(qakernels.coherence_ratio(a0, a1), 7, drop_sites='R')
+
+def kernel_triangle_groups(df, triangles):
+    return qakernels.triangle_groups(qakernels.cphase_cut(df, 3), triangles)
+
+def _sorted(df):
+    # sort on the non-float (key) columns first and on single precision floats last, so that rows
+    # differing only in float rounding keep their order
+    floats = [c for c in df.columns if df[c].dtype.kind == 'f']
+    key = df.astype({c: np.float32 for c in floats})
+    cols = [c for c in df.columns if c not in floats] + floats
+    return df.iloc[np.lexsort([key[c].to_numpy() for c in reversed(cols)])].reset_index(drop=True)
+
+def same(x, y):
+    """True if a kernel result *x* holds the same values as the legacy result *y* (up to row
+    order, float rounding, the compact schema and the extra 'stations' column)."""
+    if isinstance(x, dict):
+        return x.keys() == y.keys() and all(same(x[k], y[k]) for k in x)
+    if isinstance(x, pd.DataFrame):
+        x = alistschema.expand(x).drop(columns=['stations'], errors='ignore')
+        if sorted(x.columns) != sorted(y.columns) or len(x) != len(y):
+            return False
+        cols = sorted(x.columns)
+        (x, y) = (_sorted(x[cols]), _sorted(y[cols]))
+        try:
+            pd.testing.assert_frame_equal(x, y, check_dtype=False, check_index_type=False)
+        except AssertionError:
+            return False
+        return True
+    if isinstance(x, pd.Series):
+        return x.index.equals(y.index) and np.array_equal(x.to_numpy(), y.to_numpy())
+    return np.allclose(x, y)
+
+def timeit(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return (best, res)
+
+def bench(nrows, repeat=3, compact=False):
+    a = synthetic_alist(nrows)
+    a1 = synthetic_alist(nrows, seed=1)
+    a1[['expt_no', 'scan_id', 'source', 'baseline', 'polarization']] = a[['expt_no', 'scan_id', 'source', 'baseline', 'polarization']]
+    tl = synthetic_tlist(nrows)
+    triangles = sorted(t for t in set(tl.triangle) if 'R' not in t)
+    # the kernels run on the compact schema, the legacy code on the frames as read
+    (ka, ka1, ktl) = (alistschema.compact(a), alistschema.compact(a1), alistschema.compact(tl)) if compact else (a, a1, tl)
+
+    cases = [
+        ('snr_cut', legacy_snr_cut, lambda a: qakernels.snr_cut(a, 7, drop_sites='R'), (a,), (ka,)),
+        ('relabel', legacy_relabel, lambda a: qakernels.relabel(a.polarization, qakernels.MIXED_TO_PARALLEL), (a,), (ka,)),
+        ('expt_boundaries', legacy_expt_boundaries, qakernels.expt_boundaries, (a,), (ka,)),
+        ('coherence_ratio', legacy_coherence_ratio, qakernels.coherence_ratio, (a, a1), (ka, ka1)),
+        ('coherence+cut', legacy_coherence_snr_cut, kernel_coherence_snr_cut, (a, a1), (ka, ka1)),
+        ('polfrac', legacy_polfrac, qakernels.polfrac, (a,), (ka,)),
+        ('site_frames', legacy_site_frames, qakernels.site_frames, (a,), (ka,)),
+        ('triangle_groups', legacy_triangle_groups, kernel_triangle_groups, (tl, triangles), (ktl, triangles)),
+    ]
+
+    ok = True
+    for (name, legacy, kernel, args, kargs) in cases:
+        (t_legacy, r_legacy) = timeit(legacy, *args, repeat=repeat)
+        (t_kernel, r_kernel) = timeit(kernel, *kargs, repeat=repeat)
+        match = same(r_kernel, r_legacy)
+        ok &= match
+        print(f"{nrows:>10d} {name:<16s} {t_legacy:9.4f}s {t_kernel:9.4f}s {t_legacy / t_kernel:7.1f}x  {'ok' if match else 'MISMATCH'}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and time the qakernels functions on synthetic alists')
+    parser.add_argument('-n', '--rows', type=int, nargs='+', default=[100000, 1000000], help='alist sizes (rows) to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timing repeats (best time is reported)')
+    parser.add_argument('-c', '--compact', action='store_true', help='run the kernels on frames with the compact alist schema')
+
+    args = parser.parse_args()
+
+    print(f"{'rows':>10s} {'kernel':<16s} {'legacy':>10s} {'kernel':>10s} {'speedup':>8s}")
+    ok = True
+    for nrows in args.rows:
+        ok &= bench(nrows, args.repeat, args.compact)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
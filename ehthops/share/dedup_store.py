@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Content-addressed store deduplicating the data directories of the pipeline stages and bands.
+
+Every stage of every band has its own DATADIR holding the linked correlator data, the fringe
+files made by fourfit and copies of earlier products (e.g. the adhoc phase files). ``ingest``
+replaces the byte-identical files in the expt_no directories of a DATADIR with links to one object
+of the store (objects/<2 hex>/<blake2b hex>), so that identical files across stages and bands
+take one inode (hardlink mode) or one set of data blocks (reflink mode) only:
+
+- regular files are hashed and hardlinked (or reflinked with ``cp --reflink``) to the object
+  with the same content, which is created from the first file seen;
+- files already linked to the store are not hashed again: in hardlink mode these are the files
+  sharing their inode with an object, in reflink mode the files with the same inode, size and
+  modification time as when they were reflinked (recorded in reflinked/ of the store);
+- symbolic links to files inside the DATADIRs being ingested are replaced by a hardlink to their
+  target (hardlink mode only); links to files elsewhere, e.g. the archive linked by 2.link, are
+  left alone;
+- the files at the top of DATADIR (alists, control files), the other directories of DATADIR
+  (e.g. adhoc, copied over by 9.next) and the fourfit .out/.err logs are rewritten in place by
+  the stage scripts and are left alone.
+
+In hardlink mode the objects are made read-only, as a write to any of the links would change
+the content seen by all of them, unless the file became an object while it had other hardlinks
+(which may be outside the stages). ``gc`` removes the objects that are no longer linked from any
+stage (e.g. after scripts/cleanup.sh) in hardlink mode, and all objects not reflinked since the
+given age in reflink mode.
+
+    dedup_store.py ingest STORE DATADIR [DATADIR ...]
+    dedup_store.py gc STORE
+"""
+import os
+import sys
+import time
+import stat
+import json
+import hashlib
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# logs written with shell redirections (truncated in place when a step is re-run)
+SKIP_SUFFIXES = ('.out', '.err')
+
+def digest(path, bufsize=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(bufsize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def candidates(datadir):
+    """(directory, files) of the expt_no directories of *datadir* (see module docstring)."""
+    for entry in os.scandir(datadir):
+        if not entry.is_dir(follow_symlinks=False) or not entry.name[:1].isdigit():
+            continue
+        for (root, _, files) in os.walk(entry.path):
+            files = [os.path.join(root, name) for name in sorted(files) if not name.endswith(SKIP_SUFFIXES)]
+            if files:
+                yield (root, files)
+
+def stored_inodes(store):
+    """(st_dev, st_ino) of the objects of *store* (hardlink mode)."""
+    inodes = set()
+    for (root, _, files) in os.walk(os.path.join(store, 'objects')):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            inodes.add((st.st_dev, st.st_ino))
+    return inodes
+
+def _record_path(store, datadir):
+    key = hashlib.blake2b(os.path.abspath(datadir).encode(), digest_size=10).hexdigest()
+    return os.path.join(store, 'reflinked', f'{key}.json')
+
+def load_reflinked(store, datadirs):
+    """{path: (st_ino, st_size, st_mtime_ns, key)} of the files reflinked by earlier ingests (reflink mode)."""
+    reflinked = {}
+    for datadir in datadirs:
+        try:
+            with open(_record_path(store, datadir)) as f:
+                reflinked.update((path, tuple(rec)) for (path, rec) in json.load(f).items())
+        except (FileNotFoundError, ValueError):
+            pass
+    return reflinked
+
+def save_reflinked(store, datadirs, reflinked):
+    os.makedirs(os.path.join(store, 'reflinked'), exist_ok=True)
+    for datadir in datadirs:
+        prefix = os.path.join(os.path.abspath(datadir), '')
+        rec = _record_path(store, datadir)
+        with open(rec + '.tmp', 'w') as f:
+            json.dump({path: r for (path, r) in reflinked.items() if path.startswith(prefix) and os.path.lexists(path)}, f)
+        os.replace(rec + '.tmp', rec)
+
+def _inside(path, roots):
+    return any(os.path.commonpath([path, root]) == root for root in roots)
+
+def _replace(path, make_link):
+    """Atomically replace *path* by the file made by make_link(tmp)."""
+    tmp = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.dedup')
+    make_link(tmp)
+    os.replace(tmp, path)
+
+def _reflink(src, dst):
+    subprocess.run(['cp', '--reflink=always', src, dst], check=True, capture_output=True)
+
+def ingest_file(path, store, mode, roots, stored, reflinked):
+    """Link *path* to its store object; returns the number of bytes saved. *roots* are the real
+    paths of the DATADIRs ingested, *stored* the inodes of the objects (updated, hardlink mode)
+    and *reflinked* the files reflinked before (updated, reflink mode)."""
+    st = os.lstat(path)
+    dev = os.stat(store).st_dev
+    if stat.S_ISLNK(st.st_mode):
+        target = os.path.realpath(path)
+        if mode != 'hardlink' or not _inside(target, roots) or not os.path.isfile(target) or os.stat(target).st_dev != dev:
+            return 0
+        _replace(path, lambda tmp: os.link(target, tmp))
+        return 0
+    if not stat.S_ISREG(st.st_mode) or st.st_dev != dev or st.st_size == 0:
+        return 0
+    if mode == 'hardlink' and st.st_nlink > 1 and (st.st_dev, st.st_ino) in stored:
+        return 0
+    rec = reflinked.get(path) if mode == 'reflink' else None
+    if rec is not None and rec[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+        # keep the objects in use recent for gc
+        obj = os.path.join(store, 'objects', rec[3][:2], rec[3][2:])
+        if os.path.exists(obj):
+            os.utime(obj)
+            return 0
+
+    obj = os.path.join(store, 'objects')
+    key = digest(path)
+    obj = os.path.join(obj, key[:2], key[2:])
+    try:
+        ost = os.stat(obj)
+    except FileNotFoundError:
+        # first copy of this content becomes the object (unless another thread got there first)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            if mode == 'hardlink':
+                os.link(path, obj)
+                stored.add((st.st_dev, st.st_ino))
+                # a file with other hardlinks may be shared with files outside the stages
+                if st.st_nlink == 1:
+                    os.chmod(obj, stat.S_IMODE(st.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            else:
+                _replace(obj, lambda tmp: _reflink(path, tmp))
+                reflinked[path] = (st.st_ino, st.st_size, st.st_mtime_ns, key)
+            return 0
+        except FileExistsError:
+            ost = os.stat(obj)
+    if mode == 'hardlink':
+        stored.add((ost.st_dev, ost.st_ino))
+        if ost.st_ino == st.st_ino:
+            return 0
+        _replace(path, lambda tmp: os.link(obj, tmp))
+        return st.st_size if st.st_nlink == 1 else 0
+    _replace(path, lambda tmp: _reflink(obj, tmp))
+    # keep the objects in use recent for gc
+    os.utime(obj)
+    nst = os.lstat(path)
+    reflinked[path] = (nst.st_ino, nst.st_size, nst.st_mtime_ns, key)
+    return st.st_size
+
+def ingest(store, datadirs, mode='hardlink', nproc=8):
+    os.makedirs(os.path.join(store, 'objects'), exist_ok=True)
+    dirs = [d for datadir in datadirs for d in candidates(os.path.abspath(datadir))]
+    roots = [os.path.realpath(datadir) for datadir in datadirs]
+    stored = stored_inodes(store) if mode == 'hardlink' else set()
+    reflinked = load_reflinked(store, datadirs) if mode == 'reflink' else {}
+    (nfiles, saved, failed) = (0, 0, 0)
+
+    def work(dirpath, paths):
+        # the directory keeps its modification time so that 4.alists does not see the scan as changed
+        st = os.stat(dirpath)
+        res = []
+        for path in paths:
+            try:
+                res.append(ingest_file(path, store, mode, roots, stored, reflinked))
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.debug(f"{path} not deduplicated: {e}")
+                res.append(None)
+        os.utime(dirpath, ns=(st.st_atime_ns, st.st_mtime_ns))
+        return res
+
+    # one directory per task; hashing releases the GIL, so threads are enough to keep the filesystem busy
+    with ThreadPoolExecutor(max_workers=nproc) as pool:
+        for res in pool.map(lambda d: work(*d), dirs):
+            nfiles += len(res)
+            failed += sum(1 for r in res if r is None)
+            saved += sum(r for r in res if r is not None)
+    if mode == 'reflink':
+        save_reflinked(store, datadirs, reflinked)
+    logger.info(f"Ingested {nfiles} files from {len(datadirs)} data directories into {store}: "
+                f"{saved / 2**20:.1f} MiB deduplicated, {failed} files left as they are")
+
+def gc(store, mode='hardlink', age=7.0):
+    """Remove the store objects that are no longer used (see module docstring)."""
+    (removed, nbytes) = (0, 0)
+    cutoff = time.time() - age * 86400
+    for (root, _, files) in os.walk(os.path.join(store, 'objects')):
+        for name in files:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            if (mode == 'hardlink' and st.st_nlink == 1) or (mode == 'reflink' and st.st_mtime < cutoff):
+                os.remove(path)
+                removed += 1
+                nbytes += st.st_size
+    logger.info(f"Removed {removed} unused objects ({nbytes / 2**20:.1f} MiB) from {store}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Deduplicate the stage data directories through a content-addressed store')
+    parser.add_argument('command', choices=['ingest', 'gc'], help='link the files of DATADIRs to the store, or remove unused objects')
+    parser.add_argument('store', type=str, help='store directory (on the same filesystem as the data directories)')
+    parser.add_argument('datadirs', nargs='*', help='data directories to ingest')
+    parser.add_argument('-m', '--mode', choices=['hardlink', 'reflink'], default='hardlink', help='how files are linked to the store objects')
+    parser.add_argument('-n', '--nproc', type=int, default=min(8, os.cpu_count() or 1), help='number of files hashed concurrently')
+    parser.add_argument('--age', type=float, default=7.0, help='reflink mode gc: remove objects not used for this many days')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.command == 'ingest':
+        if not args.datadirs:
+            parser.error("no data directory to ingest")
+        ingest(args.store, args.datadirs, args.mode, args.nproc)
+    else:
+        if not os.path.isdir(args.store):
+            sys.exit(0)
+        gc(args.store, args.mode, args.age)
+
+if __name__ == '__main__':
+    main()
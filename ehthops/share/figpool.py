@@ -0,0 +1,78 @@
+"""Parallel rendering of independent figures for the summary notebooks.
+
+render() calls a plotting function once per argument tuple in a pool of processes forked from
+the notebook, draws the figures with the Agg backend and returns them as PNG images in the same
+order as the arguments. Plotting functions defined inside notebook cells cannot be pickled, so
+the jobs are handed to the workers through a module-level list that the forked workers inherit;
+only the job index and the rendered PNG bytes cross the process boundary.
+
+The number of worker processes defaults to the number of CPUs and can be set with the
+FIGPOOL_NPROC environment variable (FIGPOOL_NPROC=1 renders serially in the notebook process).
+"""
+import io
+import os
+import multiprocessing
+
+# (func, args) tuples of the render() call in progress, inherited by the forked workers
+_jobs = []
+
+def nproc():
+    """Number of worker processes to use."""
+    return max(1, int(os.environ.get('FIGPOOL_NPROC', os.cpu_count() or 1)))
+
+def _to_png(result):
+    """Replace every matplotlib figure in *result* by its PNG bytes and close the figure."""
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+
+    if isinstance(result, Figure):
+        buf = io.BytesIO()
+        result.savefig(buf, format='png')
+        plt.close(result)
+        return buf.getvalue()
+    if isinstance(result, tuple):
+        return tuple(_to_png(r) for r in result)
+    return result
+
+def _render(i):
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    (func, args) = _jobs[i]
+    return _to_png(func(*args))
+
+def _to_image(result):
+    import marimo as mo
+
+    if isinstance(result, bytes):
+        return mo.image(src=io.BytesIO(result))
+    if isinstance(result, tuple):
+        return tuple(_to_image(r) for r in result)
+    return result
+
+def render_png(func, argslist, processes=None):
+    """Call func(*args) for every args in *argslist* and return the results in order, with
+    every figure (also inside a returned tuple) replaced by its PNG bytes. None is passed
+    through for calls that do not make a figure.
+    """
+    global _jobs
+    argslist = [args if isinstance(args, tuple) else (args,) for args in argslist]
+    processes = min(processes or nproc(), len(argslist))
+
+    if processes <= 1:
+        return [_to_png(func(*args)) for args in argslist]
+
+    _jobs = [(func, args) for args in argslist]
+    try:
+        with multiprocessing.get_context('fork').Pool(processes=processes) as pool:
+            return pool.map(_render, range(len(_jobs)), chunksize=1)
+    finally:
+        _jobs = []
+
+def render(func, argslist, processes=None, skip_none=True):
+    """Same as render_png() but returns marimo images that can be shown in the notebook output.
+    Calls that returned None are dropped from the list unless *skip_none* is False.
+    """
+    results = [_to_image(r) for r in render_png(func, argslist, processes)]
+    if skip_none:
+        results = [r for r in results if r is not None]
+    return results
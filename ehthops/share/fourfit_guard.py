@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Stop a fourfit pass early when its first fringe results look broken.
+
+Started in the background by 3.fourfit when SET_FOURFITGUARD is warn, pause or abort. Like
+stream_alists.py it follows the root files the fourfit tasks append to DONEFILE; the alist of a
+sample of the scans whose root files are all done (--sample, selected by a hash of the scan name
+so that reruns look at the same scans) is made with ``alist -v6`` into WORKDIR. Once --min-done
+of the root files are done and at least --min-scans scans are sampled, the records are compared
+after every poll with the alist.v6 of the previous stage (--reference) on the same (expt_no,
+scan_id, baseline, polarization) keys:
+
+- detection fraction (snr above --snr) of all matched records, relative to the reference;
+- detection fraction of every baseline with at least --min-records matched records, relative to
+  the reference;
+- median snr ratio of the records detected in the reference.
+
+Without a reference (first stage) only the absolute detection fraction is checked. The metrics,
+per-baseline table and failed checks are written to REPORT (JSON) at every evaluation. When a
+check fails the guard logs it and, depending on --action, creates temp/fourfit.pause (the fourfit
+tasks not yet started wait until the file is removed) or temp/fourfit.abort (they are skipped and
+3.fourfit returns an error), then stops evaluating.
+
+    fourfit_guard.py --filelist log/filelist.txt --donefile log/fourfit.done --stopfile temp/fourfit.finished \\
+        --reference ../2.+pcal/data/alist.v6 --action abort
+"""
+import os
+import json
+import hashlib
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from stream_alists import scan_of, follow
+from alistdiff import FIELDS
+
+logger = logging.getLogger(__name__)
+
+KEYS = ['expt_no', 'scan_id', 'baseline', 'polarization']
+ACTIONS = ('warn', 'pause', 'abort')
+
+def read_records(path):
+    """Key columns and snr of the records of an alist v6 file."""
+    cols = KEYS + ['snr']
+    df = pd.read_csv(path, sep=r'\s+', comment='*', header=None, usecols=[FIELDS[c] for c in cols],
+                     dtype={FIELDS[c]: str for c in KEYS if c != 'expt_no'})
+    return df.rename(columns={FIELDS[c]: c for c in cols})[cols]
+
+def sampled(scan, fraction):
+    return int(hashlib.md5(scan.encode()).hexdigest()[:8], 16) < fraction * 0x100000000
+
+def build(scan, datadir, workdir):
+    """Alist of one scan directory, None if alist failed or found no fringe."""
+    out = os.path.join(workdir, scan.replace('/', '.') + '.v6')
+    try:
+        rc = subprocess.call(['alist', '-v6', '-o', out, os.path.join(datadir, scan)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if rc != 0 or not os.path.isfile(out):
+            logger.warning(f"alist failed on {scan} (exit code {rc})")
+            return None
+        df = read_records(out)
+    except pd.errors.EmptyDataError:
+        # only header lines: the scan has no fringe
+        return None
+    except OSError as e:
+        logger.warning(f"alist failed on {scan}: {e}")
+        return None
+    return df if len(df) else None
+
+def evaluate(cur, ref, args):
+    """(metrics, per-baseline table, failed checks) of the sampled records *cur*."""
+    failed = []
+    if ref is None:
+        det = float((cur.snr > args.snr).mean())
+        metrics = {'records': len(cur), 'detection': det}
+        table = cur.assign(det=cur.snr > args.snr).groupby('baseline').agg(n=('det', 'size'), detection=('det', 'mean')).reset_index()
+        if det < args.min_detection:
+            failed.append(f"detection fraction {det:.2f} < {args.min_detection}")
+        return (metrics, table, failed)
+
+    m = cur.merge(ref, on=KEYS, suffixes=('', '_ref'))
+    if len(m) == 0:
+        return ({'records': len(cur), 'matched': 0}, pd.DataFrame(), failed)
+    (det, det_ref) = (m.snr > args.snr, m.snr_ref > args.snr)
+    ratio = det.mean() / det_ref.mean() if det_ref.any() else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr_ratio = float(np.nanmedian((m.snr / m.snr_ref)[det_ref])) if det_ref.any() else np.nan
+    metrics = {'records': len(cur), 'matched': len(m), 'detection': float(det.mean()), 'detection_ref': float(det_ref.mean()),
+               'detection_ratio': float(ratio), 'snr_ratio': snr_ratio,
+               'snr_quantiles': [float(q) for q in np.quantile(m.snr, [0.1, 0.5, 0.9])],
+               'snr_quantiles_ref': [float(q) for q in np.quantile(m.snr_ref, [0.1, 0.5, 0.9])]}
+    table = m.assign(det=det, det_ref=det_ref).groupby('baseline').agg(
+        n=('det', 'size'), detection=('det', 'mean'), detection_ref=('det_ref', 'mean')).reset_index()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table['ratio'] = table.detection / table.detection_ref
+
+    if ratio < args.min_detection_ratio:
+        failed.append(f"detection fraction {det.mean():.2f} is {ratio:.2f} of the reference ({det_ref.mean():.2f})")
+    for row in table[(table.n >= args.min_records) & (table.ratio < args.min_baseline_ratio)].itertuples():
+        failed.append(f"baseline {row.baseline}: detection fraction {row.detection:.2f} is {row.ratio:.2f} of the reference ({row.detection_ref:.2f})")
+    if snr_ratio < args.min_snr_ratio:
+        failed.append(f"median snr ratio to the reference {snr_ratio:.2f} < {args.min_snr_ratio}")
+    return (metrics, table, failed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the first fringe results of a fourfit pass and stop it early if they look broken')
+    parser.add_argument('-f', '--filelist', type=str, required=True, help='root files processed by fourfit (log/filelist.txt)')
+    parser.add_argument('-d', '--donefile', type=str, required=True, help='file the fourfit tasks append their finished root file to')
+    parser.add_argument('-s', '--stopfile', type=str, required=True, help='file created when all fourfit tasks have ended')
+    parser.add_argument('-r', '--reference', type=str, default=None, help='alist.v6 of the previous stage')
+    parser.add_argument('-a', '--action', choices=ACTIONS, default='warn', help='what to do when a check fails')
+    parser.add_argument('-w', '--workdir', type=str, default='temp/guard', help='directory for the alists of the sampled scans')
+    parser.add_argument('-o', '--report', type=str, default='log/fourfit_guard.json', help='JSON report')
+    parser.add_argument('--datadir', type=str, default=os.environ.get('DATADIR'), help='HOPS data directory (default: $DATADIR)')
+    parser.add_argument('--sample', type=float, default=0.25, help='fraction of the scans checked')
+    parser.add_argument('--min-done', type=float, default=0.05, help='fraction of the root files done before the first check')
+    parser.add_argument('--min-scans', type=int, default=10, help='number of sampled scans before the first check')
+    parser.add_argument('--snr', type=float, default=7.0, help='detection threshold')
+    parser.add_argument('--min-detection', type=float, default=0.2, help='minimum detection fraction (no reference)')
+    parser.add_argument('--min-detection-ratio', type=float, default=0.7, help='minimum detection fraction relative to the reference')
+    parser.add_argument('--min-baseline-ratio', type=float, default=0.3, help='minimum detection fraction of a baseline relative to the reference')
+    parser.add_argument('--min-snr-ratio', type=float, default=0.7, help='minimum median snr ratio to the reference')
+    parser.add_argument('--min-records', type=int, default=20, help='matched records of a baseline needed to check it')
+    parser.add_argument('-n', '--nproc', type=int, default=2, help='number of scans read concurrently')
+    parser.add_argument('--poll', type=float, default=30.0, help='seconds between checks of the done file')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.datadir is None:
+        parser.error("DATADIR not set; pass --datadir")
+    os.makedirs(args.workdir, exist_ok=True)
+    ref = None
+    if args.reference and os.path.isfile(args.reference):
+        try:
+            ref = read_records(args.reference).rename(columns={'snr': 'snr_ref'}).drop_duplicates(KEYS, keep='last')
+            logger.info(f"Comparing with {len(ref)} records of {args.reference}")
+        except pd.errors.EmptyDataError:
+            logger.info(f"No records in {args.reference}, checking the absolute detection fraction only")
+    else:
+        logger.info("No reference alist, checking the absolute detection fraction only")
+
+    pending = {}
+    with open(args.filelist) as f:
+        for rootfile in f.read().split():
+            pending.setdefault(scan_of(rootfile, args.datadir), set()).add(os.path.abspath(rootfile))
+    total = sum(len(r) for r in pending.values())
+    (ndone, builds, frames, tripped) = (0, [], [], False)
+    with ThreadPoolExecutor(max_workers=args.nproc) as pool:
+        for (lines, stop) in follow(args.donefile, args.stopfile, args.poll):
+            if stop or tripped:
+                break
+            for rootfile in lines:
+                scan = scan_of(rootfile, args.datadir)
+                if os.path.abspath(rootfile) in pending.get(scan, ()):
+                    pending[scan].discard(os.path.abspath(rootfile))
+                    ndone += 1
+            for scan in [s for (s, r) in pending.items() if not r]:
+                del pending[scan]
+                if sampled(scan, args.sample):
+                    builds.append(pool.submit(build, scan, args.datadir, args.workdir))
+            frames += [b.result() for b in builds if b.done() and b.result() is not None]
+            builds = [b for b in builds if not b.done()]
+            if ndone < args.min_done * total or len(frames) < args.min_scans:
+                continue
+
+            (metrics, table, failed) = evaluate(pd.concat(frames, ignore_index=True), ref, args)
+            metrics.update({'root_files_done': ndone, 'root_files': total, 'scans_sampled': len(frames), 'failed': failed})
+            with open(args.report, 'w') as f:
+                json.dump({'metrics': metrics, 'baselines': table.to_dict(orient='records')}, f, indent=1, default=float)
+            if not failed:
+                continue
+            tripped = True
+            for msg in failed:
+                logger.error(msg)
+            logger.error(f"Checks failed after {ndone} of {total} root files ({len(frames)} scans sampled), see {args.report}")
+            if args.action != 'warn':
+                flag = os.path.join(os.path.dirname(os.path.abspath(args.stopfile)), f'fourfit.{args.action}')
+                with open(flag, 'w') as f:
+                    f.write('\n'.join(failed) + '\n')
+                logger.error(f"Created {flag}: the fourfit tasks not started yet are " +
+                             ("skipped" if args.action == 'abort' else "waiting until it is removed"))
+
+if __name__ == '__main__':
+    main()
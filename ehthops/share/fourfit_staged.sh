@@ -0,0 +1,37 @@
+#!/usr/bin/env bash
+#
+# Usage: fourfit_staged.sh CONTROLFILE ROOTFILE SCRATCH
+#
+# Run fourfit on ROOTFILE in node-local scratch instead of in its scan
+# directory on the shared filesystem: the root file and the corel and fringe
+# files with the same root code are copied to a private directory under
+# SCRATCH, fourfit runs there (writing ROOTFILE.out and ROOTFILE.err), and the
+# new files are written back to the scan directory with one tar stream. The
+# copy back is checked against md5 sums taken in scratch before the scratch
+# directory is removed. Exits with the fourfit exit code, or 1 if staging or
+# the copy back fails (the scratch directory is then left for inspection).
+# Used by 3.fourfit when SET_FOURFITSCRATCH is set.
+
+_cf=$(cd "$(dirname "$1")" && pwd)/$(basename "$1")
+_scandir=$(dirname "$2")
+_root=$(basename "$2")
+_code=${_root##*.}
+
+_tmp=$(mktemp -d "$(cd "$3" && pwd)/fourfit.XXXXXX") || exit 1
+# root file, corel files and earlier fringe files of this root code in one read; the root and corel
+# files are the links made by 2.link, which are followed (-h) so that fourfit reads the copies
+(cd "$_scandir" && LC_ALL=C ls | grep "\.$_code\$" | tar -chf - --files-from -) \
+    | tar -C "$_tmp" -xf - || { echo "ERROR: staging $2 in $_tmp failed" >&2; exit 1; }
+(cd "$_tmp" && LC_ALL=C ls > .staged)
+
+(cd "$_tmp" && fourfit -c "$_cf" "$_root" > "$_root.out" 2> "$_root.err")
+_rc=$?
+
+# write back everything fourfit created, with the md5 sums to check the copy
+(cd "$_tmp" && LC_ALL=C ls | LC_ALL=C comm -13 .staged - > .new && xargs -d '\n' md5sum < .new > .md5) || exit 1
+tar -C "$_tmp" -cf - --files-from "$_tmp/.new" | tar -C "$_scandir" -xf - \
+    && (cd "$_scandir" && md5sum --quiet -c "$_tmp/.md5") \
+    || { echo "ERROR: copy of the fourfit output of $2 from $_tmp failed" >&2; exit 1; }
+
+rm -rf "$_tmp"
+exit $_rc
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Compiled index of the campaign metadata of a METADIR (vex/, array.txt, cf/).
+
+compile_index() parses the VEX schedules, the array file and the control file presets of a
+METADIR once into pandas tables:
+
+- scans:     one row per scheduled scan (track, scan name, scan_id as in the alists, start time
+             as datetime and MJD, duration, source, participating stations and GMST at start);
+- stations:  VEX site definitions (track, site_ID, site_name, ECEF position);
+- sources:   source coordinates (track, source, ra and dec in radians);
+- baselines: projected (u, v) in meters of every baseline of every scan at the scan start,
+             labelled with the two-letter VEX site_IDs (e.g. Aa-Ax) and not with the one-letter
+             HOPS codes of the alists, which METADIR does not define;
+- array:     the rows of array.txt;
+- cf:        the control file presets (name, step, band, path).
+
+load() returns the tables from a pickle cache that is rebuilt whenever one of the source files
+is added, removed or modified (size or mtime), so consumers can join against the scan table
+(e.g. add_scan_info() on the scan_id of an alist) instead of parsing the VEX text again.
+
+    metaindex.py $METADIR            # compile (or refresh) the cache and print a summary
+"""
+import os
+import re
+import glob
+import pickle
+import hashlib
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHEDIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ehthops', 'metaindex')
+# bump when the tables change so that older caches are rebuilt
+VERSION = 1
+
+def _vex_time(s):
+    """Datetime of a VEX epoch like 2017y099d23h17m00s."""
+    m = re.match(r'(\d+)y(\d+)d(\d+)h(\d+)m(\d+(?:\.\d*)?)s', s.strip())
+    (y, d, h, mi, sec) = m.groups()
+    return datetime(int(y), 1, 1) + timedelta(days=int(d) - 1, hours=int(h), minutes=int(mi), seconds=float(sec))
+
+def _angle(s, hours=False):
+    """Radians of a VEX ra (12h34m56.7s) or dec (-12d34'56.7") value."""
+    m = re.match(r'\s*([+-]?)(\d+)[hd](\d+)[m\'](\d+(?:\.\d*)?)[s"]', s)
+    (sign, a, b, c) = m.groups()
+    val = int(a) + int(b) / 60.0 + float(c) / 3600.0
+    val *= 15.0 if hours else 1.0
+    return np.radians(-val if sign == '-' else val)
+
+def _statements(text):
+    """(block type, block name, [statements]) of the def/scan blocks of the VEX *text*, with the
+    enclosing $SECTION as block type of the defs."""
+    # drop comments (from * to the end of the line)
+    text = re.sub(r'\*[^\n]*', '', text)
+    (section, block, name, body) = (None, None, None, [])
+    for stmt in (s.strip() for s in text.split(';')):
+        if not stmt:
+            continue
+        if stmt.startswith('$'):
+            section = stmt[1:]
+        elif stmt.startswith('def ') or stmt.startswith('scan '):
+            (kind, name) = stmt.split(None, 1)
+            (block, body) = (section if kind == 'def' else 'SCHED', [])
+        elif stmt in ('enddef', 'endscan'):
+            yield (block, name, body)
+            block = None
+        elif block is not None:
+            body.append(stmt)
+
+def _kv(stmt):
+    (k, _, v) = stmt.partition('=')
+    return (k.strip(), v.strip())
+
+def gmst(mjd):
+    """Greenwich mean sidereal time in hours at *mjd* (UT1 ~ UTC)."""
+    return (18.697374558 + 24.06570982441908 * (np.asarray(mjd) + 2400000.5 - 2451545.0)) % 24.0
+
+def parse_vex(path):
+    """(scans, stations, sources) records of one VEX file."""
+    track = os.path.splitext(os.path.basename(path))[0]
+    with open(path, errors='replace') as f:
+        text = f.read()
+    (scans, stations, sources) = ([], [], [])
+    for (block, name, body) in _statements(text):
+        kv = [_kv(s) for s in body]
+        if block == 'SITE':
+            d = dict(kv)
+            if 'site_position' not in d:
+                continue
+            xyz = [float(p.replace('m', '')) for p in d['site_position'].split(':')[:3]]
+            stations.append({'track': track, 'site_ID': d.get('site_ID', name), 'site_name': d.get('site_name', name),
+                             'x': xyz[0], 'y': xyz[1], 'z': xyz[2]})
+        elif block == 'SOURCE':
+            d = dict(kv)
+            if 'ra' not in d:
+                continue
+            sources.append({'track': track, 'source': d.get('source_name', name),
+                            'ra': _angle(d['ra'], hours=True), 'dec': _angle(d['dec'])})
+        elif block == 'SCHED':
+            (start, source, sites, stop) = (None, None, [], 0.0)
+            for (k, v) in kv:
+                if k == 'start':
+                    start = _vex_time(v)
+                elif k == 'source':
+                    source = v
+                elif k == 'station':
+                    fields = [x.strip() for x in v.split(':')]
+                    sites.append(fields[0])
+                    stop = max(stop, float(fields[2].split()[0]))
+            if start is None:
+                continue
+            scans.append({'track': track, 'scan_name': name, 'scan_id': start.strftime('%j-%H%M'),
+                          'start': start, 'duration': stop, 'source': source, 'stations': ' '.join(sites)})
+    return (scans, stations, sources)
+
+def read_array(path):
+    """array.txt as a table (header line starting with #)."""
+    with open(path) as f:
+        cols = f.readline().lstrip('#').split()
+    return pd.read_csv(path, sep=r'\s+', comment='#', names=cols, header=None)
+
+def _cf_table(metadir):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(metadir, 'cf', 'cf*'))):
+        name = os.path.basename(path)
+        m = re.match(r'cf(\d+)_([^_]+)_(.*)', name)
+        rows.append({'name': name, 'step': int(m.group(1)) if m else None, 'band': m.group(2) if m else None,
+                     'path': os.path.relpath(path, metadir)})
+    return pd.DataFrame(rows, columns=['name', 'step', 'band', 'path'])
+
+def uv_table(scans, stations, sources):
+    """Projected (u, v) in meters of every baseline of every scan at the scan start. The baseline
+    is the pair of two-letter VEX site_IDs in schedule order (e.g. Aa-Ax); to join an alist, map its
+    one-letter station codes to site_IDs first and match on (scan_id, baseline)."""
+    pos = stations.set_index(['track', 'site_ID'])[['x', 'y', 'z']]
+    src = sources.set_index(['track', 'source'])[['ra', 'dec']]
+    rows = []
+    for s in scans.itertuples():
+        if (s.track, s.source) not in src.index:
+            continue
+        (ra, dec) = src.loc[(s.track, s.source)]
+        # Greenwich hour angle of the source (baselines are in the Earth fixed frame)
+        h = np.radians(s.gmst * 15.0) - ra
+        sites = [x for x in s.stations.split() if (s.track, x) in pos.index]
+        for (i, a) in enumerate(sites):
+            for b in sites[i + 1:]:
+                (bx, by, bz) = pos.loc[(s.track, b)].to_numpy() - pos.loc[(s.track, a)].to_numpy()
+                rows.append({'track': s.track, 'scan_id': s.scan_id, 'baseline': f'{a}-{b}',
+                             'u': np.sin(h) * bx + np.cos(h) * by,
+                             'v': -np.sin(dec) * np.cos(h) * bx + np.sin(dec) * np.sin(h) * by + np.cos(dec) * bz})
+    return pd.DataFrame(rows, columns=['track', 'scan_id', 'baseline', 'u', 'v'])
+
+def compile_index(metadir):
+    """Dict of the metadata tables of *metadir* (see module docstring)."""
+    (scans, stations, sources) = ([], [], [])
+    for path in sorted(glob.glob(os.path.join(metadir, 'vex', '*.vex'))):
+        (sc, st, so) = parse_vex(path)
+        scans += sc
+        stations += st
+        sources += so
+    scans = pd.DataFrame(scans, columns=['track', 'scan_name', 'scan_id', 'start', 'duration', 'source', 'stations'])
+    scans['mjd'] = (scans.start - datetime(1858, 11, 17)).dt.total_seconds() / 86400.0
+    scans['gmst'] = gmst(scans.mjd)
+    stations = pd.DataFrame(stations, columns=['track', 'site_ID', 'site_name', 'x', 'y', 'z'])
+    sources = pd.DataFrame(sources, columns=['track', 'source', 'ra', 'dec'])
+    arrayf = os.path.join(metadir, 'array.txt')
+    return {
+        'scans': scans,
+        'stations': stations,
+        'sources': sources,
+        'baselines': uv_table(scans, stations, sources),
+        'array': read_array(arrayf) if os.path.isfile(arrayf) else pd.DataFrame(),
+        'cf': _cf_table(metadir),
+    }
+
+def _manifest(metadir):
+    """(relative path, size, mtime) of the source files of the index."""
+    paths = glob.glob(os.path.join(metadir, 'vex', '*.vex')) + glob.glob(os.path.join(metadir, 'array.txt')) + \
+        glob.glob(os.path.join(metadir, 'cf', 'cf*'))
+    return sorted((os.path.relpath(p, metadir), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths)
+
+def load(metadir, cachedir=DEFAULT_CACHEDIR):
+    """Metadata tables of *metadir*, from the cache unless a source file changed."""
+    metadir = os.path.abspath(metadir)
+    cache = os.path.join(cachedir, hashlib.sha1(metadir.encode()).hexdigest()[:16] + '.pkl')
+    manifest = _manifest(metadir)
+    try:
+        with open(cache, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['version'] == VERSION and cached['manifest'] == manifest:
+            return cached['tables']
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+    logger.info(f"Compiling the metadata index of {metadir}")
+    tables = compile_index(metadir)
+    os.makedirs(cachedir, exist_ok=True)
+    tmp = f'{cache}.{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': VERSION, 'metadir': metadir, 'manifest': manifest, 'tables': tables}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache)
+    return tables
+
+def add_scan_info(df, index, cols=('track', 'scan_name', 'duration', 'gmst')):
+    """*df* (an alist frame with a scan_id column) joined with the given columns of the scan
+    table; scans missing from the schedule get NaN."""
+    scans = index['scans'].drop_duplicates('scan_id').set_index('scan_id')[list(cols)]
+    return df.join(scans.rename(columns={c: 'vex_' + c for c in cols}), on='scan_id')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the metadata index of a METADIR')
+    parser.add_argument('metadir', nargs='?', default=os.environ.get('METADIR'), help='metadata directory (default: $METADIR)')
+    parser.add_argument('-c', '--cachedir', type=str, default=DEFAULT_CACHEDIR, help='cache directory')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+    if args.metadir is None:
+        parser.error("METADIR not set")
+
+    tables = load(args.metadir, args.cachedir)
+    for (name, table) in tables.items():
+        print(f"{name:<10s} {len(table):>8d} rows")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""Dry-run planner predicting the cost of a pipeline run before it is submitted.
+
+``record`` reads the logs of finished stage directories (or of all stages below the given
+directories, e.g. hops-b1) and stores their measured costs in a history file (--history):
+
+- fourfit: seconds of every task from the GNU parallel joblog (log/parallel.log), or, for a SLURM
+  job array, the elapsed time and MaxRSS of every array task from sacct (the array id is read from
+  log/parallel.time), together with the size of the corel files of the root file;
+- alist: seconds of every scan from log/alist.parallel.log;
+- the steps tracked in log/progress (share/progress.py): wall time per expt_no;
+- other: the rest of the wall time of the stage (first to last file in log/), per expt_no;
+- disk: bytes of the regular files written in the stage directory, per corel byte for the
+  fringe-fitting stages, per expt_no otherwise.
+
+Recording a stage directory again replaces its previous entries.
+
+``predict`` reads the pipeline configuration (settings.config), inventories the root files,
+corel files, baselines and expt_nos of every band in SRCDIR/CORRDAT (band and FILTERSTRING
+selection as in 2.link, earlier CORRDAT releases taking precedence, -haxp directories ignored)
+and predicts, for every configured stage of every band, the number of fourfit SLURM array tasks,
+the CPU and wall time, the peak memory of a fourfit task and the disk footprint. The costs of a
+stage come from the history entries of the same stage, then of any stage of the same kind, then
+from rough built-in defaults (marked as such). The summary gives the allocation time of the SLURM
+job of each band (with a --margin) against the time limit of the job script, and the JOBARRAY_CAP
+needed to bring fourfit under --target-hours in every stage.
+
+    plan_campaign.py record hops-b1 hops-b2
+    plan_campaign.py predict settings.config --job ehthops_slurm.job -o plan.json
+"""
+import os
+import re
+import glob
+import stat
+import json
+import math
+import time
+import fnmatch
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ehthops', 'plan_history.json')
+# root files as selected by 3.fourfit, corel files <baseline>..<rootcode>
+ROOTFILE = '??[!.]*.??????'
+COREL = re.compile(r'^[A-Za-z0-9]{2}\.\.[^.]{6}$')
+EXPT = re.compile(r'^\d{4,}$')
+FRINGE_STAGE = re.compile(r'^[0-5]\.')
+# progress steps of the post-processing stages without history
+STEPS = {'6': ('convert',), '7': ('applycal',), '8': ('gainratiocal',)}
+# limits of the fourfit array tasks submitted by 3.fourfit
+ARRAY_MEM = 4 << 30
+ARRAY_TIME = 4 * 3600
+# rough costs used without any history
+DEFAULTS = {
+    'fourfit': {'seconds_per_byte': 30.0 / (1 << 30), 'task_seconds': 30.0, 'max_seconds': 600.0, 'peak_rss': None},
+    'alist': {'seconds_per_task': 1.0},
+    'other': {'seconds_per_day': 600.0},
+    'disk': {'bytes_per_input_byte': 0.05, 'bytes_per_day': 2 << 30},
+    # post-processing steps, wall time per expt_no
+    'convert': {'seconds_per_day': 900.0},
+    'applycal': {'seconds_per_day': 600.0},
+    'gainratiocal': {'seconds_per_day': 600.0},
+}
+
+def read_config(path):
+    """Key/value pairs of a pipeline configuration file, read like ehthops_pipeline.sh does."""
+    config = {}
+    with open(path) as f:
+        for line in f:
+            (key, _, value) = line.partition('=')
+            key = key.strip()
+            if not key or key.startswith('#'):
+                continue
+            config[key] = value.strip().strip('"\'')
+    return config
+
+def band_patterns(obsyear):
+    """hops-bx directory band -> band string of the archive paths (lo/hi in 2017)."""
+    if str(obsyear) == '2017':
+        return {'b3': 'lo', 'b4': 'hi'}
+    return {b: b for b in ('b1', 'b2', 'b3', 'b4')}
+
+def _scan_files(scandir):
+    """Root files of a scan directory, with the bytes and baselines of the corel files of their rootcode."""
+    (roots, corel) = ([], {})
+    for entry in os.scandir(scandir):
+        if COREL.match(entry.name):
+            (nbytes, nbl) = corel.get(entry.name[-6:], (0, 0))
+            try:
+                corel[entry.name[-6:]] = (nbytes + entry.stat().st_size, nbl + 1)
+            except OSError:
+                pass
+        elif fnmatch.fnmatchcase(entry.name, ROOTFILE):
+            roots.append(entry.name)
+    return [(r, r[-6:]) + corel.get(r[-6:], (0, 0)) for r in roots]
+
+def _scandirs(top):
+    """<expt_no>/<scan> directories below *top*."""
+    for (dirpath, dirnames, _) in os.walk(top):
+        if EXPT.match(os.path.basename(dirpath)):
+            yield from (os.path.join(dirpath, d) for d in sorted(dirnames))
+            dirnames[:] = []
+        else:
+            dirnames[:] = sorted(d for d in dirnames if 'haxp' not in d)
+
+def inventory(srcdir, corrdat, nproc=None):
+    """One row per root file of the archive: path of the scan directory relative to SRCDIR,
+    priority of its CORRDAT release, expt_no, scan, root file, corel bytes and baselines of its
+    rootcode."""
+    items = [(i, d) for (i, cd) in enumerate(corrdat.split(':')) for d in _scandirs(os.path.join(srcdir, cd))]
+    with ThreadPoolExecutor(max_workers=nproc or 16) as pool:
+        files = pool.map(lambda item: _scan_files(item[1]), items)
+        rows = [(os.path.relpath(d, srcdir), i, os.path.basename(os.path.dirname(d)), os.path.basename(d)) + f
+                for ((i, d), fs) in zip(items, files) for f in fs]
+    return pd.DataFrame(rows, columns=['path', 'priority', 'expt_no', 'scan', 'rootfile', 'rootcode', 'corel_bytes', 'baselines'])
+
+def select(inv, band, filterstring=''):
+    """Root files of *band* (band string of the archive paths), as linked by 2.link."""
+    parents = '/' + inv.path.str.rsplit('/', n=2).str[0] + '/'
+    keep = parents.str.contains(f'[-_/]{re.escape(band)}[-_/]', regex=True)
+    if filterstring:
+        keep &= parents.str.contains(filterstring, regex=True)
+    sel = inv[keep]
+    # a scan present in several releases is taken from the first one in CORRDAT
+    first = sel.groupby(['expt_no', 'scan']).priority.transform('min')
+    return sel[sel.priority == first]
+
+def _rss(s):
+    """Bytes of a sacct MaxRSS value (e.g. 102400K)."""
+    m = re.match(r'^([\d.]+)([KMGT]?)$', str(s).strip())
+    if not m:
+        return np.nan
+    return float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2) or ' ')
+
+def _sacct(jobid):
+    """(task, seconds, MaxRSS bytes) of the tasks of a SLURM job array."""
+    out = subprocess.run(['sacct', '-j', jobid, '-P', '-n', '-o', 'JobID,ElapsedRaw,MaxRSS'],
+                         capture_output=True, text=True, timeout=120).stdout
+    tasks = {}
+    for line in out.splitlines():
+        (job, elapsed, rss) = line.split('|')[:3]
+        m = re.match(rf'^{jobid}_(\d+)(\.\w+)?$', job)
+        if not m:
+            continue
+        (secs, peak) = tasks.get(int(m.group(1)), (0.0, np.nan))
+        if m.group(2) is None:
+            secs = float(elapsed or 0)
+        tasks[int(m.group(1))] = (secs, np.fmax(peak, _rss(rss)))
+    return pd.DataFrame([(t, s, r) for (t, (s, r)) in tasks.items()], columns=['task', 'seconds', 'rss'])
+
+def _joblog(path):
+    """Seq, start and runtime of the jobs of a GNU parallel joblog."""
+    df = pd.read_csv(path, sep='\t', usecols=['Seq', 'Starttime', 'JobRuntime'])
+    return df.rename(columns={'Seq': 'task', 'Starttime': 'start', 'JobRuntime': 'seconds'})
+
+def _span(jobs):
+    """Wall time from the first start to the last end of the jobs of a joblog."""
+    return float((jobs.start + jobs.seconds).max() - jobs.start.min()) if len(jobs) else 0.0
+
+def _corel_bytes(rootfile, cache):
+    """Bytes of the corel files of the rootcode of *rootfile* (through the links of DATADIR)."""
+    scandir = os.path.dirname(rootfile)
+    if scandir not in cache:
+        try:
+            cache[scandir] = {r: b for (r, _, b, _) in _scan_files(scandir)}
+        except OSError:
+            cache[scandir] = {}
+    return cache[scandir].get(os.path.basename(rootfile), np.nan)
+
+def _written_bytes(top):
+    """Bytes of the regular files below *top* (the links to the archive are not counted)."""
+    total = 0
+    for (dirpath, _, filenames) in os.walk(top):
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if stat.S_ISREG(st.st_mode):
+                total += st.st_size
+    return total
+
+def _days(stagedir):
+    return len({d for pat in ('*', os.path.join('data', '*')) for d in glob.glob(os.path.join(stagedir, pat))
+                if EXPT.match(os.path.basename(d)) and os.path.isdir(d)})
+
+def record_stage(stagedir):
+    """History entries of a finished stage directory."""
+    stagedir = os.path.abspath(stagedir)
+    (stage, band) = (os.path.basename(stagedir), os.path.basename(os.path.dirname(stagedir)).replace('hops-', ''))
+    entry = lambda step, **kw: dict(stage=stage, band=band, step=step, source=stagedir, recorded=time.time(), **kw)
+    logs = os.path.join(stagedir, 'log')
+    (entries, measured) = ([], 0.0)
+    days = _days(stagedir)
+
+    input_bytes = np.nan
+    if FRINGE_STAGE.match(stage) and os.path.isfile(os.path.join(logs, 'filelist.txt')):
+        with open(os.path.join(logs, 'filelist.txt')) as f:
+            rootfiles = f.read().split()
+        tasks = None
+        m = None
+        if os.path.isfile(os.path.join(logs, 'parallel.time')):
+            with open(os.path.join(logs, 'parallel.time')) as f:
+                m = re.search(r'Fourfit array (\d+) completed in (\d+)s', f.read())
+        if m:
+            try:
+                tasks = _sacct(m.group(1))
+                measured += float(m.group(2))
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"{stagedir}: sacct failed for array {m.group(1)}: {e}")
+        elif os.path.isfile(os.path.join(logs, 'parallel.log')):
+            tasks = _joblog(os.path.join(logs, 'parallel.log'))
+            tasks['rss'] = np.nan
+        if tasks is not None and len(tasks):
+            cache = {}
+            tasks = tasks[(tasks.task >= 1) & (tasks.task <= len(rootfiles))]
+            tasks = tasks.assign(bytes=[_corel_bytes(rootfiles[t - 1], cache) for t in tasks.task])
+            sized = tasks[tasks.bytes > 0]
+            input_bytes = float(sum(b for b in (_corel_bytes(r, cache) for r in rootfiles) if b > 0))
+            if not m:
+                measured += _span(tasks)
+            entries.append(entry('fourfit', tasks=len(tasks), cpu_seconds=float(tasks.seconds.sum()),
+                                 sized_seconds=float(sized.seconds.sum()), sized_bytes=float(sized.bytes.sum()),
+                                 median_seconds=float(tasks.seconds.median()), max_seconds=float(tasks.seconds.max()),
+                                 peak_rss=None if tasks.rss.isna().all() else float(tasks.rss.max())))
+        if os.path.isfile(os.path.join(logs, 'alist.parallel.log')):
+            scans = _joblog(os.path.join(logs, 'alist.parallel.log'))
+            if len(scans):
+                measured += _span(scans)
+                entries.append(entry('alist', tasks=len(scans), seconds_per_task=float(scans.seconds.mean())))
+
+    for path in sorted(glob.glob(os.path.join(logs, 'progress', '*.json'))):
+        with open(path) as f:
+            state = json.load(f)
+        if 'step' not in state or state['step'] == 'fourfit' or not state.get('end') or not state.get('total'):
+            continue
+        wall = state['end'] - state['start']
+        measured += wall
+        if days:
+            entries.append(entry(state['step'], progress=True, tasks=state['total'], seconds_per_day=wall / days))
+
+    mtimes = [os.path.getmtime(p) for p in glob.glob(os.path.join(logs, '*')) if os.path.isfile(p)]
+    if mtimes and days:
+        entries.append(entry('other', days=days, seconds_per_day=max(0.0, max(mtimes) - min(mtimes) - measured) / days))
+    written = _written_bytes(stagedir)
+    if input_bytes > 0:
+        entries.append(entry('disk', bytes_per_input_byte=written / input_bytes))
+    elif days:
+        entries.append(entry('disk', bytes_per_day=written / days))
+    return entries
+
+def load_history(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def record(dirs, history):
+    entries = load_history(history)
+    stagedirs = sorted({os.path.abspath(os.path.dirname(p)) for d in dirs for pat in ('', '*', os.path.join('*', '*'))
+                        for p in glob.glob(os.path.join(d, pat, 'log'))})
+    for stagedir in stagedirs:
+        new = record_stage(stagedir)
+        logger.info(f"{stagedir}: {', '.join(e['step'] for e in new) or 'nothing to record'}")
+        if new:
+            entries = [e for e in entries if e['source'] != stagedir] + new
+    os.makedirs(os.path.dirname(os.path.abspath(history)), exist_ok=True)
+    tmp = f'{history}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(entries, f, indent=1)
+    os.replace(tmp, history)
+
+def cost(history, stage, step):
+    """(aggregated costs of *step*, origin) from the entries of *stage*, of any stage of the same kind
+    (fringe-fitting or post-processing), or the defaults."""
+    kind = bool(FRINGE_STAGE.match(stage))
+    for (origin, rows) in (('stage', [e for e in history if e['step'] == step and e['stage'] == stage]),
+                           ('any stage', [e for e in history if e['step'] == step and bool(FRINGE_STAGE.match(e['stage'])) == kind])):
+        if not rows:
+            continue
+        if step == 'fourfit':
+            (secs, nbytes) = (sum(e['sized_seconds'] for e in rows), sum(e['sized_bytes'] for e in rows))
+            rss = [e['peak_rss'] for e in rows if e.get('peak_rss')]
+            return ({'seconds_per_byte': secs / nbytes if nbytes else None,
+                     'task_seconds': sum(e['cpu_seconds'] for e in rows) / sum(e['tasks'] for e in rows),
+                     'max_seconds': max(e['max_seconds'] for e in rows), 'peak_rss': max(rss) if rss else None}, origin)
+        keys = {k for e in rows for k in e if k.endswith(('_per_task', '_per_day', '_per_input_byte'))}
+        return ({k: float(np.mean([e[k] for e in rows if k in e])) for k in keys}, origin)
+    return (DEFAULTS.get(step), 'default')
+
+def plan_stage(stage, sel, history, cpus, cap):
+    """Predicted costs of one stage of one band."""
+    (days, scans) = (sel.expt_no.nunique(), len(sel.drop_duplicates(['expt_no', 'scan'])))
+    (corel, other) = (float(sel.corel_bytes.sum()), cost(history, stage, 'other'))
+    (disk, disk_origin) = cost(history, stage, 'disk')
+    out = {'stage': stage, 'days': days, 'origins': {'other': other[1], 'disk': disk_origin}}
+    wall = other[0].get('seconds_per_day', DEFAULTS['other']['seconds_per_day']) * days
+    if 'bytes_per_input_byte' in disk and corel:
+        out['disk_bytes'] = disk['bytes_per_input_byte'] * corel
+    else:
+        out['disk_bytes'] = disk.get('bytes_per_day', DEFAULTS['disk']['bytes_per_day']) * days
+
+    if FRINGE_STAGE.match(stage):
+        ((ff, ff_origin), (al, al_origin)) = (cost(history, stage, 'fourfit'), cost(history, stage, 'alist'))
+        if ff.get('seconds_per_byte'):
+            task_secs = np.where(sel.corel_bytes > 0, sel.corel_bytes * ff['seconds_per_byte'], ff['task_seconds'])
+        else:
+            task_secs = np.full(len(sel), ff['task_seconds'])
+        cpu = float(task_secs.sum())
+        conc = min(cap, len(sel)) if cap else cpus
+        longest = max(ff.get('max_seconds') or 0.0, float(task_secs.max()) if len(sel) else 0.0)
+        ff_wall = max(cpu / max(1, conc), longest) if len(sel) else 0.0
+        wall += ff_wall + al.get('seconds_per_task', DEFAULTS['alist']['seconds_per_task']) * scans / cpus
+        out.update({'root_files': len(sel), 'scans': scans, 'corel_bytes': corel,
+                    'slurm_tasks': len(sel) if cap else 0, 'fourfit_cpu_seconds': cpu,
+                    'fourfit_wall_seconds': ff_wall, 'fourfit_longest_seconds': longest, 'peak_rss': ff.get('peak_rss')})
+        out['origins'].update({'fourfit': ff_origin, 'alist': al_origin})
+        if cap and longest > ARRAY_TIME:
+            out.setdefault('warnings', []).append(f"fourfit tasks may exceed the {ARRAY_TIME // 3600}h limit of the array tasks")
+        if cap and ff.get('peak_rss') and ff['peak_rss'] > ARRAY_MEM:
+            out.setdefault('warnings', []).append(f"fourfit tasks used up to {ff['peak_rss'] / (1 << 30):.1f}G, more than the 4G of the array tasks")
+
+    # steps tracked by progress.py (notebooks, convert, applycal, gainratiocal)
+    steps = ({e['step'] for e in history if e['stage'] == stage and e.get('progress')}
+             or {e['step'] for e in history if e.get('progress') and bool(FRINGE_STAGE.match(e['stage'])) == bool(FRINGE_STAGE.match(stage))}
+             or set(STEPS.get(stage[0], ())))
+    for step in sorted(steps):
+        (c, origin) = cost(history, stage, step)
+        wall += c.get('seconds_per_day', 0.0) * days
+        out['origins'][step] = origin
+    out['wall_seconds'] = wall
+    return out
+
+def _limit(jobscript):
+    """Time limit in seconds of the #SBATCH -t/--time line of a job script."""
+    with open(jobscript) as f:
+        m = re.search(r'^#SBATCH\s+(?:-t\s+|--time=)(\S+)', f.read(), re.M)
+    if not m:
+        return None
+    # minutes, minutes:seconds, hours:minutes:seconds, days-hours[:minutes[:seconds]]
+    (days, _, hms) = m.group(1).rpartition('-')
+    parts = [int(p) for p in hms.split(':')]
+    if days:
+        parts += [0] * (3 - len(parts))
+    else:
+        parts = [0, parts[0], 0] if len(parts) == 1 else [0] * (3 - len(parts)) + parts
+    return ((int(days or 0) * 24 + parts[0]) * 60 + parts[1]) * 60 + parts[2]
+
+def predict(config, history, bands=None, cpus=10, cap=None, timelimit=None, margin=1.3, target_hours=2.0, nproc=None):
+    stages = config.get('stages', '').split()
+    cap = cap if cap is not None else int(config['SET_JOBARRAY_CAP']) if config.get('SET_JOBARRAY_CAP') else None
+    logger.info(f"Inventory of {config['SET_SRCDIR']} ({config['SET_CORRDAT']})")
+    inv = inventory(config['SET_SRCDIR'], config['SET_CORRDAT'], nproc)
+    logger.info(f"{len(inv)} root files in {inv.expt_no.nunique()} expt_nos")
+    patterns = band_patterns(config.get('SET_OBSYEAR', ''))
+    plan = {'stages': stages, 'jobarray_cap': cap, 'cpus': cpus, 'time_limit': timelimit, 'bands': []}
+    for (band, pattern) in patterns.items():
+        if bands and band not in bands:
+            continue
+        sel = select(inv, pattern, config.get('SET_FILTERSTRING', ''))
+        if not len(sel):
+            continue
+        rows = [plan_stage(s, sel, history, cpus, cap) for s in stages]
+        wall = sum(r['wall_seconds'] for r in rows)
+        plan['bands'].append({'band': band, 'root_files': len(sel), 'days': sel.expt_no.nunique(),
+                              'corel_bytes': float(sel.corel_bytes.sum()),
+                              'baselines_per_scan': float(sel.groupby(['expt_no', 'scan']).baselines.max().mean()),
+                              'stages': rows, 'wall_seconds': wall,
+                              'allocation_seconds': math.ceil(wall * margin / 3600) * 3600,
+                              'disk_bytes': sum(r['disk_bytes'] for r in rows),
+                              'slurm_tasks': sum(r.get('slurm_tasks', 0) for r in rows)})
+    ff = [r for b in plan['bands'] for r in b['stages'] if 'fourfit_cpu_seconds' in r]
+    if ff:
+        need = max(r['fourfit_cpu_seconds'] / (target_hours * 3600) for r in ff)
+        plan['recommended_jobarray_cap'] = min(max(r['root_files'] for r in ff), max(1, math.ceil(need)))
+    plan['wall_seconds'] = sum(b['wall_seconds'] for b in plan['bands'])
+    return plan
+
+def _hms(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+def _size(nbytes):
+    return f'{nbytes / (1 << 30):.1f}G'
+
+def report(plan):
+    print(f"Stages: {' '.join(plan['stages'])}")
+    print(f"fourfit on {'a SLURM job array, JOBARRAY_CAP=' + str(plan['jobarray_cap']) if plan['jobarray_cap'] else 'GNU parallel'}, "
+          f"{plan['cpus']} CPUs for the other steps")
+    for b in plan['bands']:
+        print(f"\nBand {b['band']}: {b['root_files']} root files, {b['days']} expt_nos, {_size(b['corel_bytes'])} of corel files, "
+              f"{b['baselines_per_scan']:.1f} baselines per scan")
+        print(f"  {'stage':<16s} {'tasks':>8s} {'cpu':>10s} {'fourfit':>10s} {'wall':>10s} {'peak mem':>9s} {'disk':>8s}  costs from")
+        for r in b['stages']:
+            peak = _size(r['peak_rss']) if r.get('peak_rss') else '-'
+            origins = ', '.join(sorted({o for o in r['origins'].values()}))
+            print(f"  {r['stage']:<16s} {r.get('slurm_tasks', 0) or r.get('root_files', r['days']):>8d} "
+                  f"{_hms(r.get('fourfit_cpu_seconds', 0)):>10s} {_hms(r.get('fourfit_wall_seconds', 0)):>10s} "
+                  f"{_hms(r['wall_seconds']):>10s} {peak:>9s} {_size(r['disk_bytes']):>8s}  {origins}")
+            for w in r.get('warnings', []):
+                print(f"    WARNING: {w}")
+        print(f"  total: {_hms(b['wall_seconds'])} wall, {b['slurm_tasks']} SLURM array tasks, {_size(b['disk_bytes'])} of disk; "
+              f"allocation {_hms(b['allocation_seconds'])}")
+        if plan['time_limit'] and b['allocation_seconds'] > plan['time_limit']:
+            print(f"  WARNING: more than the time limit of the job ({_hms(plan['time_limit'])}): split the stages over several jobs"
+                  + (" or raise JOBARRAY_CAP" if plan['jobarray_cap'] else " or use a SLURM job array (JOBARRAY_CAP)"))
+    if len(plan['bands']) > 1:
+        print(f"\nAll bands in one job: {_hms(plan['wall_seconds'])} wall", end='')
+        if plan['time_limit'] and plan['wall_seconds'] > plan['time_limit']:
+            print(" (more than the time limit: run the bands as separate jobs)")
+        else:
+            print()
+    if 'recommended_jobarray_cap' in plan:
+        print(f"JOBARRAY_CAP for fourfit within the target time in every stage: {plan['recommended_jobarray_cap']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict the cost of a pipeline run from the archive and the recorded costs of past runs')
+    parser.add_argument('--history', type=str, default=DEFAULT_HISTORY, help='history file of the recorded costs')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('record', help='record the costs of finished stages')
+    p.add_argument('dirs', nargs='+', help='stage directories, or directories holding stages')
+    p = sub.add_parser('predict', help='predict the cost of the stages of a configuration file')
+    p.add_argument('config', help='pipeline configuration file (settings.config)')
+    p.add_argument('-b', '--band', action='append', default=None, help='band to plan (b1-b4, repeatable; default: all)')
+    p.add_argument('-c', '--cpus', type=int, default=None, help='CPUs of the pipeline job (default: from --job, else 10)')
+    p.add_argument('-j', '--jobarray-cap', type=int, default=None, help='JOBARRAY_CAP (default: from the configuration file)')
+    p.add_argument('--job', type=str, default=None, help='SLURM job script (ehthops_slurm.job) for the CPUs and time limit')
+    p.add_argument('--margin', type=float, default=1.3, help='factor applied to the predicted wall time for the allocation')
+    p.add_argument('--target-hours', type=float, default=2.0, help='target wall time of fourfit in a stage for the JOBARRAY_CAP advice')
+    p.add_argument('-n', '--nproc', type=int, default=None, help='number of scan directories read concurrently')
+    p.add_argument('-o', '--output', type=str, default=None, help='also write the plan as JSON to this file')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.command == 'record':
+        record(args.dirs, args.history)
+        return
+    (cpus, timelimit) = (args.cpus, None)
+    if args.job:
+        with open(args.job) as f:
+            m = re.search(r'^#SBATCH\s+--cpus-per-task=(\d+)', f.read(), re.M)
+        cpus = cpus or (int(m.group(1)) if m else None)
+        timelimit = _limit(args.job)
+    history = load_history(args.history)
+    if not history:
+        logger.warning(f"No recorded costs in {args.history}, using the built-in defaults")
+    plan = predict(read_config(args.config), history, args.band, cpus or 10, args.jobarray_cap, timelimit,
+                   args.margin, args.target_hours, args.nproc)
+    report(plan)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(plan, f, indent=1, default=float)
+
+if __name__ == '__main__':
+    main()
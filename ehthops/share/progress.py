@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Progress, throughput and ETA of the long running steps of the stages.
+
+A step announces itself with ``begin`` (number of tasks and the file its tasks append a line to
+when they finish), and ``end`` records when it is over; both write log/progress/<step>.json in
+the stage directory. The tasks themselves only append to the done file (fourfit writes the root
+file to log/fourfit.done, the per-day steps the expt_no, 5.check the notebook name), so that
+reporting costs nothing while the step runs.
+
+``status`` reads the steps of the given stage directories (or of all stages below them, e.g. a
+hops-b1 directory or the directory holding all bands) and prints the completed/total tasks,
+throughput and ETA of every step, and, inside a SLURM job, the time left in the allocation with a
+warning when a running step is not expected to finish within it. ``--output`` writes the same as
+JSON and ``--watch`` refreshes both every given number of seconds. 3.fourfit keeps
+log/progress/status.json up to date this way while fourfit runs.
+
+    progress.py begin fourfit --total 12345 --donefile log/fourfit.done
+    progress.py end fourfit
+    progress.py status hops-b1 hops-b2 --watch 60
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import subprocess
+
+PROGRESSDIR = os.path.join('log', 'progress')
+# stage directories below the given ones in which steps are looked for
+PATTERNS = ['', '*', os.path.join('*', '*')]
+
+def _statefile(step, stagedir='.'):
+    return os.path.join(stagedir, PROGRESSDIR, step + '.json')
+
+def _write(path, state):
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+def begin(step, total, donefile=None, keep=False):
+    os.makedirs(PROGRESSDIR, exist_ok=True)
+    donefile = os.path.abspath(donefile or os.path.join(PROGRESSDIR, step + '.done'))
+    if not keep:
+        open(donefile, 'w').close()
+    _write(_statefile(step), {'step': step, 'total': int(total), 'donefile': donefile, 'start': time.time(), 'end': None})
+
+def end(step):
+    path = _statefile(step)
+    with open(path) as f:
+        state = json.load(f)
+    state['end'] = time.time()
+    _write(path, state)
+
+def _count(donefile):
+    try:
+        with open(donefile) as f:
+            # a task retried after a failure is counted once
+            return len(set(l.strip() for l in f if l.strip()))
+    except OSError:
+        return 0
+
+def slurm_time_left():
+    """Seconds left in the allocation of the current SLURM job, None outside of SLURM."""
+    jobid = os.environ.get('SLURM_JOB_ID')
+    if not jobid:
+        return None
+    try:
+        left = subprocess.run(['squeue', '-h', '-j', jobid, '-o', '%L'], capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    # [days-]hours:minutes:seconds, minutes:seconds, or UNLIMITED
+    (days, _, hms) = left.rpartition('-')
+    try:
+        parts = [int(p) for p in hms.split(':')]
+    except ValueError:
+        return None
+    while len(parts) < 3:
+        parts.insert(0, 0)
+    return ((int(days or 0) * 24 + parts[0]) * 60 + parts[1]) * 60 + parts[2]
+
+def step_status(path, now):
+    with open(path) as f:
+        state = json.load(f)
+    done = _count(state['donefile'])
+    elapsed = (state['end'] or now) - state['start']
+    rate = done / elapsed if elapsed > 0 else 0.0
+    remaining = max(0, state['total'] - done)
+    eta = None if state['end'] or not rate else remaining / rate
+    return {
+        'stage': os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(path)))),
+        'step': state['step'], 'done': done, 'total': state['total'],
+        'running': state['end'] is None, 'elapsed': elapsed, 'rate': rate, 'eta': eta,
+    }
+
+def status(stagedirs):
+    now = time.time()
+    paths = sorted(set(p for d in stagedirs for pat in PATTERNS
+                       for p in glob.glob(os.path.join(d, pat, PROGRESSDIR, '*.json')) if not p.endswith('status.json')))
+    steps = [step_status(p, now) for p in paths]
+    return {'time': now, 'slurm_time_left': slurm_time_left(), 'steps': steps}
+
+def _hms(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return f'{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+def report(st, out=sys.stdout):
+    out.write(f"{'stage':<40s} {'step':<14s} {'done':>13s} {'%':>6s} {'tasks/min':>10s} {'elapsed':>10s} {'eta':>10s}\n")
+    for s in st['steps']:
+        stage = s['stage'] if len(s['stage']) <= 40 else '...' + s['stage'][-37:]
+        pct = 100.0 * s['done'] / s['total'] if s['total'] else 100.0
+        state = _hms(s['eta']) if s['running'] else 'done'
+        out.write(f"{stage:<40s} {s['step']:<14s} {s['done']:>6d}/{s['total']:<6d} {pct:>6.1f} {60 * s['rate']:>10.2f} "
+                  f"{_hms(s['elapsed']):>10s} {state:>10s}\n")
+    left = st['slurm_time_left']
+    if left is not None:
+        out.write(f"SLURM allocation time left: {_hms(left)}\n")
+        for s in st['steps']:
+            if s['running'] and s['eta'] is not None and s['eta'] > left:
+                out.write(f"WARNING: {s['step']} in {s['stage']} is expected to need {_hms(s['eta'])}, "
+                          f"more than the time left in the allocation\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Progress, throughput and ETA of the pipeline steps')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('begin', help='start tracking a step of the stage in the current directory')
+    p.add_argument('step', help='step name')
+    p.add_argument('-t', '--total', type=int, required=True, help='number of tasks of the step')
+    p.add_argument('-d', '--donefile', type=str, default=None, help='file the tasks append a line to when done (default: log/progress/STEP.done)')
+    p.add_argument('--keep', action='store_true', help='do not truncate the done file')
+    p = sub.add_parser('end', help='mark a step of the stage in the current directory as finished')
+    p.add_argument('step', help='step name')
+    p = sub.add_parser('status', help='show the progress of the steps')
+    p.add_argument('stagedirs', nargs='*', default=['.'], help='stage directories, or directories holding stages')
+    p.add_argument('-o', '--output', type=str, default=None, help='also write the status as JSON to this file')
+    p.add_argument('-w', '--watch', type=float, default=None, help='refresh every WATCH seconds')
+    p.add_argument('-q', '--quiet', action='store_true', help='do not print (with --output)')
+
+    args = parser.parse_args()
+    if args.command == 'begin':
+        begin(args.step, args.total, args.donefile, args.keep)
+    elif args.command == 'end':
+        end(args.step)
+    else:
+        while True:
+            st = status(args.stagedirs)
+            if args.output:
+                _write(args.output, st)
+            if not args.quiet:
+                report(st)
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+            if not args.quiet:
+                sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Run a Python script under a profiler.
+
+The stage scripts call their Python steps through the run_profiled shell function of 0.launch,
+which runs the step unchanged unless PYPROFILE (SET_PYPROFILE) is set, in which case the step is
+run through this wrapper with the profile files written to log/profile/<name>.*:
+
+- ``cprofile``: deterministic profile of the main thread with cProfile, written as <name>.prof
+  (for pstats, snakeviz, flameprof, ...) and <name>.txt (the functions with the largest
+  cumulative time);
+- ``sample``: statistical profile of all threads, sampled every --interval seconds by a
+  background thread, written as <name>.folded in the collapsed stack format read by
+  flamegraph.pl and speedscope (one line per distinct stack, frames separated by ';', followed by
+  the number of samples).
+
+The script is given as a path, as the name of a script on the PATH (link_hops_scans.py, the marimo
+entry point), as ``-m module`` or as ``-`` for a script read from the standard input, and runs
+with the given arguments as its sys.argv. Processes forked by the script are not profiled;
+run_notebooks.py (--profile) therefore profiles every notebook in its own forked process with
+profiled() and is not wrapped itself.
+
+    pyprofile.py --mode sample -o log/profile/qa_headless $SHRDIR/qa_headless.py --datadir ...
+    python - << EOF   ->   pyprofile.py -o log/profile/average - << EOF
+"""
+import os
+import sys
+import time
+import runpy
+import shutil
+import pstats
+import cProfile
+import argparse
+import threading
+from collections import Counter
+
+MODES = ('cprofile', 'sample')
+
+class Sampler(threading.Thread):
+    """Collect the stacks of all other threads every *interval* seconds."""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.done.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for (stack, n) in self.stacks.most_common():
+                f.write(f'{stack} {n}\n')
+
+def profiled(mode, output, func, interval=0.005, label=''):
+    """Call func() under the *mode* profiler and write the profile files to *output*.*."""
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    start = time.perf_counter()
+    if mode == 'cprofile':
+        prof = cProfile.Profile()
+        prof.enable()
+    else:
+        prof = Sampler(interval)
+        prof.start()
+    try:
+        return func()
+    finally:
+        elapsed = time.perf_counter() - start
+        if mode == 'cprofile':
+            prof.disable()
+            prof.dump_stats(output + '.prof')
+            with open(output + '.txt', 'w') as f:
+                f.write(f'# {label}: {elapsed:.2f} s\n')
+                pstats.Stats(prof, stream=f).sort_stats('cumulative').print_stats(40)
+        else:
+            prof.done.set()
+            prof.join()
+            prof.write(output + '.folded')
+
+def _target(script, module):
+    """(function running the script, sys.argv[0])."""
+    if module:
+        return (lambda: runpy.run_module(script, run_name='__main__', alter_sys=True), script)
+    if script == '-':
+        code = compile(sys.stdin.read(), '<stdin>', 'exec')
+        return (lambda: exec(code, {'__name__': '__main__', '__file__': '<stdin>'}), '-')
+    if not os.path.exists(script) and shutil.which(script):
+        script = shutil.which(script)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    return (lambda: runpy.run_path(script, run_name='__main__'), script)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a Python script under a profiler')
+    parser.add_argument('-o', '--output', type=str, required=True, help='output prefix of the profile files')
+    parser.add_argument('--mode', choices=MODES, default='cprofile', help='deterministic (cprofile) or sampling profiler')
+    parser.add_argument('--interval', type=float, default=0.005, help='sampling interval in seconds')
+    parser.add_argument('-m', dest='module', action='store_true', help='run SCRIPT as a module')
+    parser.add_argument('script', help='script path, script on the PATH, module (with -m) or - for the standard input')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the script')
+
+    args = parser.parse_args()
+
+    (run, argv0) = _target(args.script, args.module)
+    sys.argv = [argv0] + args.args
+    status = 0
+    try:
+        profiled(args.mode, args.output, run, args.interval, ' '.join(sys.argv))
+    except SystemExit as e:
+        status = e.code
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
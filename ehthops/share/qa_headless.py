@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Headless QA analytics for a fringe-fitting stage.
+
+Runs the same computations as the summary_plots_* notebooks (coherence loss, R-L and RR-LL
+delay outliers, polarization fractions and trivial closure phases) without making any figures,
+and writes the outlier tables as Parquet files plus a JSON file with summary metrics that can
+be used to gate a stage before (or instead of) rendering the notebooks to HTML.
+"""
+import os
+import sys
+import json
+import argparse
+import logging
+
+# no figures are made here, so never let matplotlib (imported by eat) pick an interactive backend
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+import pandas as pd
+from eat.io import util
+from eat.hops import util as hu
+import alistio
+import alistschema
+import qakernels
+
+logger = logging.getLogger(__name__)
+
+# cutoffs used by the summary notebooks
+SNR_CUTOFF = 7.0
+COH_OUTLIER = 0.8
+COH_OUTLIER_SNR = 20.0
+LROFFSET_THRES = 0.0002
+LRSTD_THRES = 5.0
+LLRROFFSET_THRES = 0.000050
+LLRRSTD_THRES = 5.0
+BIS_SNR_CUTOFF = 3.0
+CPHASE_NSIGMA = 3.0
+
+def load_alist(datadir, alistf):
+    """Read an alist file and pre-process it the same way as the summary notebooks."""
+    a = util.noauto(alistio.read_alist(datadir, alistf))
+    util.fix(a)
+    util.add_days(a)
+    util.add_path(a)
+    util.add_scanno(a)
+    return alistschema.compact(a)
+
+def load_alist_v6(datadir):
+    """Read alist.v6 once with all the columns needed by the delay and polfrac checks."""
+    a = util.noauto(alistio.read_alist(datadir, 'alist.v6'))
+    util.fix(a)
+    util.unwrap_mbd(a)
+    util.add_days(a)
+    util.add_delayerr(a)
+    util.add_path(a)
+    util.add_scanno(a)
+    util.add_gmst(a)
+    return alistschema.compact(a)
+
+def coherence(datadir):
+    """30s/2s coherent amplitude ratio (summary_plots_coherence)."""
+    a0 = load_alist(datadir, 'alist.v6.2s.avg')
+    a1 = load_alist(datadir, 'alist.v6.30s.avg')
+
+    a = qakernels.coherence_ratio(a0, a1)
+
+    a_snrcut = qakernels.snr_cut(a, SNR_CUTOFF, drop_sites='R')
+    outliers = a_snrcut[(a_snrcut.coh < COH_OUTLIER) & (a_snrcut.snr > COH_OUTLIER_SNR)]
+    hisnr = a_snrcut[a_snrcut.snr > COH_OUTLIER_SNR]
+
+    summary = {
+        'rows': len(a_snrcut),
+        'outliers': len(outliers),
+        'median_coh': float(a_snrcut.coh.median()) if len(a_snrcut) else None,
+        'median_coh_hisnr': float(hisnr.coh.median()) if len(hisnr) else None,
+    }
+    return outliers[['expt_no', 'scan_id', 'source', 'baseline', 'snr', 'coh']], summary
+
+def rldelay(a):
+    """R-L delay offsets at each site (summary_plots_rldelay)."""
+    a_snrcut = qakernels.snr_cut(a, SNR_CUTOFF, drop_baselines={'RS', 'SR'}).copy()
+
+    (p, stats, errors) = qakernels.rl_segmented_per_site(a_snrcut, restarts=hu.restarts)
+    if len(p):
+        outliers = p.loc[qakernels.rl_outliers(p, LROFFSET_THRES, LRSTD_THRES), ['site', 'expt_no', 'scan_id', 'source', 'timetag', 'baseline', 'ref_pol', 'mbd_unwrap', 'LR_offset', 'LR_offset_wrap']].reset_index(drop=True)
+    else:
+        outliers = pd.DataFrame()
+
+    summary = {
+        'sites': p.site.nunique() + len(errors),
+        'outliers': len(outliers),
+        'outliers_per_site': outliers.groupby('site').size().to_dict() if len(outliers) else {},
+        'errors': errors,
+    }
+    return outliers, summary
+
+def rrlldelay(a):
+    """RR-LL delay offsets on each baseline (summary_plots_rrlldelay)."""
+    a_snrcut = qakernels.snr_cut(a, SNR_CUTOFF, drop_baselines={'RS', 'SR'}).copy()
+    a_snrcut['polarization'] = qakernels.relabel(a_snrcut.polarization, qakernels.MIXED_TO_PARALLEL)
+
+    (p, stats) = hu.rrll_segmented(alistschema.expand(a_snrcut), restarts=hu.restarts)
+    outliers = (p.LLRR_offset.abs() > LLRROFFSET_THRES) & (p.LLRR_std.abs() > LLRRSTD_THRES)
+    outlier_data = p.loc[outliers, "expt_no scan_id source timetag mbd_unwrap LLRR_offset LLRR_std".split()]
+
+    summary = {
+        'rows': len(p),
+        'outliers': int(outliers.sum()),
+        'rms_std': float(np.sqrt(np.mean(p.LLRR_std**2))) if len(p) else None,
+    }
+    return outlier_data.reset_index(), stats.reset_index(), summary
+
+def polfrac(a):
+    """Fractional polarization from the four polarization products (summary_plots_polfrac)."""
+    a_snrcut = qakernels.snr_cut(a, SNR_CUTOFF, drop_sites='R')
+    q = qakernels.polfrac(a_snrcut, index_cols='expt_no scan_no gmst timetag baseline source u v'.split())
+    if q.empty:
+        return q, {'rows': 0}
+
+    summary = {
+        'rows': len(q),
+        'median_fpol_per_source': q.groupby('source', observed=True).fpol.median().to_dict(),
+        'unphysical': int((q.fpol > 1.0).sum()),
+    }
+    return q, summary
+
+def cphase(datadir, a):
+    """Deviation of the trivial (zero-baseline) closure phases from zero (summary_plots_cphase)."""
+    ll = alistio.read_tlist(datadir, 'alist.v6.8s.LL.close.avg')
+    ll['polarization'] = 'LL'
+    rr = alistio.read_tlist(datadir, 'alist.v6.8s.RR.close.avg')
+    rr['polarization'] = 'RR'
+
+    df_close = pd.concat((ll, rr), ignore_index=True)
+    util.add_gmst(df_close)
+    hu.setparity(df_close)
+    util.fix(df_close)
+    df_close = alistschema.compact(df_close)
+    tup2scanno = a.groupby(['expt_no', 'scan_id'], observed=True).first().scan_no
+    df_close = df_close.join(tup2scanno, on=['expt_no', 'scan_id'], how='left')
+
+    trivial = {t for t in set(df_close.triangle) if (('A' in t and 'X' in t) or ('S' in t and 'J' in t)) and 'R' not in t}
+    df = qakernels.cphase_cut(df_close, BIS_SNR_CUTOFF)
+    df = df[df.triangle.isin(trivial)].copy()
+    # the closure phase error in degrees is 1/snr radians
+    df['nsigma'] = np.abs(df.bis_phas) * df.bis_snr * np.pi / 180.0
+    outliers = df[df.nsigma > CPHASE_NSIGMA]
+
+    summary = {
+        'triangles': len(trivial),
+        'rows': len(df),
+        'outliers': len(outliers),
+        'rms_phase_per_triangle': df.groupby('triangle', observed=True).bis_phas.apply(lambda x: float(np.sqrt(np.mean(x**2)))).to_dict(),
+    }
+    return outliers[['expt_no', 'scan_id', 'scan_no', 'source', 'triangle', 'polarization', 'bis_phas', 'bis_snr', 'nsigma']], summary
+
+def write_table(df, outdir, name):
+    """Write a table as Parquet, falling back to CSV if no Parquet engine is installed."""
+    try:
+        fname = os.path.join(outdir, name + '.parquet')
+        df.to_parquet(fname, index=False)
+    except ImportError:
+        fname = os.path.join(outdir, name + '.csv')
+        logger.warning(f"No Parquet engine available, writing {fname} instead.")
+        df.to_csv(fname, index=False)
+    return os.path.basename(fname)
+
+def run(datadir, outdir, checks):
+    """Run the requested checks, write their tables to *outdir* and return the summary dict."""
+    os.makedirs(outdir, exist_ok=True)
+    summary = {'datadir': os.path.abspath(datadir), 'checks': {}}
+
+    a = None
+    for check in checks:
+        logger.info(f"Running {check}...")
+        try:
+            if check in ('rldelay', 'rrlldelay', 'polfrac', 'cphase') and a is None:
+                a = load_alist_v6(datadir)
+
+            if check == 'coherence':
+                (outliers, result) = coherence(datadir)
+                tables = {'coherence_outliers': outliers}
+            elif check == 'rldelay':
+                (outliers, result) = rldelay(a)
+                tables = {'rldelay_outliers': outliers}
+            elif check == 'rrlldelay':
+                (outliers, stats, result) = rrlldelay(a)
+                tables = {'rrlldelay_outliers': outliers, 'rrlldelay_stats': stats}
+            elif check == 'polfrac':
+                (q, result) = polfrac(a)
+                tables = {'polfrac': q}
+            elif check == 'cphase':
+                (outliers, result) = cphase(datadir, a)
+                tables = {'cphase_trivial_outliers': outliers}
+
+            result['status'] = 'ok'
+            result['tables'] = [write_table(df, outdir, name) for (name, df) in tables.items()]
+        except Exception as e:
+            logger.error(f"{check} failed: {e}")
+            result = {'status': 'error', 'error': str(e)}
+        summary['checks'][check] = result
+
+    with open(os.path.join(outdir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2, default=str)
+
+    return summary
+
+CHECKS = ['coherence', 'rldelay', 'rrlldelay', 'polfrac', 'cphase']
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the summary notebook QA metrics without plotting')
+    parser.add_argument('-d', '--datadir', type=str, default=os.environ.get('DATADIR'), help='directory with the alist files (default: $DATADIR)')
+    parser.add_argument('-o', '--outdir', type=str, default='qa', help='output directory for the tables and summary.json')
+    parser.add_argument('-c', '--checks', nargs='+', choices=CHECKS, default=CHECKS, help='checks to run (default: all)')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.datadir is None:
+        parser.error("DATADIR not set; pass --datadir")
+
+    summary = run(args.datadir, args.outdir, args.checks)
+
+    # non-zero exit status if any check could not be computed
+    if any(result['status'] != 'ok' for result in summary['checks'].values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
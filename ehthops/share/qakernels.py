@@ -0,0 +1,180 @@
+"""Computational kernels and plotting helpers shared by the summary notebooks and qa_headless.py.
+
+The functions here work on whole alist frames at once (one grouped pass instead of one boolean
+scan of the full frame per site, baseline or triangle) and return plain tables that the notebooks
+then plot. Station tests on the baseline and triangle columns use the bitmask of compacted frames
+(see alistschema) or are evaluated once per distinct value and broadcast back to the rows. bench_qakernels.py checks the kernels against the original
+notebook code and times them on synthetic alists.
+"""
+import numpy as np
+import pandas as pd
+
+import figpool
+from alistschema import expand, has_station, add_stations
+
+# mixedpol products relabelled to the parallel hand they contain for the RR-LL delay test
+MIXED_TO_PARALLEL = {'XL': 'LL', 'YL': 'LL', 'XR': 'RR', 'YR': 'RR'}
+# the two disjoint sets of products used to compute the fractional polarization, with the
+# (cross1, cross2, par1, par2) products of fpol = sqrt(cross1*cross2 / (par1*par2))
+POLFRAC_PRODUCTS = {
+    'circ': ('LR', 'RL', 'LL', 'RR'),
+    'mixed': ('XR', 'YL', 'XL', 'YR'),
+}
+# principal diagonal products averaged for the coherence test ('L' before 'R' for circular
+# polarizations, so that both lin-circ and circ-lin products are included)
+COHERENCE_POLS = {'RR', 'LL', 'YR', 'XL', 'RY', 'LX'}
+
+def wide(w=8, h=3):
+    import matplotlib.pyplot as plt
+    plt.setp(plt.gcf(), figwidth=w, figheight=h)
+    plt.tight_layout()
+
+def tightx():
+    import matplotlib.pyplot as plt
+    plt.autoscale(enable=True, axis='x', tight=True)
+
+def multline(xs, fun=None):
+    import matplotlib.pyplot as plt
+    fun = fun or plt.axvline
+    for x in xs: fun(x, alpha=0.25, ls='--', color='k')
+
+def toiter(x):
+    return(x if hasattr(x, '__iter__') else [x,])
+
+def relabel(col, mapping):
+    """Same as col.replace(mapping) for a string column, evaluated once per distinct value."""
+    (codes, uniq) = pd.factorize(col, sort=False)
+    return pd.Series(np.append(np.array([mapping.get(v, v) for v in uniq], dtype=object), None)[codes], index=col.index)
+
+def snr_cut(a, snr=7.0, drop_sites='', drop_baselines=()):
+    """Rows of *a* with snr above *snr*, without the baselines to any of *drop_sites* and without
+    the baselines in *drop_baselines*."""
+    keep = (a.snr > snr).to_numpy()
+    if drop_sites:
+        keep = keep & ~has_station(a, drop_sites).to_numpy()
+    if drop_baselines:
+        keep = keep & ~a.baseline.isin(set(drop_baselines)).to_numpy()
+    return a[keep]
+
+def expt_boundaries(a):
+    """Scan numbers halfway between consecutive expt_nos (the dashed lines of the trend plots)."""
+    last_scans = a.groupby('expt_no', sort=True, observed=True).scan_no.max()  # Find the 'max' scan_no for each expt_no
+    return (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+
+def coherence_ratio(a0, a1):
+    """Ratio between the 30s (a1) and 2s (a0) amplitudes of the principal diagonal products,
+    averaged over polarization on each baseline and scan."""
+    group_cols = 'expt_no source scan_id baseline'.split()
+    # the station bitmask is not averaged but set again on the result
+    a0_1 = a0[a0.polarization.isin(COHERENCE_POLS)].drop(columns=['stations'], errors='ignore')
+    a0_1 = a0_1.groupby(group_cols, observed=True).mean(numeric_only=True)
+    # only the averaged snr and amplitude of the 30s data are needed
+    a1_1 = a1[a1.polarization.isin(COHERENCE_POLS)].groupby(group_cols, observed=True)[['snr', 'amp']].mean()
+    a = a0_1.join(a1_1.rename(columns={'snr': 'snr1', 'amp': 'amp1'}), how='left')
+    a['coh'] = a.amp1 / a.amp
+    a = a.reset_index().dropna()
+    return add_stations(a) if 'stations' in a0 else a
+
+def polfrac(a, index_cols='expt_no scan_no gmst timetag baseline source u v'.split()):
+    """Fractional polarization (and its error) from the SNRs of the four products of every row
+    uniquely identified by *index_cols*, for circular and mixedpol data.
+
+    Same result as pivot_table(aggfunc='first', index=index_cols, columns='polarization') but the
+    rows are reshaped from sorted integer (index, polarization) keys. Rows without all four
+    products are dropped. Returns one row per index with snr_<pol>, fpol and fpol_err columns.
+    """
+    a = a.dropna(subset=index_cols + ['snr'])
+    frames = []
+    for pols in POLFRAC_PRODUCTS.values():
+        sub = a[a.polarization.isin(set(pols))]
+        if sub.empty:
+            continue
+        # integer key of the index (in sorted order) and of the product of every row
+        key = sub.groupby(index_cols, sort=True, observed=True).ngroup().to_numpy()
+        pol = pd.Categorical(sub.polarization, categories=pols).codes.astype(np.int64)
+        # first row of every (index, product) like aggfunc='first'
+        (_, first) = np.unique(key * len(pols) + pol, return_index=True)
+        snr = np.full((key.max() + 1, len(pols)), np.nan)
+        snr[key[first], pol[first]] = sub.snr.to_numpy()[first]
+        # keep the indexes with all the products
+        full = ~np.isnan(snr).any(axis=1)
+        (_, rows) = np.unique(key, return_index=True)
+        p = sub.iloc[rows[full]][index_cols].reset_index(drop=True)
+        snr = snr[full]
+        for (i, name) in sorted(enumerate(pols), key=lambda x: x[1]):
+            p['snr_' + name] = snr[:, i]
+        (c1, c2, p1, p2) = snr.T
+        p['fpol'] = np.sqrt(c1 * c2 / (p1 * p2))
+        p['fpol_err'] = np.sqrt(2.0 / (p1 * p2))
+        frames.append(p)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def cphase_cut(df_close, threshold=3, min_duration=8 * 5):
+    """Closure phases with bis_snr above *threshold* on triangles without R that are averaged
+    over more than *min_duration* seconds."""
+    keep = (df_close.bis_snr > threshold).to_numpy() & (df_close.duration > min_duration).to_numpy()
+    keep = keep & ~has_station(df_close, 'R', col='triangle').to_numpy()
+    return df_close[keep]
+
+def triangle_groups(df, triangles, pols=('LL', 'RR')):
+    """Dict of the rows of *df* for every (triangle, polarization) in *triangles* x *pols*, from one
+    groupby instead of one boolean scan per pair; missing pairs map to an empty frame."""
+    sub = df[df.triangle.isin(set(triangles)) & df.polarization.isin(set(pols))]
+    groups = dict(tuple(sub.groupby(['triangle', 'polarization'], sort=False, observed=True)))
+    return {(tri, pol): groups.get((tri, pol), df.iloc[:0]) for tri in triangles for pol in pols}
+
+def site_frames(a, sites=None):
+    """Split *a* into one frame per site holding the rows of all baselines to that site.
+
+    The rows are grouped by baseline once; each site frame is then assembled from the row
+    positions of its baselines instead of scanning the whole frame with baseline.str.contains.
+    """
+    groups = a.groupby('baseline', sort=False, observed=True).indices
+    if sites is None:
+        sites = sorted(set().union(*groups))
+    frames = {}
+    for site in sites:
+        idx = [groups[bl] for bl in groups if site in bl]
+        frames[site] = a.iloc[np.sort(np.concatenate(idx))] if idx else a.iloc[:0]
+    return frames
+
+def _rl_site(rl_segmented, site, a_site, restarts):
+    try:
+        return rl_segmented(expand(a_site), site, restarts=restarts)
+    except Exception as e:
+        return e
+
+def rl_segmented_per_site(a, sites=None, restarts=None, processes=None):
+    """R-L delay offsets for every site, as a parallel map of eat's hu.rl_segmented over the sites.
+
+    hu.rl_segmented is still called once per site, but on the rows of the baselines to that site
+    only (split from one groupby, see site_frames) instead of the whole alist, and the sites run
+    concurrently in the figpool workers. Returns (p, stats, errors) where p and stats are the
+    per-site results concatenated with a leading 'site' column and errors maps the sites that
+    could not be processed to the error message.
+    """
+    from eat.hops import util as hu
+
+    restarts = {} if restarts is None else restarts
+    frames = site_frames(a, sites)
+    results = figpool.render_png(_rl_site, [(hu.rl_segmented, site, df, restarts) for (site, df) in frames.items()], processes)
+
+    (ps, stats, errors) = ({}, {}, {})
+    for (site, res) in zip(frames, results):
+        if isinstance(res, Exception):
+            errors[site] = str(res)
+            continue
+        (ps[site], stats[site]) = res
+
+    if not ps:
+        return (pd.DataFrame(columns=['site']), pd.DataFrame(columns=['site']), errors)
+    p = pd.concat(ps, names=['site']).reset_index(level='site')
+    s = pd.concat(stats, names=['site']).reset_index(level='site')
+    return (p, s, errors)
+
+def rl_outliers(p, lroffset_thres=0.0002, lrstd_thres=5.0):
+    """Boolean mask of the R-L delay outliers in *p*, ignoring the 1.45 ns offset on baselines to
+    the (ALMA) L station."""
+    lroffset = np.abs(p.LR_offset)
+    return (lroffset > lroffset_thres) & (np.abs(p.LR_std) > lrstd_thres) & \
+        ~(p.baseline.str.contains('L') & (np.abs(lroffset - 0.00145) < lroffset_thres))
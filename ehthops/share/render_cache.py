@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Cache of rendered summary notebooks used by 5.check.
+
+A rendered HTML file is keyed on the hash of the notebook source, the source of the helper
+modules it imports from the same directory (directly or through other helper modules), the content
+of the alist files it reads from DATADIR and, for the notebooks querying the campaign alist
+dataset, the manifest of $ALISTDATASET. If nothing changed since the last export, the cached HTML
+is copied to the output location and the notebook is not executed again.
+
+Usage:
+    render_cache.py fetch NOTEBOOK HTML  # copy the cached HTML to HTML, exit status 1 on a miss
+    render_cache.py store NOTEBOOK HTML  # store a freshly exported HTML in the cache
+"""
+import os
+import re
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+
+# alist file names (or glob patterns) read by a notebook, e.g. 'alist.v6.2s.avg' or "alist.v6"
+INPUT_PATTERN = re.compile(r"""['"](alist\.v6[^'"\s]*)['"]""")
+IMPORT_PATTERN = re.compile(r"^\s*(?:from|import)\s+(\w+)", re.MULTILINE)
+
+STATCACHE = 'filehashes.json'
+
+def local_imports(path):
+    """Local modules (next to *path*) imported by the source file *path*."""
+    with open(path) as f:
+        source = f.read()
+    srcdir = os.path.dirname(os.path.abspath(path))
+    return set(os.path.join(srcdir, m + '.py') for m in IMPORT_PATTERN.findall(source)
+               if os.path.isfile(os.path.join(srcdir, m + '.py')))
+
+def notebook_inputs(nbpath):
+    """Return the alist files declared in the notebook and the local modules it imports,
+    including those imported by these modules in turn."""
+    with open(nbpath) as f:
+        source = f.read()
+
+    inputs = sorted(set(INPUT_PATTERN.findall(source)))
+    modules = set()
+    todo = local_imports(nbpath) - {os.path.abspath(nbpath)}
+    while todo:
+        path = todo.pop()
+        modules.add(path)
+        todo |= local_imports(path) - modules - {os.path.abspath(nbpath)}
+    return inputs, sorted(modules)
+
+def file_hash(path, statcache):
+    """sha256 of a file, reusing the previous value if its size and mtime are unchanged."""
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    entry = statcache.get(path)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha256']
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 24), b''):
+            h.update(chunk)
+    statcache[path] = {'stamp': stamp, 'sha256': h.hexdigest()}
+    return h.hexdigest()
+
+def cache_key(nbpath, datadir, cachedir):
+    """Hash of the notebook, its local modules and all its input files."""
+    fname = os.path.join(cachedir, STATCACHE)
+    try:
+        with open(fname) as f:
+            statcache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        statcache = {}
+
+    (inputs, modules) = notebook_inputs(nbpath)
+    h = hashlib.sha256()
+    for path in [os.path.abspath(nbpath)] + modules:
+        h.update(os.path.basename(path).encode())
+        h.update(file_hash(path, statcache).encode())
+    for pattern in inputs:
+        h.update(pattern.encode())
+        matches = sorted(glob.glob(os.path.join(datadir, pattern)))
+        if not matches:
+            h.update(b'missing')
+        for path in matches:
+            h.update(os.path.basename(path).encode())
+            h.update(file_hash(os.path.abspath(path), statcache).encode())
+    # notebooks reading the campaign alist dataset change with its manifest (see alistdataset.py)
+    with open(nbpath) as f:
+        if 'query_dataset' in f.read():
+            manifest = os.path.join(os.environ.get('ALISTDATASET', ''), '_manifest.json')
+            h.update(file_hash(os.path.abspath(manifest), statcache).encode() if os.path.isfile(manifest) else b'no dataset')
+
+    # written atomically since several notebooks may be processed in parallel
+    tmp = f'{fname}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(statcache, f)
+    os.replace(tmp, fname)
+
+    return h.hexdigest()
+
+def cached_html(nbpath, key, cachedir):
+    name = os.path.splitext(os.path.basename(nbpath))[0]
+    return os.path.join(cachedir, f'{name}.{key}.html')
+
+def fetch(nbpath, html, datadir, cachedir):
+    """Copy the cached HTML for the notebook to *html*. Returns False on a cache miss."""
+    src = cached_html(nbpath, cache_key(nbpath, datadir, cachedir), cachedir)
+    if not os.path.isfile(src):
+        return False
+    shutil.copyfile(src, html)
+    return True
+
+def store(nbpath, html, datadir, cachedir):
+    """Store *html* in the cache, replacing older renders of the same notebook."""
+    dst = cached_html(nbpath, cache_key(nbpath, datadir, cachedir), cachedir)
+    name = os.path.splitext(os.path.basename(nbpath))[0]
+    for old in glob.glob(os.path.join(cachedir, f'{name}.*.html')):
+        os.remove(old)
+    shutil.copyfile(html, dst + '.tmp')
+    os.replace(dst + '.tmp', dst)
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache of rendered summary notebooks')
+    parser.add_argument('action', choices=['fetch', 'store'], help='fetch a cached render or store a new one')
+    parser.add_argument('notebook', type=str, help='path to the marimo notebook')
+    parser.add_argument('html', type=str, help='path to the rendered HTML file')
+    parser.add_argument('-d', '--datadir', type=str, default=os.environ.get('DATADIR'), help='directory with the alist files (default: $DATADIR)')
+    parser.add_argument('-c', '--cachedir', type=str, required=True, help='cache directory')
+
+    args = parser.parse_args()
+    if args.datadir is None:
+        parser.error("DATADIR not set; pass --datadir")
+    os.makedirs(args.cachedir, exist_ok=True)
+
+    if args.action == 'fetch':
+        if not fetch(args.notebook, args.html, args.datadir, args.cachedir):
+            sys.exit(1)
+    else:
+        store(args.notebook, args.html, args.datadir, args.cachedir)
+
+if __name__ == '__main__':
+    main()
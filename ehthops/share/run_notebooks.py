@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Execute and export all summary notebooks from one warm interpreter.
+
+The heavy imports (pandas, matplotlib, seaborn, eat, marimo) and the alist files read by the
+notebooks are loaded once in this process. Every notebook is then exported to HTML in a process
+forked from it, so each notebook starts with the imports done and the parsed alist frames shared
+copy-on-write (see alistio.preload) instead of paying the start-up and parsing cost itself.
+
+Renders of notebooks whose source and inputs have not changed are reused from the render cache
+when --cachedir is given. With --profile (cprofile or sample) the warm-up and every notebook are
+profiled in their own process into --profiledir (see pyprofile.py).
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import logging
+import subprocess
+import multiprocessing
+import multiprocessing.connection
+
+SHRDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SHRDIR)
+
+import pyprofile
+import render_cache
+
+logger = logging.getLogger(__name__)
+
+def warm_up(datadir, alistfs):
+    """Import the modules common to all notebooks and parse the alists they read."""
+    import numpy, pandas, scipy.stats
+    import matplotlib
+    import matplotlib.pyplot
+    import seaborn
+    from eat.io import hops, util
+    from eat.hops import util as hu
+    from eat.plots import util as pu
+    import marimo
+    import alistio
+
+    alistio.preload(datadir, alistfs)
+
+def export_html(nbpath, html, logfile, errfile):
+    """Export one notebook to HTML inside the current (forked) process."""
+    with open(logfile, 'w') as out, open(errfile, 'w') as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            from marimo._cli.cli import main as marimo_cli
+        except ImportError:
+            # fall back to a separate marimo process (without the warm-up benefit)
+            return subprocess.call(['marimo', 'export', 'html', nbpath, '--output', html])
+        # an HTML file left by an earlier run must not pass for this export
+        if os.path.exists(html):
+            os.remove(html)
+        try:
+            # without standalone mode click returns the exit code instead of raising SystemExit
+            rc = marimo_cli(['export', 'html', nbpath, '--output', html], standalone_mode=False)
+        except SystemExit as e:
+            rc = 1 if isinstance(e.code, str) else e.code
+        except Exception as e:
+            print(f"Error exporting {nbpath}: {e}", file=sys.stderr)
+            return 1
+        rc = rc if isinstance(rc, int) else 0
+        if rc == 0 and not os.path.isfile(html):
+            print(f"Error exporting {nbpath}: {html} not written", file=sys.stderr)
+            return 1
+    return rc
+
+def _html(nbpath, outdir):
+    return os.path.join(outdir, os.path.splitext(os.path.basename(nbpath))[0] + '.html')
+
+def _run(nbpath, outdir, logdir, profile=None, profiledir=None):
+    """Body of the forked process of one notebook; its exit code is the one of the export."""
+    fname = os.path.basename(nbpath)
+    export = lambda: export_html(nbpath, _html(nbpath, outdir), os.path.join(logdir, f'{fname}.log'), os.path.join(logdir, f'{fname}.err'))
+    if profile:
+        rc = pyprofile.profiled(profile, os.path.join(profiledir, os.path.splitext(fname)[0]), export, label=nbpath)
+    else:
+        rc = export()
+    sys.exit(rc if isinstance(rc, int) else 1)
+
+def run_forked(todo, outdir, logdir, nproc, profile=None, profiledir=None):
+    """Run every notebook of *todo* in its own process forked from this one, *nproc* at a time,
+    and yield (nbpath, exit code, seconds) as they finish.
+
+    Plain (non-daemonic) processes are used instead of a Pool so that the notebooks can start
+    their own figure pools (figpool).
+    """
+    ctx = multiprocessing.get_context('fork')
+    (queue, running) = (list(todo), {})
+    while queue or running:
+        while queue and len(running) < nproc:
+            nbpath = queue.pop(0)
+            proc = ctx.Process(target=_run, args=(nbpath, outdir, logdir, profile, profiledir), name=os.path.basename(nbpath))
+            proc.start()
+            running[proc.sentinel] = (proc, nbpath, time.time())
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            (proc, nbpath, t0) = running.pop(sentinel)
+            proc.join()
+            yield (nbpath, proc.exitcode, time.time() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the summary notebooks to HTML from one warm interpreter')
+    parser.add_argument('notebooks', nargs='*', help='notebooks to run (default: summary_*.py next to this script)')
+    parser.add_argument('-d', '--datadir', type=str, default=os.environ.get('DATADIR'), help='directory with the alist files (default: $DATADIR)')
+    parser.add_argument('-o', '--outdir', type=str, default='tests', help='output directory for the HTML files')
+    parser.add_argument('-l', '--logdir', type=str, default='log', help='directory for the per-notebook .log/.err files')
+    parser.add_argument('-c', '--cachedir', type=str, default=None, help='render cache directory (default: no caching)')
+    parser.add_argument('-n', '--nproc', type=int, default=min(7, os.cpu_count() or 1), help='number of notebooks to run concurrently')
+    parser.add_argument('--profile', choices=pyprofile.MODES, default=None, help='profile the warm-up and every notebook')
+    parser.add_argument('--profiledir', type=str, default=os.path.join('log', 'profile'), help='directory for the profile files')
+    parser.add_argument('--donefile', type=str, default=None, help='append the name of every finished notebook to this file (see progress.py)')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.datadir is None:
+        parser.error("DATADIR not set; pass --datadir")
+    # the notebooks read DATADIR from the environment
+    os.environ['DATADIR'] = args.datadir
+    os.makedirs(args.outdir, exist_ok=True)
+    os.makedirs(args.logdir, exist_ok=True)
+
+    notebooks = args.notebooks or sorted(glob.glob(os.path.join(SHRDIR, 'summary_*.py')))
+
+    def done(nbpath):
+        if args.donefile is not None:
+            with open(args.donefile, 'a') as f:
+                f.write(os.path.basename(nbpath) + '\n')
+
+    # reuse cached renders of unchanged notebooks
+    todo = []
+    for nbpath in notebooks:
+        html = _html(nbpath, args.outdir)
+        if args.cachedir is not None:
+            os.makedirs(args.cachedir, exist_ok=True)
+            if render_cache.fetch(nbpath, html, args.datadir, args.cachedir):
+                print(f"{os.path.basename(nbpath)} (unchanged, using cached render)")
+                done(nbpath)
+                continue
+        todo.append(nbpath)
+    if not todo:
+        return
+
+    t0 = time.time()
+    alistfs = sorted(set(f for nbpath in todo for f in render_cache.notebook_inputs(nbpath)[0]))
+    if args.profile:
+        pyprofile.profiled(args.profile, os.path.join(args.profiledir, 'run_notebooks'), lambda: warm_up(args.datadir, alistfs), label='warm-up')
+    else:
+        warm_up(args.datadir, alistfs)
+    logger.info(f"Imports and {len(alistfs)} alist files loaded in {time.time() - t0:.1f}s")
+
+    # share the CPUs between the notebooks running concurrently and their figure pools
+    nproc = max(1, min(args.nproc, len(todo)))
+    os.environ.setdefault('FIGPOOL_NPROC', str(max(1, (os.cpu_count() or 1) // nproc)))
+
+    # one fresh fork of the warm parent per notebook so that notebooks never see each other's state
+    failed = 0
+    for (nbpath, rc, dt) in run_forked(todo, args.outdir, args.logdir, nproc, args.profile, args.profiledir):
+        print(f"{os.path.basename(nbpath)} ({dt:.1f}s)")
+        done(nbpath)
+        if rc != 0:
+            logger.error(f"{nbpath} failed with exit code {rc}")
+            failed += 1
+        elif args.cachedir is not None:
+            render_cache.store(nbpath, _html(nbpath, args.outdir), args.datadir, args.cachedir)
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Stratified sample of the root files of a stage for a quick-look run.
+
+Reads the root files listed by 3.fourfit (DATADIR/<expt_no>/<scan>/<source>.<rootcode>) and
+writes a sample of them, in the original order, such that every expt_no, every source and every
+station present in the full list is covered by at least one sampled scan: scans are first picked
+greedily for the number of expt_nos, sources and stations they add (stations are read from the
+station files <site>..<rootcode> of the scan directory, or from the baseline files), and the
+sample is then filled up to --size by taking scans from the expt_nos in turn. The order of the
+candidates is fixed by a hash of their path and --seed, so the same sample is drawn again for
+the same list.
+
+--size is a fraction of the root files when below 1, otherwise a number of root files; the
+covering scans are kept even if there are more of them than --size.
+
+    sample_rootfiles.py --size 0.05 log/filelist.txt > temp/filelist.sample
+"""
+import os
+import re
+import sys
+import math
+import hashlib
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATION_FILE = re.compile(r'^([A-Za-z0-9])\.\.')
+BASELINE_FILE = re.compile(r'^([A-Za-z0-9])([A-Za-z0-9])\.\.')
+
+def stations(scandir):
+    """Station codes of the station (or baseline) files of a scan directory."""
+    try:
+        names = os.listdir(scandir)
+    except OSError:
+        return set()
+    sites = {m.group(1) for m in map(STATION_FILE.match, names) if m}
+    if not sites:
+        for m in map(BASELINE_FILE.match, names):
+            if m:
+                sites.update(m.groups())
+    return sites
+
+def features(rootfile):
+    """(expt_no, set of expt_no/source/station features) of a root file."""
+    scandir = os.path.dirname(rootfile)
+    expt = os.path.basename(os.path.dirname(scandir))
+    source = os.path.basename(rootfile).rsplit('.', 1)[0]
+    return (expt, {('expt_no', expt), ('source', source)} | {('station', s) for s in stations(scandir)})
+
+def sample(rootfiles, size, seed=0):
+    """Indices (sorted) of the sampled root files."""
+    n = math.ceil(size * len(rootfiles)) if size < 1 else int(size)
+    key = lambda i: hashlib.md5(f'{seed}:{rootfiles[i]}'.encode()).hexdigest()
+    order = sorted(range(len(rootfiles)), key=key)
+    feats = {i: features(rootfiles[i]) for i in order}
+
+    # greedy cover of all the expt_nos, sources and stations
+    uncovered = set().union(*(f for (_, f) in feats.values())) if feats else set()
+    chosen = []
+    while uncovered:
+        best = max(order, key=lambda i: len(feats[i][1] & uncovered))
+        gain = feats[best][1] & uncovered
+        if not gain:
+            break
+        chosen.append(best)
+        uncovered -= gain
+    logger.info(f"{len(chosen)} root files cover all expt_nos, sources and stations")
+
+    # fill up with the expt_nos in turn
+    byexpt = {}
+    for i in order:
+        byexpt.setdefault(feats[i][0], []).append(i)
+    taken = set(chosen)
+    queues = [iter(v) for (_, v) in sorted(byexpt.items())]
+    while len(taken) < n and queues:
+        for q in list(queues):
+            i = next(q, None)
+            if i is None:
+                queues.remove(q)
+            elif i not in taken:
+                taken.add(i)
+                if len(taken) >= n:
+                    break
+    return sorted(taken)
+
+def main():
+    parser = argparse.ArgumentParser(description='Stratified sample of root files covering every expt_no, source and station')
+    parser.add_argument('filelist', help='root files, one per line (log/filelist.txt)')
+    parser.add_argument('-s', '--size', type=float, required=True, help='fraction (below 1) or number of root files to sample')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the candidate order')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    with open(args.filelist) as f:
+        rootfiles = [l.strip() for l in f if l.strip()]
+    idx = sample(rootfiles, args.size, args.seed)
+    sys.stdout.write(''.join(rootfiles[i] + '\n' for i in idx))
+    logger.info(f"Sampled {len(idx)} of {len(rootfiles)} root files")
+
+if __name__ == '__main__':
+    main()
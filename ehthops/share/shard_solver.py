@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""Run a calibration solver (alma_pcal, alma_adhoc, alma_delayoffs, closecf) per expt_no in parallel.
+
+The input alist is split into one alist per expt_no (the header followed by the records of that
+expt_no in their original order). The solver command is run once per shard, with {alist} replaced
+by the shard alist and {out} by the shard output, and the shard outputs are merged in expt_no
+order into --output:
+
+- file outputs (e.g. ``alma_pcal -o {out}``) and the standard output of the solver (--stdout)
+  are concatenated, with the leading comment lines (* or #) common to all shards written once;
+- directory outputs (--dir, e.g. ``alma_adhoc -o {out}``) are combined by moving the per-shard
+  files into --output; files present in several shards (e.g. adhoc_cfcodes) are concatenated
+  like file outputs.
+
+Concatenated control files are only equivalent to the unsharded output if the statements of a
+shard cannot apply to the scans of another one, i.e. if every ``if`` block of the shard outputs
+selects scans. If a shard output has statements outside such blocks (e.g. a plain
+``if station A``), the sharded output is dropped and the solver is run once on the whole alist
+instead (or, with --verify, the outputs are compared as usual).
+
+The standard error of every shard is written to the standard error of this script in expt_no
+order. With --verify the solver is also run once on the whole alist and the script exits with
+a non-zero status if the merged output is not identical; the unsharded output is kept in that case.
+
+    shard_solver.py --alist $DATADIR/alist.v6 --output $DATADIR/cf2_pcal -- alma_pcal {alist} -g -c -o {out}
+"""
+import os
+import sys
+import shutil
+import filecmp
+import argparse
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# position of expt_no in the whitespace separated fields of the alist records (all versions)
+EXPT_FIELD = 7
+# comment lines of the solver outputs, of which the leading ones shared by all shards are the header
+COMMENT_PREFIXES = ('*', '#')
+
+def split_alist(alist, workdir):
+    """Write one alist per expt_no into *workdir*; returns {expt_no: path} in expt_no order."""
+    (header, records) = ([], {})
+    with open(alist) as f:
+        for line in f:
+            if line.startswith('*'):
+                header.append(line)
+                continue
+            fields = line.split()
+            if len(fields) > EXPT_FIELD:
+                records.setdefault(int(fields[EXPT_FIELD]), []).append(line)
+    shards = {}
+    for expt in sorted(records):
+        shards[expt] = os.path.join(workdir, f'{expt}.alist')
+        with open(shards[expt], 'w') as f:
+            f.writelines(header + records[expt])
+    return shards
+
+def run(cmd, alist, out, stdout=False):
+    """Run the solver on *alist* writing to *out*; returns (exit code, standard error)."""
+    args = [a.replace('{alist}', alist).replace('{out}', out) for a in cmd]
+    if stdout:
+        with open(out, 'w') as f:
+            p = subprocess.run(args, stdout=f, stderr=subprocess.PIPE, text=True)
+    else:
+        p = subprocess.run(args, stderr=subprocess.PIPE, text=True)
+    return (p.returncode, p.stderr)
+
+def scan_scoped(path):
+    """True if every statement of the control file *path* is inside an ``if`` block selecting scans."""
+    inblock = False
+    with open(path) as f:
+        for line in f:
+            words = line.split()
+            if not words or words[0].startswith(COMMENT_PREFIXES):
+                continue
+            if words[0] == 'if':
+                if 'scan' not in words:
+                    return False
+                inblock = True
+            elif not inblock:
+                return False
+    return True
+
+def merge_files(paths, outfile):
+    """Concatenate *paths* with the leading comment lines common to all of them written once."""
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.readlines())
+    ncommon = 0
+    if len(texts) > 1:
+        while all(ncommon < len(t) and t[ncommon].startswith(COMMENT_PREFIXES) for t in texts) \
+                and all(t[ncommon] == texts[0][ncommon] for t in texts):
+            ncommon += 1
+    with open(outfile, 'w') as out:
+        for (i, lines) in enumerate(texts):
+            out.writelines(lines if i == 0 else lines[ncommon:])
+
+def shared_files(outs, isdir):
+    """Lists of the shard output files that are concatenated into one merged file."""
+    if not isdir:
+        return [outs] if len(outs) > 1 else []
+    names = {}
+    for d in outs:
+        for (root, _, files) in os.walk(d):
+            for name in files:
+                names.setdefault(os.path.relpath(os.path.join(root, name), d), []).append(os.path.join(root, name))
+    return [paths for paths in names.values() if len(paths) > 1]
+
+def merge_dirs(dirs, outdir):
+    """Combine the shard output directories *dirs* into *outdir* (see module docstring)."""
+    names = {}
+    for d in dirs:
+        for (root, _, files) in os.walk(d):
+            for name in files:
+                rel = os.path.relpath(os.path.join(root, name), d)
+                names.setdefault(rel, []).append(os.path.join(root, name))
+    for (rel, paths) in sorted(names.items()):
+        dest = os.path.join(outdir, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if len(paths) == 1:
+            shutil.move(paths[0], dest)
+        else:
+            merge_files(paths, dest)
+
+def same_output(a, b):
+    if os.path.isdir(a):
+        cmp = filecmp.dircmp(a, b)
+        stack = [cmp]
+        while stack:
+            c = stack.pop()
+            if c.left_only or c.right_only or c.diff_files or c.funny_files:
+                return False
+            (_, mismatch, errors) = filecmp.cmpfiles(c.left, c.right, c.common_files, shallow=False)
+            if mismatch or errors:
+                return False
+            stack.extend(c.subdirs.values())
+        return True
+    return filecmp.cmp(a, b, shallow=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a calibration solver per expt_no in parallel and merge the outputs')
+    parser.add_argument('-a', '--alist', type=str, required=True, help='input alist to shard by expt_no')
+    parser.add_argument('-o', '--output', type=str, required=True, help='merged output file (or directory with --dir)')
+    parser.add_argument('--stdout', action='store_true', help='the solver writes its output to the standard output')
+    parser.add_argument('--dir', action='store_true', help='the solver writes its output to a directory')
+    parser.add_argument('-n', '--nproc', type=int, default=os.cpu_count() or 1, help='number of shards run concurrently')
+    parser.add_argument('--verify', action='store_true', help='also run the solver on the whole alist and check that the outputs are identical')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+    parser.add_argument('cmd', nargs=argparse.REMAINDER, help='solver command after --, with {alist} and {out} placeholders')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+    if not cmd:
+        parser.error("no solver command given")
+    if not args.stdout and not any('{out}' in c for c in cmd):
+        parser.error("the solver command must contain {out} (or use --stdout)")
+
+    workdir = tempfile.mkdtemp(prefix='shard_solver.', dir=os.path.dirname(os.path.abspath(args.output)))
+    try:
+        shards = split_alist(args.alist, workdir)
+        logger.info(f"{' '.join(cmd[:1])}: {len(shards)} expt_no shards")
+
+        outs = {expt: os.path.join(workdir, f'{expt}.out') for expt in shards}
+        if args.dir:
+            for out in outs.values():
+                os.makedirs(out)
+        with ThreadPoolExecutor(max_workers=max(1, args.nproc)) as pool:
+            jobs = {expt: pool.submit(run, cmd, shards[expt], outs[expt], args.stdout) for expt in shards}
+            results = {expt: job.result() for (expt, job) in jobs.items()}
+
+        failed = 0
+        for (expt, (rc, err)) in results.items():
+            sys.stderr.write(err)
+            if rc != 0:
+                logger.error(f"{cmd[0]} failed on expt_no {expt} with exit code {rc}")
+                failed += 1
+        if failed:
+            sys.exit(1)
+
+        # solvers may leave no output for an expt_no without solutions
+        done = [outs[expt] for expt in shards if os.path.exists(outs[expt])]
+        unscoped = [p for paths in shared_files(done, args.dir) for p in paths if not scan_scoped(p)]
+        if unscoped and not args.verify:
+            logger.warning(f"output of {cmd[0]} has statements not restricted to scans ({unscoped[0]}), "
+                           f"running it on the whole alist instead")
+            if args.dir:
+                shutil.rmtree(args.output, ignore_errors=True)
+                os.makedirs(args.output)
+            (rc, err) = run(cmd, os.path.abspath(args.alist), os.path.abspath(args.output), args.stdout)
+            sys.stderr.write(err)
+            if rc != 0:
+                logger.error(f"{cmd[0]} failed on the whole alist with exit code {rc}")
+            sys.exit(rc)
+        if args.dir:
+            os.makedirs(args.output, exist_ok=True)
+            merge_dirs(done, args.output)
+        else:
+            merge_files(done, args.output)
+
+        if args.verify:
+            full = os.path.join(workdir, 'full.out')
+            if args.dir:
+                os.makedirs(full)
+            (rc, err) = run(cmd, os.path.abspath(args.alist), full, args.stdout)
+            if rc != 0:
+                logger.error(f"{cmd[0]} failed on the whole alist with exit code {rc}, output not verified")
+                sys.exit(2)
+            if not same_output(args.output, full):
+                logger.error(f"sharded output of {cmd[0]} differs from the unsharded run, keeping the unsharded output")
+                if args.dir:
+                    shutil.rmtree(args.output)
+                    shutil.copytree(full, args.output)
+                else:
+                    shutil.copyfile(full, args.output)
+                sys.exit(2)
+            logger.info(f"sharded output of {cmd[0]} identical to the unsharded run")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Compute the SEFD tables of a campaign once and share them between the bands.
+
+antab2sefd parses the ANTAB and VEX tables of METADIR and writes SEFD/SEFD_<band>/<expt_no>
+tables for every band, but 7.+apriori/bin/1.antab2sefd runs it again in each hops-bx tree. This
+script keeps the output in a campaign-level directory (SEFDROOT/<key>, where the key is a hash
+of OBSYEAR and of the METADIR tables other than the control files) and links WRKDIR/SEFD to it:
+the first band to run computes the tables while holding a lock, the other bands find them
+already done and only make the link.
+
+The tables also depend on INPUTDIR (the days and uvfits files present), which differs between
+the bands and between runs. A band therefore runs antab2sefd again, and replaces its SEFD_<band>
+tables (adding the missing tables of the other bands), when:
+
+- SEFD_<band> is missing from the shared directory;
+- an expt_no of its INPUTDIR has no table in SEFD_<band>;
+- its INPUTDIR changed since the band last used the tables. The expt_no/uvfits names and mtimes
+  are kept in inputs_<band>.json next to the tables.
+
+With --split, antab2sefd is run on every expt_no (day) of INPUTDIR separately and in parallel,
+each on a view of INPUTDIR holding that expt_no only, and the per-day SEFD tables are merged.
+
+    shared_sefd.py INPUTDIR METADIR WRKDIR OBSYEAR --band b1 --sefdroot ../sefd [--split]
+"""
+import os
+import sys
+import glob
+import json
+import fcntl
+import shutil
+import hashlib
+import argparse
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# METADIR subdirectories that do not affect the SEFD tables
+IGNORE_DIRS = {'cf'}
+
+def metadata_key(metadir, obsyear):
+    """Hash of OBSYEAR and of the names and contents of the METADIR tables."""
+    h = hashlib.sha1(str(obsyear).encode())
+    for (root, dirs, files) in os.walk(metadir):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORE_DIRS)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            h.update(os.path.relpath(path, metadir).encode() + b'\0')
+            with open(path, 'rb') as f:
+                h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()[:16]
+
+def input_listing(inputdir):
+    """Sorted [name, mtime] of the expt_no/uvfits files of INPUTDIR."""
+    files = glob.glob(os.path.join(inputdir, '[0-9]*', '*'))
+    return sorted([os.path.relpath(f, inputdir), os.path.getmtime(f)] for f in files)
+
+def stale(shared, band, inputdir):
+    """Reason to compute the SEFD_<band> tables again for *inputdir*, None if they can be used."""
+    tables = os.path.join(shared, f'SEFD_{band}')
+    if not os.path.isdir(tables):
+        return f"no SEFD_{band} tables"
+    expts = sorted(os.path.basename(d) for d in glob.glob(os.path.join(inputdir, '[0-9]*')) if os.path.isdir(d))
+    missing = [e for e in expts if not os.path.exists(os.path.join(tables, e))]
+    if missing:
+        return f"no SEFD_{band} tables for expt_no {' '.join(missing)}"
+    manifest = os.path.join(shared, f'inputs_{band}.json')
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            if json.load(f) != input_listing(inputdir):
+                return f"{inputdir} changed since the SEFD_{band} tables were made"
+    return None
+
+def antab2sefd(inputdir, metadir, outdir, obsyear, log):
+    """Run antab2sefd writing outdir/SEFD; returns its exit code."""
+    with open(log + '.log', 'w') as out, open(log + '.err', 'w') as err:
+        return subprocess.call(['antab2sefd', inputdir, metadir, outdir, '-v', str(obsyear)], stdout=out, stderr=err)
+
+def compute(inputdir, metadir, obsyear, dest, logdir, split=False, nproc=None):
+    """Compute the SEFD tables into *dest* (the content of a SEFD directory)."""
+    work = tempfile.mkdtemp(prefix='sefd.', dir=os.path.dirname(dest))
+    try:
+        if not split:
+            rc = antab2sefd(inputdir, metadir, work, obsyear, os.path.join(logdir, 'antab2sefd'))
+            if rc != 0:
+                return rc
+            os.replace(os.path.join(work, 'SEFD'), dest)
+            return 0
+
+        expts = sorted(os.path.basename(d) for d in glob.glob(os.path.join(inputdir, '[0-9]*')) if os.path.isdir(d))
+        def day(expt):
+            # view of INPUTDIR with this expt_no only
+            view = os.path.join(work, 'input', expt)
+            os.makedirs(view)
+            os.symlink(os.path.abspath(os.path.join(inputdir, expt)), os.path.join(view, expt))
+            out = os.path.join(work, 'output', expt)
+            os.makedirs(out)
+            return antab2sefd(view, metadir, out, obsyear, os.path.join(logdir, f'antab2sefd-{expt}'))
+        with ThreadPoolExecutor(max_workers=nproc or os.cpu_count() or 1) as pool:
+            rcs = dict(zip(expts, pool.map(day, expts)))
+        for (expt, rc) in rcs.items():
+            if rc != 0:
+                logger.error(f"antab2sefd failed on expt_no {expt} with exit code {rc}")
+                return rc
+
+        # merge SEFD/SEFD_<band>/<expt_no> of all days
+        merged = os.path.join(work, 'SEFD')
+        for expt in expts:
+            src = os.path.join(work, 'output', expt, 'SEFD')
+            for (root, _, files) in os.walk(src):
+                for name in files:
+                    path = os.path.join(root, name)
+                    target = os.path.join(merged, os.path.relpath(path, src))
+                    if os.path.exists(target):
+                        logger.warning(f"{os.path.relpath(path, src)} written by several expt_nos, keeping the first one")
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+        os.replace(merged, dest)
+        return 0
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def link(shared, wrkdir):
+    """Point WRKDIR/SEFD to the shared tables."""
+    sefd = os.path.join(wrkdir, 'SEFD')
+    if os.path.islink(sefd):
+        os.remove(sefd)
+    elif os.path.isdir(sefd):
+        shutil.rmtree(sefd)
+    os.symlink(os.path.abspath(shared), sefd)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the SEFD tables once per campaign and link them into the band stage')
+    parser.add_argument('inputdir', help='INPUTDIR of 7.+apriori (uvfits files organized by expt_no)')
+    parser.add_argument('metadir', help='METADIR with the ANTAB and VEX tables')
+    parser.add_argument('wrkdir', help='working directory of the stage (WRKDIR/SEFD is linked to the shared tables)')
+    parser.add_argument('obsyear', help='observing year')
+    parser.add_argument('-b', '--band', type=str, required=True, help='band of the stage (SEFD_<band> is read by 2.applycal)')
+    parser.add_argument('-s', '--sefdroot', type=str, required=True, help='campaign-level directory holding the shared SEFD tables')
+    parser.add_argument('--split', action='store_true', help='run antab2sefd per expt_no in parallel')
+    parser.add_argument('-n', '--nproc', type=int, default=None, help='number of expt_nos processed concurrently with --split')
+    parser.add_argument('-l', '--logdir', type=str, default='log', help='directory for the antab2sefd .log/.err files')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    os.makedirs(args.sefdroot, exist_ok=True)
+    os.makedirs(args.logdir, exist_ok=True)
+    key = metadata_key(args.metadir, args.obsyear)
+    shared = os.path.join(args.sefdroot, key)
+
+    # the bands running at the same time wait for the first one to compute the tables
+    with open(shared + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        reason = stale(shared, args.band, args.inputdir)
+        if reason is None:
+            logger.info(f"Using the SEFD tables in {shared}")
+        else:
+            logger.info(f"Computing the SEFD tables into {shared} ({reason})")
+            new = shared + '.new'
+            shutil.rmtree(new, ignore_errors=True)
+            rc = compute(args.inputdir, args.metadir, args.obsyear, new, args.logdir, args.split, args.nproc)
+            if rc != 0:
+                logger.error(f"antab2sefd failed with exit code {rc}, see {args.logdir}")
+                sys.exit(rc)
+            # replace the tables of this band, keep those of the other bands and add the missing ones
+            os.makedirs(shared, exist_ok=True)
+            for name in sorted(os.listdir(new)):
+                target = os.path.join(shared, name)
+                if name == f'SEFD_{args.band}':
+                    shutil.rmtree(target, ignore_errors=True)
+                if not os.path.exists(target):
+                    os.replace(os.path.join(new, name), target)
+            shutil.rmtree(new)
+        with open(os.path.join(shared, f'inputs_{args.band}.json'), 'w') as f:
+            json.dump(input_listing(args.inputdir), f)
+    link(shared, args.wrkdir)
+
+if __name__ == '__main__':
+    main()
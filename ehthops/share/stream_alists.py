@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Build alists and provisional QA metrics while fourfit is still running.
+
+Started in the background by 3.fourfit when SET_STREAMING=true. Every fourfit task appends its
+root file to DONEFILE when it finishes. This script follows that file and, as soon as all the root
+files of a scan directory are done, builds the alists of the scan with alist_scan.sh into the
+alist cache of 4.alists (which then only has to merge them). When all the scans of an expt_no are
+built, their alists are merged into QADIR/<expt_no>/alist.v6 and qa_headless.py computes the
+provisional R-L, RR-LL and polarization fraction metrics of that day in the same directory.
+
+3.fourfit creates STOPFILE once all fourfit tasks have ended; the scans still incomplete at that
+point (failed tasks) are built with what is there and the script exits when all work is done.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+SHRDIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+# checks that only need alist.v6 (the segmented and closure alists are made by 4.alists)
+QA_CHECKS = ['rldelay', 'rrlldelay', 'polfrac']
+
+def scan_of(rootfile, datadir):
+    """<expt_no>/<scan> key of the scan directory holding *rootfile*."""
+    return os.path.relpath(os.path.dirname(os.path.abspath(rootfile)), os.path.abspath(datadir))
+
+def build_scan(scan, cachedir):
+    rc = subprocess.call([os.path.join(SHRDIR, 'alist_scan.sh'), cachedir, scan])
+    if rc != 0:
+        logger.error(f"alist_scan.sh failed on {scan} with exit code {rc}")
+    return rc
+
+def merge(frags, outfile):
+    """Concatenate alists: header of the first one, then the records of all."""
+    with open(outfile, 'w') as out:
+        for (i, frag) in enumerate(frags):
+            if not os.path.isfile(frag):
+                continue
+            with open(frag) as f:
+                for line in f:
+                    if i == 0 or not line.startswith('*'):
+                        out.write(line)
+
+def provisional_qa(expt, scans, cachedir, qadir):
+    outdir = os.path.join(qadir, expt)
+    os.makedirs(outdir, exist_ok=True)
+    merge([os.path.join(cachedir, scan.replace('/', '.') + '.v6') for scan in sorted(scans)], os.path.join(outdir, 'alist.v6'))
+    with open(os.path.join(outdir, 'qa_headless.log'), 'w') as log:
+        rc = subprocess.call([sys.executable, os.path.join(SHRDIR, 'qa_headless.py'), '--datadir', outdir, '--outdir', outdir, '--checks'] + QA_CHECKS, stdout=log, stderr=subprocess.STDOUT)
+    logger.info(f"Provisional QA of expt_no {expt} in {outdir} (exit code {rc})")
+    return rc
+
+def follow(donefile, stopfile, poll):
+    """Yield the batches of root files appended to *donefile* until *stopfile* exists; the last
+    batch (possibly empty) is yielded with stop=True."""
+    pos = 0
+    while True:
+        # look for the stop file before reading so that no line written before it is missed
+        stop = os.path.exists(stopfile)
+        lines = []
+        if os.path.exists(donefile):
+            with open(donefile) as f:
+                f.seek(pos)
+                data = f.read()
+            # only consume complete lines
+            end = data.rfind('\n') + 1
+            pos += len(data[:end].encode())
+            lines = [l for l in data[:end].splitlines() if l]
+        yield (lines, stop)
+        if stop:
+            return
+        time.sleep(poll)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build alists and provisional QA metrics as fourfit tasks finish')
+    parser.add_argument('-f', '--filelist', type=str, required=True, help='root files processed by fourfit (log/filelist.txt)')
+    parser.add_argument('-d', '--donefile', type=str, required=True, help='file the fourfit tasks append their finished root file to')
+    parser.add_argument('-s', '--stopfile', type=str, required=True, help='file created when all fourfit tasks have ended')
+    parser.add_argument('-c', '--cachedir', type=str, required=True, help='alist cache directory of 4.alists')
+    parser.add_argument('-q', '--qadir', type=str, required=True, help='output directory for the provisional QA metrics')
+    parser.add_argument('--datadir', type=str, default=os.environ.get('DATADIR'), help='HOPS data directory (default: $DATADIR)')
+    parser.add_argument('-n', '--nproc', type=int, default=max(1, (os.cpu_count() or 1) // 4), help='number of scans built concurrently')
+    parser.add_argument('--poll', type=float, default=10.0, help='seconds between checks of the done file')
+    parser.add_argument('--loglevel', type=str, default='INFO', help='logging level')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel.upper(), format='%(asctime)s %(levelname)s:: %(message)s')
+
+    if args.datadir is None:
+        parser.error("DATADIR not set; pass --datadir")
+    os.makedirs(args.cachedir, exist_ok=True)
+
+    # root files still running in every scan, and scans still to be built in every expt_no
+    pending = {}
+    with open(args.filelist) as f:
+        for rootfile in f.read().split():
+            pending.setdefault(scan_of(rootfile, args.datadir), set()).add(os.path.abspath(rootfile))
+    expts = {}
+    for scan in pending:
+        expts.setdefault(scan.split('/')[0], set()).add(scan)
+    scans_of = {expt: set(scans) for (expt, scans) in expts.items()}
+    logger.info(f"Following {sum(len(r) for r in pending.values())} root files in {len(pending)} scans of {len(expts)} expt_nos")
+
+    builds = {}
+    qa = []
+    with ThreadPoolExecutor(max_workers=args.nproc) as pool:
+        for (lines, stop) in follow(args.donefile, args.stopfile, args.poll):
+            for rootfile in lines:
+                scan = scan_of(rootfile, args.datadir)
+                pending.get(scan, set()).discard(os.path.abspath(rootfile))
+            # build every scan whose fourfit tasks have all finished (or all remaining ones at the end)
+            for scan in [s for (s, r) in pending.items() if stop or not r]:
+                del pending[scan]
+                builds[scan] = pool.submit(build_scan, scan, args.cachedir)
+            # provisional QA of every expt_no whose scans are all built
+            for (expt, scans) in list(expts.items()):
+                if all(s in builds and builds[s].done() for s in scans) or stop:
+                    del expts[expt]
+                    for s in scans:
+                        builds[s].result()
+                    qa.append(pool.submit(provisional_qa, expt, scans_of[expt], args.cachedir, args.qadir))
+        for q in qa:
+            q.result()
+
+    failed = sum(1 for b in builds.values() if b.result() != 0)
+    logger.info(f"Built the alists of {len(builds) - failed} scans ({failed} failed)")
+
+if __name__ == '__main__':
+    main()
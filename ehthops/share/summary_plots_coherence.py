@@ -17,14 +17,14 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, alistschema, os, util):
     # Define variables and load data
     alist0 = 'alist.v6.2s.avg'
     alist1 = 'alist.v6.30s.avg'
     datadir = os.environ['DATADIR']
 
-    a0 = util.noauto(hops.read_alist(os.path.join(datadir, alist0)))
-    a1 = util.noauto(hops.read_alist(os.path.join(datadir, alist1)))
+    a0 = util.noauto(alistio.read_alist(datadir, alist0))
+    a1 = util.noauto(alistio.read_alist(datadir, alist1))
 
     # Pre-process the alist files for easier manipulation
     util.fix(a0)
@@ -36,25 +36,20 @@ def _(hops, os, util):
     util.add_days(a1)
     util.add_path(a1)
     util.add_scanno(a1)
+
+    # Categorical string columns, compact numeric types and station bitmasks
+    a0 = alistschema.compact(a0)
+    a1 = alistschema.compact(a1)
     return a0, a1
 
 
 @app.cell
-def _(a0, a1):
-    # Compute the ratio between the amplitudes of the 30s and the 2s alist files
-    idx_cols = 'expt_no source scan_id baseline polarization'.split()
-    # Set MultiIndex columns and group by the same columns (except polarization) for averaging
-    group_cols = 'expt_no source scan_id baseline'.split()
-    a0_1 = a0[a0.polarization.isin({'RR', 'LL', 'YR', 'XL', 'RY', 'LX'})].set_index(idx_cols).groupby(group_cols).mean(numeric_only=True)
-    a1_1 = a1[a1.polarization.isin({'RR', 'LL', 'YR', 'XL', 'RY', 'LX'})].set_index(idx_cols).groupby(group_cols).mean(numeric_only=True)
-    # Filter the data to include only the correlation products in the principal diagonal and compute the mean.
-    # With the convention 'L' before 'R' for circular polarizations, we account for both 'lin-circ' and 'circ-lin' correlation products.
-    a0_1['snr1'] = a1_1.snr
-    a0_1['amp1'] = a1_1.amp
-    a0_1['coh'] = a0_1.amp1 / a0_1.amp
-    # Add some columns to a0 from a1 for easier manipulation later
-    # Compute the amplitude ratio
-    a = a0_1.reset_index().dropna()
+def _(a0, a1, qakernels):
+    # Compute the ratio between the amplitudes of the 30s and the 2s alist files.
+    # The principal diagonal products are averaged over polarization on each baseline and scan
+    # (with the convention 'L' before 'R' for circular polarizations, both 'lin-circ' and
+    # 'circ-lin' correlation products are included) and the 30s snr and amp are joined as snr1, amp1.
+    a = qakernels.coherence_ratio(a0, a1)
     return (a,)
 
 
@@ -94,19 +89,17 @@ def _(mo):
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # data filters
     snr_cutoff = 7  # reasonable SNR cutoff for filtering
-    a_snrcut = a[(a.snr > snr_cutoff) & ~a.baseline.str.contains('R')]
+    a_snrcut = qakernels.snr_cut(a, snr_cutoff, drop_sites='R')
     return (a_snrcut,)
 
 
 @app.cell
-def _(a_snrcut):
+def _(a_snrcut, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a_snrcut.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()  # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a_snrcut)
     return (elines,)
 
 
@@ -119,20 +112,23 @@ def _(mo):
 
 
 @app.cell
-def _(a_snrcut, elines, multline, plt, tightx):
-    # Get sorted list of unique sites from the baseline column
-    sites = sorted(set().union(*set(a_snrcut.baseline)))
+def _(a_snrcut, elines, figpool, multline, plt, qakernels, tightx):
+    # Split the rows by site (all baselines to the site) in one pass
+    site_rows = qakernels.site_frames(a_snrcut)
+    sites = list(site_rows)
     snr_split = 50
     # Define cutoffs for SNR and outliers
     outliers_coh = 0.8
     outliers_snr = 20
 
-    outputs = []
-    for site in sites:
+    def _site_outliers(df_site):
+        return df_site[(df_site.coh < outliers_coh) & (df_site.snr > outliers_snr)]
+
+    def _cohplot(site):
         fig = plt.figure(figsize=(12, 4))  # Create new figure for each site
-    
-        df_site = a_snrcut[a_snrcut.baseline.str.contains(site)]
-        for (bl, rows) in df_site.groupby('baseline'):
+
+        df_site = site_rows[site]
+        for (bl, rows) in df_site.groupby('baseline', observed=True):
             lo_mask = rows.snr < snr_split
             hi_mask = rows.snr >= snr_split
             bl = bl if bl[1] == site else bl[::-1]  # Reverse the baseline if the second character is not the site
@@ -144,14 +140,21 @@ def _(a_snrcut, elines, multline, plt, tightx):
         _ = plt.xlim(0, plt.xlim()[1] * 1.1)
         _ = plt.grid(axis='y', alpha=0.25)
         _ = plt.legend(loc='best')
-        outliers = df_site[(df_site.coh < outliers_coh) & (df_site.snr > outliers_snr)]
+        outliers = _site_outliers(df_site)
         if len(outliers) > 0:
             _ = plt.plot(outliers.scan_no, outliers.coh, 'ko', ms=8, mfc='none', mew=2, zorder=-100)
-    
+
+        return fig
+
+    # render the per-site figures in parallel
+    figures = figpool.render(_cohplot, sites, skip_none=False)
+
+    outputs = []
+    for (site, fig) in zip(sites, figures):
         outputs.append(fig)
-        plt.close(fig)
-    
+
         # Add outliers table right after the figure
+        outliers = _site_outliers(site_rows[site])
         if len(outliers) > 0:
             outputs.append(outliers[['expt_no', 'scan_id', 'source', 'baseline', 'snr', 'coh']])
 
@@ -176,29 +179,19 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import alistschema
+    import qakernels
+    from qakernels import multline, tightx, wide
+    import figpool
     import matplotlib.pyplot as plt
     import os
     import sys
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, os, plt, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return multline, tightx, wide
+    return alistio, alistschema, figpool, multline, os, plt, qakernels, tightx, util, wide
 
 
 if __name__ == "__main__":
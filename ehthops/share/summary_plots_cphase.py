@@ -19,19 +19,19 @@ def _(mo):
 
 
 @app.cell
-def _(hops, hu, os, pd, util):
+def _(alistio, alistschema, hu, os, pd, util):
     # Define variables and load data
     alistf = 'alist.v6'
     alistfll = 'alist.v6.8s.LL.close.avg'
     alistfrr = 'alist.v6.8s.RR.close.avg'
     datadir = os.environ['DATADIR']
 
-    a = hops.read_alist(os.path.join(datadir, alistf)) # alist file to make scan_no
+    a = alistio.read_alist(datadir, alistf) # alist file to make scan_no
 
-    ll = hops.read_tlist_v6(os.path.join(datadir, alistfll))
+    ll = alistio.read_tlist(datadir, alistfll)
     ll['polarization'] = 'LL'
 
-    rr = hops.read_tlist_v6(os.path.join(datadir, alistfrr))
+    rr = alistio.read_tlist(datadir, alistfrr)
     rr['polarization'] = 'RR'
 
     # Concat the two dataframes and pre-process them
@@ -39,6 +39,9 @@ def _(hops, hu, os, pd, util):
     util.add_gmst(df_close)
     hu.setparity(df_close)
     util.fix(df_close)
+
+    # Categorical string columns, compact numeric types and station bitmasks
+    df_close = alistschema.compact(df_close)
     return a, df_close
 
 
@@ -52,11 +55,9 @@ def _(a, df_close, util):
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max() # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy() # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a)
     return (elines,)
 
 
@@ -97,14 +98,14 @@ def _(mo):
 
 
 @app.cell
-def _(clplot2, df_close_scanno, sns):
+def _(clplot2, df_close_scanno, figpool, sns):
     triangles = sorted((t for t in set(df_close_scanno.triangle) if 'R' not in t))
     triangles = [t for t in triangles if not ('X' in t or 'J' in t)]
 
     sns.set_palette(sns.color_palette(sns.hls_palette(len(triangles), l=0.6, s=0.6)))
 
-    figures = [fig3 for src in sorted(set(df_close_scanno.source)) 
-               if (fig3 := clplot2(df_close_scanno, source=src, triangles=triangles)) is not None]
+    # render one figure per source in parallel
+    figures = figpool.render(clplot2, [(df_close_scanno, src, triangles) for src in sorted(set(df_close_scanno.source))])
     figures
     return
 
@@ -118,20 +119,19 @@ def _(mo):
 
 
 @app.cell
-def _(clplot2, df_close_scanno):
+def _(clplot2, df_close_scanno, figpool):
     triangles2 = sorted((t for t in set(df_close_scanno.triangle) if 'R' not in t))
     triangles2 = [t for t in triangles2 if not ('X' in t or 'J' in t)]
     sources = ['SGRA', 'M87', '3C279', 'OJ287']
 
-    figures2 = []
-    for src2 in sorted(set(sources)):
-        for expt_no in sorted(set(df_close_scanno.expt_no)):
-            fig4 = clplot2(df_close_scanno[df_close_scanno.expt_no == expt_no], source=src2, triangles=triangles2)
-            if fig4 is None:
-                continue
+    def _clplot2_expt(src2, expt_no):
+        fig4 = clplot2(df_close_scanno[df_close_scanno.expt_no == expt_no], source=src2, triangles=triangles2)
+        if fig4 is not None:
             fig4.axes[0].set_title(str(expt_no) + ' - ' + src2 + ' closure phases')
-            figures2.append(fig4)
+        return fig4
 
+    # render one figure per source and track in parallel
+    figures2 = figpool.render(_clplot2_expt, [(src2, expt_no) for src2 in sorted(set(sources)) for expt_no in sorted(set(df_close_scanno.expt_no))])
     figures2
     return
 
@@ -153,7 +153,12 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import alistschema
+    import qakernels
+    from qakernels import wide
+    import figpool
     from eat.hops import util as hu
     from eat.plots import util as pu
     import matplotlib.pyplot as plt
@@ -163,22 +168,7 @@ def _():
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, hu, np, os, pd, plt, pu, sns, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return (wide,)
+    return alistio, alistschema, figpool, hu, np, os, pd, plt, pu, qakernels, sns, util, wide
 
 
 @app.cell(hide_code=True)
@@ -190,13 +180,13 @@ def _(mo):
 
 
 @app.cell
-def _(elines, np, plt, pu, wide):
+def _(elines, np, plt, pu, qakernels, wide):
     def clplot(df_close, triangles, threshold=3):
         wide(12, 5)
-        df = df_close[(df_close.bis_snr > threshold) & ~df_close.triangle.str.contains('R') & (df_close.duration > 8 * 5)]
+        df = qakernels.cphase_cut(df_close, threshold)
+        rows = qakernels.triangle_groups(df, triangles)
         for tri in triangles:
-            rr = df[(df.polarization == 'RR') & (df.triangle == tri)]
-            ll = df[(df.polarization == 'LL') & (df.triangle == tri)]
+            (rr, ll) = (rows[(tri, 'RR')], rows[(tri, 'LL')])
             hl = plt.errorbar(ll.scan_no - 0.025, ll.bis_phas, yerr=1.0 / ll.bis_snr * 180.0 / np.pi, fmt='o', label=tri)
             _ = plt.errorbar(rr.scan_no + 0.025, rr.bis_phas, yerr=1.0 / rr.bis_snr * 180.0 / np.pi, fmt='x', label='_nolegend_', color=hl[0].get_color())
         plt.gca().yaxis.grid(alpha=0.25)
@@ -210,10 +200,11 @@ def _(elines, np, plt, pu, wide):
 
 
 @app.cell
-def _(np, plt):
+def _(np, plt, qakernels):
     def clplot2(df_close, source, triangles, threshold=3):
         fig = plt.figure(figsize=(12, 5))
-        df = df_close[(df_close.bis_snr > threshold) & ~df_close.triangle.str.contains('R') & (df_close.duration > 8 * 5) & (df_close.source == source) & df_close.triangle.isin(set(triangles))].copy()
+        df = qakernels.cphase_cut(df_close, threshold)
+        df = df[(df.source == source) & df.triangle.isin(set(triangles))].copy()
         t = np.hstack((df.gmst.sort_values().values, df.gmst.sort_values().values + 24.0))
         if len(t) == 0:
             plt.close(fig)
@@ -221,9 +212,9 @@ def _(np, plt):
         idx = np.argmax(np.diff(t))
         toff = np.fmod(48.0 - 0.5 * (t[idx] + t[1 + idx]), 24.0)
         df.gmst = np.fmod(df.gmst + toff, 24.0) - toff
+        rows = qakernels.triangle_groups(df, triangles)
         for tri in triangles:
-            rr = df[(df.polarization == 'RR') & (df.triangle == tri)]
-            ll = df[(df.polarization == 'LL') & (df.triangle == tri)]
+            (rr, ll) = (rows[(tri, 'RR')], rows[(tri, 'LL')])
             if len(ll) > 0:
                 (llabel, rlabel) = (tri, '_nolegend_')
             elif len(rr) > 0:
@@ -17,12 +17,12 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, os, util):
     # define and load data
     alistf = "alist.v6"
     datadir = os.environ['DATADIR']
 
-    a = util.noauto(hops.read_alist(os.path.join(datadir, alistf)))
+    a = util.noauto(alistio.read_alist(datadir, alistf))
 
     # Pre-process alist dataframe
     util.fix(a)
@@ -31,23 +31,21 @@ def _(hops, os, util):
     util.add_delayerr(a)
     util.add_path(a)
     util.add_scanno(a)
-    return (a,)
+    return a, datadir
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # data filters -- remove SMAR-SMAW baselines (only applicable to EHT2017 data)
     thres = 7.0
-    a_filtered = a[(a.snr > thres) & ~a.baseline.isin({'RS', 'SR'})].copy()
-    return (a_filtered,)
+    a_filtered = qakernels.snr_cut(a, thres, drop_baselines={'RS', 'SR'}).copy()
+    return a_filtered, thres
 
 
 @app.cell
-def _(a_filtered):
+def _(a_filtered, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a_filtered.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()  # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a_filtered)
     return (elines,)
 
 
@@ -72,6 +70,30 @@ def _(a_filtered, elines, hu, plt, sites, wide):
     return
 
 
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Detections across bands
+
+    Fraction of the scan-averaged records above the SNR threshold per baseline in every band of this stage, read from the campaign alist dataset (`SET_ALISTDATASET`). A baseline detected in some bands only points at a band-specific problem. The dataset is exported at the end of a pipeline run, so the bands are shown as of their last export.
+    """)
+    return
+
+
+@app.cell
+def _(alistio, datadir, mo, os, thres):
+    # hops-b<n>/<stage>/data: stage as partitioned in the dataset (see alistdataset.py)
+    _stage = os.path.basename(os.path.dirname(os.path.abspath(datadir)))
+    _dataset = os.environ.get('ALISTDATASET', '')
+    if _dataset and os.path.isdir(_dataset):
+        _x = alistio.query_dataset(_dataset, columns=['baseline', 'snr'], stage=_stage, resolution='scan')
+        _out = _x.assign(det=_x.snr > thres).pivot_table(index='baseline', columns='band', values='det', aggfunc='mean').round(2)
+    else:
+        _out = mo.md("No campaign alist dataset (`ALISTDATASET` not set or not exported yet).")
+    _out
+    return
+
+
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
@@ -89,7 +111,10 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import qakernels
+    from qakernels import wide
     from eat.hops import util as hu
     from eat.plots import util as pu
     import matplotlib.pyplot as plt
@@ -99,22 +124,7 @@ def _():
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, hu, os, plt, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return (wide,)
+    return alistio, hu, os, plt, qakernels, util, wide
 
 
 if __name__ == "__main__":
@@ -17,12 +17,12 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, alistschema, os, util):
     # define and load data
     alistf = 'alist.v6'
     datadir = os.environ['DATADIR']
 
-    a = util.noauto(hops.read_alist(os.path.join(datadir, alistf)))
+    a = util.noauto(alistio.read_alist(datadir, alistf))
 
     # Pre-process the alist dataframe
     util.fix(a)
@@ -33,24 +33,25 @@ def _(hops, os, util):
     util.add_scanno(a)
     util.add_gmst(a)
 
+    # Categorical string columns, compact numeric types and station bitmasks
+    a = alistschema.compact(a)
+
     days = sorted(set(a.expt_no))
     return a, days
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # data filters
     snr_cutoff = 7  # reasonable SNR cutoff for filtering
-    a_snrcut = a[(a.snr > snr_cutoff) & ~a.baseline.str.contains('R')]
+    a_snrcut = qakernels.snr_cut(a, snr_cutoff, drop_sites='R')
     return (a_snrcut,)
 
 
 @app.cell
-def _(a_snrcut):
+def _(a_snrcut, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a_snrcut.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()  # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a_snrcut)
     return
 
 
@@ -65,30 +66,9 @@ def _(mo):
 
 
 @app.cell
-def _(a_snrcut, np, pd):
-    index_cols = 'expt_no scan_no gmst timetag baseline source u v'.split()
-
-    circ_pols = {'LL', 'LR', 'RL', 'RR'}
-    mixed_pols  = {'XL', 'XR', 'YL', 'YR'}
-
-    a_circ = a_snrcut[a_snrcut.polarization.isin(circ_pols)]
-    a_mixed = a_snrcut[a_snrcut.polarization.isin(mixed_pols)]
-
-    frames = []
-
-    if not a_circ.empty:
-        p_circ = a_circ.pivot_table(aggfunc='first', index=index_cols, columns=['polarization'], values=['snr']).dropna()
-        p_circ['fpol'] = np.sqrt(p_circ.snr.LR * p_circ.snr.RL / (p_circ.snr.LL * p_circ.snr.RR))
-        p_circ['fpol_err'] = np.sqrt(2.0 / (p_circ.snr.LL * p_circ.snr.RR))
-        frames.append(p_circ)
-
-    if not a_mixed.empty:
-        p_mixed = a_mixed.pivot_table(aggfunc='first', index=index_cols, columns=['polarization'], values=['snr']).dropna()
-        p_mixed['fpol'] = np.sqrt(p_mixed.snr.XR * p_mixed.snr.YL / (p_mixed.snr.XL * p_mixed.snr.YR))
-        p_mixed['fpol_err'] = np.sqrt(2.0 / (p_mixed.snr.XL * p_mixed.snr.YR))
-        frames.append(p_mixed)
-
-    q = pd.concat(frames).reset_index() if frames else pd.DataFrame()
+def _(a_snrcut, qakernels):
+    # snr_LL, snr_LR, ... of every row identified by index_cols (circular and mixedpol) with fpol and fpol_err
+    q = qakernels.polfrac(a_snrcut, index_cols='expt_no scan_no gmst timetag baseline source u v'.split())
     return (q,)
 
 
@@ -105,16 +85,15 @@ def _(mo):
 
 
 @app.cell
-def _(pftrend, pfuv, plt, q):
+def _(figpool, pftrend, pfuv, q):
+    def _pfplots(src):
+        return (pftrend(q, src), pfuv(q, src, 'jet'))
+
+    # render the figures of all sources in parallel
     figures_all = []
-    for src in sorted(set(q.source)):
-        fig1 = pftrend(q, src)
+    for (fig1, fig2) in figpool.render(_pfplots, sorted(set(q.source))):
         figures_all.append(fig1)
-        plt.close(fig1)  # Close after adding to list
-
-        fig2 = pfuv(q, src, 'jet')
         figures_all.append(fig2)
-        plt.close(fig2)  # Close after adding to list
 
     figures_all
     return
@@ -138,7 +117,11 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import alistschema
+    import qakernels
+    import figpool
     from eat.hops import util as hu
     from eat.plots import util as pu
     import itertools
@@ -150,23 +133,7 @@ def _():
     from matplotlib.legend import Legend
 
     sns.reset_orig()
-    return Legend, hops, itertools, np, os, pd, plt, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-
-    return
+    return Legend, alistio, alistschema, figpool, itertools, np, os, pd, plt, qakernels, util
 
 
 @app.cell(hide_code=True)
@@ -199,7 +166,7 @@ def _(Legend, days, itertools, np, plt):
                 (lax, lnum) = (ax, len(dayrows))
             if i > 0:
                 _ = plt.setp(ax.get_yticklabels(), visible=False)
-            for (bl, blrows) in dayrows.groupby('baseline'):
+            for (bl, blrows) in dayrows.groupby('baseline', observed=True):
                 h = plt.errorbar(blrows.gmst, blrows.fpol, blrows.fpol_err, fmt='.', color=blc[bl], label='_nolegend_')
                 _ = plt.plot(blrows.gmst, blrows.fpol, '-', color=h[0].get_color(), alpha=0.25, label='_nolegend_')
             ax.grid(axis='y', alpha=0.25)
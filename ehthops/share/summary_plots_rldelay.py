@@ -17,12 +17,12 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, alistschema, os, util):
     # define and load data
     alistf = 'alist.v6'
     datadir = os.environ['DATADIR']
 
-    a = util.noauto(hops.read_alist(os.path.join(datadir, alistf)))
+    a = util.noauto(alistio.read_alist(datadir, alistf))
 
     # Pre-process alist dataframe
     util.fix(a)
@@ -31,60 +31,74 @@ def _(hops, os, util):
     util.add_delayerr(a)
     util.add_path(a)
     util.add_scanno(a)
+
+    # Categorical string columns, compact numeric types and station bitmasks
+    a = alistschema.compact(a)
     return (a,)
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # data filters -- remove SMAR-SMAW baselines (only applicable to EHT2017 data)
     thres = 7.0
-    a_snrcut = a[(a.snr > thres) & ~a.baseline.isin({'RS', 'SR'})].copy()
+    a_snrcut = qakernels.snr_cut(a, thres, drop_baselines={'RS', 'SR'}).copy()
     return (a_snrcut,)
 
 
 @app.cell
-def _(a_snrcut):
+def _(a_snrcut, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a_snrcut.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()  # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a_snrcut)
     return (elines,)
 
 
 @app.cell
-def _(a_snrcut, elines, hu, multline, np, plt):
-    # Get sorted list of unique sites from the baseline column
-    sites = sorted(set().union(*set(a_snrcut.baseline)))
-    lroffset_thres = 0.0002
+def _(a_snrcut, hu, qakernels):
+    # R-L delay fits of all sites from one grouped pass over the alist, computed in parallel
+    (p_rl, stats_rl, errors_rl) = qakernels.rl_segmented_per_site(a_snrcut, restarts=hu.restarts)
     # Define cutoffs
+    lroffset_thres = 0.0002
     lrstd_thres = 5.0
+    p_rl['outlier'] = qakernels.rl_outliers(p_rl, lroffset_thres, lrstd_thres)
+    return errors_rl, p_rl
 
+
+@app.cell
+def _(elines, errors_rl, figpool, hu, multline, p_rl, plt):
+    # Get sorted list of unique sites from the baseline column
+    sites = sorted(set(p_rl.site) | set(errors_rl))
+    p_site = dict(tuple(p_rl.groupby('site', sort=False)))
+
+    def _rlplot(site):
+        if site in errors_rl:
+            return (None, f'Error processing site {site}: {errors_rl[site]}\nMoving on to next site...')
+
+        p = p_site[site].drop(columns=['site', 'outlier'])
+        outliers = p_site[site].outlier
+        fig = plt.figure(figsize=(12, 5))  # Create new figure
+        hu.rlplot(p, corrected=True)
+        multline(elines)
+        if len(outliers) > 0:
+            _ = plt.plot(p[outliers].scan_no, 1000.0 * p[outliers].LR_offset_wrap, 'ko', ms=8, mfc='none', mew=2, zorder=-100)
+        _ = plt.title('R-L delay after subtracting mean value [%.0f MHz]' % p.iloc[0].ref_freq)
+        _ = plt.xlim(0, 1.05 * plt.xlim()[1])
+
+        outlier_data = p.loc[outliers, ['expt_no', 'scan_id', 'source', 'timetag', 'baseline', 'ref_pol', 'mbd_unwrap', 'LR_offset', 'LR_offset_wrap']]
+        return (fig, outlier_data)
+
+    # the figures of each site are drawn in parallel
     outputs_rl = []
-    for site in sites:
-        try:
-            (p, stats) = hu.rl_segmented(a_snrcut, site, restarts=hu.restarts)
-        
-            fig = plt.figure(figsize=(12, 5))  # Create new figure
-            hu.rlplot(p, corrected=True)
-            multline(elines)
-            outliers = (np.abs(p.LR_offset) > lroffset_thres) & (np.abs(p.LR_std) > lrstd_thres) & ~(p.baseline.str.contains('L') & (np.abs(np.abs(p.LR_offset) - 0.00145) < lroffset_thres))
-            if len(outliers) > 0:
-                _ = plt.plot(p[outliers].scan_no, 1000.0 * p[outliers].LR_offset_wrap, 'ko', ms=8, mfc='none', mew=2, zorder=-100)
-            _ = plt.title('R-L delay after subtracting mean value [%.0f MHz]' % p.iloc[0].ref_freq)
-            _ = plt.xlim(0, 1.05 * plt.xlim()[1])
-        
-            outputs_rl.append(fig)
-            plt.close(fig)
-        
-            # Add outliers table right after the figure
-            outlier_data = p.loc[outliers, ['expt_no', 'scan_id', 'source', 'timetag', 'baseline', 'ref_pol', 'mbd_unwrap', 'LR_offset', 'LR_offset_wrap']]
-            if len(outlier_data) > 0:
-                outputs_rl.append(outlier_data)
-            
-        except Exception as e:
-            outputs_rl.append(f'Error processing site {site}: {e}\nMoving on to next site...')
+    for (fig, outlier_data) in figpool.render(_rlplot, sites):
+        if fig is None:
+            outputs_rl.append(outlier_data)
             continue
 
+        outputs_rl.append(fig)
+
+        # Add outliers table right after the figure
+        if len(outlier_data) > 0:
+            outputs_rl.append(outlier_data)
+
     outputs_rl
     return
 
@@ -106,7 +120,12 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import alistschema
+    from qakernels import multline
+    import figpool
+    import qakernels
     from eat.hops import util as hu
     from eat.plots import util as pu
     import matplotlib.pyplot as plt
@@ -116,22 +135,7 @@ def _():
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, hu, np, os, plt, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return (multline,)
+    return alistio, alistschema, figpool, hu, multline, os, plt, qakernels, util
 
 
 if __name__ == "__main__":
@@ -17,12 +17,12 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, os, util):
     # define and load data
     alistf = 'alist.v6'
     datadir = os.environ['DATADIR']
 
-    a = util.noauto(hops.read_alist(os.path.join(datadir, alistf)))
+    a = util.noauto(alistio.read_alist(datadir, alistf))
 
     # Pre-process alist dataframe
     util.fix(a)
@@ -43,21 +43,19 @@ def _(mo):
 
 
 @app.cell
-def _(a):
+def _(a, qakernels):
     # data filters -- remove SMAR-SMAW baselines (only applicable to EHT2017 data)
     thres = 7.0
-    a_snrcut = a[(a.snr > thres) & ~a.baseline.isin({'RS', 'SR'})].copy()
+    a_snrcut = qakernels.snr_cut(a, thres, drop_baselines={'RS', 'SR'}).copy()
     # Relabel polarizations if mixedpol visibilities are present
-    a_snrcut['polarization'] = a_snrcut.polarization.replace({'XL': 'LL', 'YL': 'LL', 'XR': 'RR', 'YR': 'RR'})
+    a_snrcut['polarization'] = qakernels.relabel(a_snrcut.polarization, qakernels.MIXED_TO_PARALLEL)
     return (a_snrcut,)
 
 
 @app.cell
-def _(a_snrcut):
+def _(a_snrcut, qakernels):
     # Compute the boundaries between expt_nos
-    sorted_a = a_snrcut.sort_values(['expt_no', 'scan_no'])
-    last_scans = sorted_a.groupby('expt_no')['scan_no'].max()  # Find the 'max' scan_no for each expt_no
-    elines = (last_scans.iloc[:-1] + 0.5).to_numpy()  # Drop the final expt_no and offset by 0.5
+    elines = qakernels.expt_boundaries(a_snrcut)
     return (elines,)
 
 
@@ -184,7 +182,10 @@ def _():
 @app.cell
 def _():
     import pandas as pd
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import qakernels
+    from qakernels import wide
     from eat.hops import util as hu
     from eat.plots import util as pu
     import matplotlib.pyplot as plt
@@ -195,22 +196,7 @@ def _():
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, hu, norm, np, os, plt, pu, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return (wide,)
+    return alistio, hu, norm, np, os, plt, pu, qakernels, util, wide
 
 
 if __name__ == "__main__":
@@ -17,13 +17,13 @@ def _(mo):
 
 
 @app.cell
-def _(hops, os, util):
+def _(alistio, os, util):
     # define and load data
 
     alistf = 'alist.v6'
     datadir = os.environ['DATADIR']
 
-    a = util.noauto(hops.read_alist(os.path.join(datadir, alistf)))
+    a = util.noauto(alistio.read_alist(datadir, alistf))
 
     # Pre-process the alist dataframe
     util.unwrap_mbd(a)
@@ -51,13 +51,13 @@ def _(a, util):
 
 
 @app.cell
-def _(a, hu, plt):
-    figures_uv = []
-    for src in sorted(set(a.source)):
+def _(a, figpool, hu, plt):
+    def _uvplot(src):
         hu.uvplot(a, src)
-        fig = plt.gcf()
-        figures_uv.append(fig)
-        plt.close(fig)
+        return plt.gcf()
+
+    # render one figure per source in parallel
+    figures_uv = figpool.render(_uvplot, sorted(set(a.source)))
 
     figures_uv
     return
@@ -79,7 +79,9 @@ def _():
 
 @app.cell
 def _():
-    from eat.io import hops, util
+    from eat.io import util
+    import alistio
+    import figpool
     from eat.hops import util as hu
     import matplotlib.pyplot as plt
     import os
@@ -87,22 +89,7 @@ def _():
     import seaborn as sns
 
     sns.reset_orig()
-    return hops, hu, os, plt, util
-
-
-@app.cell
-def _(plt):
-    def wide(w=8, h=3): plt.setp(plt.gcf(), figwidth=w, figheight=h); \
-        plt.tight_layout()
-
-    def tightx(): plt.autoscale(enable=True, axis='x', tight=True)
-
-    def multline(xs, fun=plt.axvline):
-        for x in xs: fun(x, alpha=0.25, ls='--', color='k')
-
-    def toiter(x):
-        return(x if hasattr(x, '__iter__') else [x,])
-    return
+    return alistio, figpool, hu, os, plt, util
 
 
 if __name__ == "__main__":